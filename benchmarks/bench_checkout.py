@@ -0,0 +1,46 @@
+"""
+Оформление заказа (POST /api/v1/orders/): заказов/сек и задержка для корзин из 1, 50 и 500 позиций.
+
+    python -m benchmarks.bench_checkout --rows 100000 --keepdb
+"""
+import random
+
+from benchmarks.utils import setup_django, get_parser, benchmark_database, seed_products, measure, report
+
+CART_SIZES = (1, 50, 500)
+
+
+def main():
+    args = get_parser(__doc__, rows=100000).parse_args()
+    setup_django()
+
+    from django.contrib.auth import get_user_model
+    from rest_framework.test import APIRequestFactory, force_authenticate
+
+    from marketplace.models import Product
+    from marketplace.views import OrderViewSet
+
+    view = OrderViewSet.as_view({'post': 'create'})
+    factory = APIRequestFactory()
+
+    with benchmark_database(keepdb=args.keepdb) as connection:
+        seed_products(connection, args.rows)
+        user, _ = get_user_model().objects.get_or_create(username='bench-customer')
+        product_ids = list(Product.objects.values_list('id', flat=True)[:10000])
+        print(f'products: {args.rows}, repeat: {args.repeat}')
+
+        for size in CART_SIZES:
+            def checkout():
+                positions = [{'product_id': pk, 'quantity': 1} for pk in random.sample(product_ids, size)]
+                request = factory.post('/api/v1/orders/', {'positions': positions}, format='json')
+                force_authenticate(request, user)
+                response = view(request)
+                assert response.status_code == 201, response.data
+                response.render()
+
+            checkout()  # прогрев
+            report(f'checkout: {size} positions', measure(checkout, args.repeat), items=1)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,62 @@
+"""
+Фильтр заказов по товарам позиций (/api/v1/orders/?product=...): один товар, любой из нескольких
+и все из нескольких (product_match=all) в сравнении с прежним JOIN по positions__product__id.
+
+    python -m benchmarks.bench_order_product_filter --rows 10000000 --keepdb
+"""
+import random
+
+from benchmarks.utils import setup_django, get_parser, benchmark_database, seed_products, seed_orders, \
+    measure, report
+
+
+def main():
+    parser = get_parser(__doc__, rows=10000000)
+    parser.add_argument('--products', type=int, default=100000, help='Количество товаров.')
+    args = parser.parse_args()
+    setup_django()
+
+    from marketplace.filters import OrderFilter
+    from marketplace.models import Order, OrderProduct
+
+    with benchmark_database(keepdb=args.keepdb) as connection:
+        seed_products(connection, args.products)
+        seed_orders(connection, args.rows)
+        print(f'positions: {args.rows}, products: {args.products}, repeat: {args.repeat}')
+
+        sample = list(OrderProduct.objects.order_by('?').values_list('order_id', 'product_id')[:args.repeat * 3])
+
+        def first_page(queryset):
+            # Первая страница списка заказов, как её выбирает KeysetPagination
+            return list(queryset.order_by('created_at', 'id')[:21])
+
+        def scenario(build_params):
+            def run():
+                filterset = OrderFilter(build_params(), queryset=Order.objects.all())
+                assert filterset.is_valid(), filterset.errors
+                first_page(filterset.qs)
+            return run
+
+        def single():
+            return {'product': str(random.choice(sample)[1])}
+
+        def any_of():
+            return {'product': ','.join(str(product_id) for _, product_id in random.sample(sample, 3))}
+
+        def all_of():
+            # Товары одного заказа, чтобы результат был непустым
+            order_id = random.choice(sample)[0]
+            products = OrderProduct.objects.filter(order=order_id).values_list('product_id', flat=True)[:2]
+            return {'product': ','.join(map(str, products)), 'product_match': 'all'}
+
+        def join_single():
+            first_page(Order.objects.filter(positions__product__id=random.choice(sample)[1]))
+
+        report('JOIN positions__product__id (previous)', measure(join_single, args.repeat))
+        report('EXISTS: product=<id>', measure(scenario(single), args.repeat))
+        report('EXISTS: product=<id>,<id>,<id>', measure(scenario(any_of), args.repeat))
+        report('EXISTS: product=<id>,<id>&product_match=all', measure(scenario(all_of), args.repeat))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,71 @@
+"""
+Пропускная способность загрузки товаров (строк/сек): по одному POST на товар и одним запросом
+к /api/v1/products/bulk/ (создание и обновление, JSON и NDJSON).
+
+    python -m benchmarks.bench_product_bulk --rows 10000 --keepdb
+"""
+import json
+
+from benchmarks.utils import setup_django, get_parser, benchmark_database, measure, report
+
+
+def main():
+    parser = get_parser(__doc__, rows=10000)
+    parser.add_argument('--single-rows', type=int, default=500, help='Количество товаров для поштучной загрузки.')
+    args = parser.parse_args()
+    setup_django()
+
+    from django.contrib.auth import get_user_model
+    from rest_framework.test import APIRequestFactory, force_authenticate
+
+    from marketplace.models import Product
+    from marketplace.views import ProductViewSet
+
+    create_view = ProductViewSet.as_view({'post': 'create'})
+    bulk_view = ProductViewSet.as_view({'post': 'bulk'}, **ProductViewSet.bulk.kwargs)
+    factory = APIRequestFactory()
+    repeat = max(1, args.repeat // 4)
+
+    with benchmark_database(keepdb=args.keepdb):
+        admin, _ = get_user_model().objects.get_or_create(
+            username='bench-admin', defaults={'is_staff': True, 'is_superuser': True}
+        )
+        rows = [
+            {'title': f'товар {i}', 'description': f'описание товара {i}', 'price': i % 100000}
+            for i in range(args.rows)
+        ]
+        print(f'rows: {args.rows}, repeat: {repeat}')
+
+        def post(view, data, **kwargs):
+            request = factory.post('/api/v1/products/bulk/', data, **kwargs)
+            force_authenticate(request, admin)
+            response = view(request)
+            assert response.status_code in (200, 201), response.data
+            return response
+
+        def create_single():
+            for row in rows[:args.single_rows]:
+                post(create_view, row, format='json')
+
+        def create_bulk():
+            post(bulk_view, rows, format='json')
+
+        def create_bulk_ndjson():
+            body = '\n'.join(json.dumps(row) for row in rows)
+            post(bulk_view, body, content_type='application/x-ndjson')
+
+        report('create: one POST per product', measure(create_single, repeat), items=args.single_rows)
+        report('create: bulk JSON', measure(create_bulk, repeat), items=args.rows)
+        report('create: bulk NDJSON', measure(create_bulk_ndjson, repeat), items=args.rows)
+
+        ids = list(Product.objects.order_by('-id').values_list('id', flat=True)[:args.rows])
+        updates = [{'id': pk, 'price': (pk * 7) % 100000} for pk in ids]
+
+        def update_bulk():
+            post(bulk_view, updates, format='json')
+
+        report('update price: bulk JSON', measure(update_bulk, repeat), items=len(updates))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,47 @@
+"""
+Сравнение полнотекстового поиска товаров (ProductSearchFilter) с прежним SearchFilter (ILIKE '%term%').
+
+    python -m benchmarks.bench_product_search --rows 1000000 --keepdb
+"""
+from benchmarks.utils import setup_django, get_parser, benchmark_database, seed_products, measure, report
+
+TERMS = ('смартфон', 'кружки', 'wireless charger', 'палатка pro', 'keyboards')
+
+
+def main():
+    args = get_parser(__doc__, rows=1000000).parse_args()
+    setup_django()
+
+    from django_filters.rest_framework import DjangoFilterBackend
+    from rest_framework.filters import SearchFilter
+    from rest_framework.test import APIRequestFactory
+
+    from marketplace.views import ProductViewSet
+
+    class SearchFilterProductViewSet(ProductViewSet):
+        filter_backends = [DjangoFilterBackend, SearchFilter]
+        search_fields = ['title', 'description']
+
+    variants = (
+        ('SearchFilter (ILIKE)', SearchFilterProductViewSet.as_view({'get': 'list'})),
+        ('ProductSearchFilter (tsvector + GIN)', ProductViewSet.as_view({'get': 'list'})),
+    )
+    factory = APIRequestFactory()
+
+    with benchmark_database(keepdb=args.keepdb) as connection:
+        seed_products(connection, args.rows)
+        print(f'products: {args.rows}, repeat: {args.repeat}')
+
+        for term in TERMS:
+            for label, view in variants:
+                def search():
+                    response = view(factory.get('/api/v1/products/', {'search': term}))
+                    assert response.status_code == 200, response.data
+                    response.render()
+
+                search()  # прогрев
+                report(f'{label}: {term!r}', measure(search, args.repeat))
+
+
+if __name__ == '__main__':
+    main()
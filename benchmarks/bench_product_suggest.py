@@ -0,0 +1,43 @@
+"""
+Задержка подсказок по названиям товаров (/api/v1/products/suggest/) без кеша и с кешем.
+
+    python -m benchmarks.bench_product_suggest --rows 1000000 --keepdb
+"""
+from benchmarks.utils import setup_django, get_parser, benchmark_database, seed_products, measure, report
+
+PREFIXES = ('смар', 'смартфан', 'кружк', 'wirel', 'keybord', 'палатка про')
+
+
+def main():
+    args = get_parser(__doc__, rows=1000000).parse_args()
+    setup_django()
+
+    from rest_framework.test import APIRequestFactory
+
+    from marketplace.cache import bump_version
+    from marketplace.views import ProductViewSet
+
+    view = ProductViewSet.as_view({'get': 'suggest'})
+    factory = APIRequestFactory()
+
+    with benchmark_database(keepdb=args.keepdb) as connection:
+        seed_products(connection, args.rows)
+        print(f'products: {args.rows}, repeat: {args.repeat}')
+
+        for prefix in PREFIXES:
+            def suggest():
+                response = view(factory.get('/api/v1/products/suggest/', {'q': prefix}))
+                assert response.status_code == 200, response.data
+                response.render()
+
+            def suggest_uncached():
+                bump_version('product')
+                suggest()
+
+            suggest_uncached()  # прогрев
+            report(f'uncached: {prefix!r}', measure(suggest_uncached, args.repeat))
+            report(f'cached: {prefix!r}', measure(suggest, args.repeat))
+
+
+if __name__ == '__main__':
+    main()
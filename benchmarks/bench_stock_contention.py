@@ -0,0 +1,76 @@
+"""
+Конкурентное оформление заказов с общим «горячим» товаром: задержка оформления и проверка,
+что остаток не уходит в минус, а продано ровно столько, сколько списано.
+
+    python -m benchmarks.bench_stock_contention --rows 10000 --threads 16 --keepdb
+
+Остатка горячего товара хватает на половину заказов, остальные должны получить 400.
+"""
+import random
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+from benchmarks.utils import setup_django, get_parser, benchmark_database, seed_products, report
+
+CART_SIZE = 5
+
+
+def main():
+    parser = get_parser(__doc__, rows=10000)
+    parser.add_argument('--threads', type=int, default=16, help='Количество параллельных покупателей.')
+    args = parser.parse_args()
+    setup_django()
+
+    from django.contrib.auth import get_user_model
+    from django.db import connection as thread_connection
+    from rest_framework.test import APIRequestFactory, force_authenticate
+
+    from marketplace.models import OrderProduct, Product
+    from marketplace.views import OrderViewSet
+
+    view = OrderViewSet.as_view({'post': 'create'})
+    factory = APIRequestFactory()
+
+    with benchmark_database(keepdb=args.keepdb) as connection:
+        seed_products(connection, args.rows)
+        user, _ = get_user_model().objects.get_or_create(username='bench-customer')
+        product_ids = list(Product.objects.values_list('id', flat=True)[:10000])
+        hot = product_ids.pop()
+        checkouts = args.threads * args.repeat
+        initial = checkouts // 2
+        Product.objects.filter(pk=hot).update(stock=initial)
+        Product.objects.filter(pk__in=product_ids).update(stock=checkouts)
+        sold_before = sum(OrderProduct.objects.filter(product_id=hot).values_list('quantity', flat=True))
+        print(f'products: {args.rows}, threads: {args.threads}, checkouts: {checkouts}, hot stock: {initial}')
+
+        def checkout(_):
+            # Горячий товар стоит в корзине на случайном месте, чтобы порядок позиций у заказов различался.
+            positions = [{'product_id': pk, 'quantity': 1} for pk in random.sample(product_ids, CART_SIZE - 1)]
+            positions.insert(random.randrange(CART_SIZE), {'product_id': hot, 'quantity': 1})
+            request = factory.post('/api/v1/orders/', {'positions': positions}, format='json')
+            force_authenticate(request, user)
+            start = time.perf_counter()
+            try:
+                response = view(request)
+                response.render()
+            finally:
+                thread_connection.close()
+            assert response.status_code in (201, 400), response.data
+            return response.status_code, time.perf_counter() - start
+
+        with ThreadPoolExecutor(max_workers=args.threads) as pool:
+            results = list(pool.map(checkout, range(checkouts)))
+
+        created = [timing for status, timing in results if status == 201]
+        rejected = [timing for status, timing in results if status == 400]
+        stock = Product.objects.get(pk=hot).stock
+        sold = sum(OrderProduct.objects.filter(product_id=hot).values_list('quantity', flat=True)) - sold_before
+        report(f'checkout: created ({len(created)})', created, items=1)
+        if rejected:
+            report(f'checkout: out of stock ({len(rejected)})', rejected, items=1)
+        print(f'hot stock: {initial} -> {stock}, sold: {sold}')
+        assert stock >= 0 and sold == initial - stock == len(created), 'oversold'
+
+
+if __name__ == '__main__':
+    main()
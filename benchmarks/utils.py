@@ -0,0 +1,156 @@
+"""
+Общие помощники для бенчмарков.
+
+Бенчмарки запускаются из корня проекта как модули, например::
+
+    python -m benchmarks.bench_product_search --rows 1000000
+
+и работают на отдельной тестовой БД (test_<NAME_DB>), которую можно сохранить
+между запусками флагом --keepdb, чтобы не заполнять данные заново.
+"""
+import argparse
+import os
+import statistics
+import time
+from contextlib import contextmanager
+
+
+def setup_django():
+    """Инициализирует Django с настройками проекта."""
+    os.environ.setdefault('DJANGO_SETTINGS_MODULE', 'website.settings')
+
+    import django
+    django.setup()
+
+
+def get_parser(description, rows):
+    """Парсер аргументов с общими для всех бенчмарков параметрами."""
+    parser = argparse.ArgumentParser(description=description)
+    parser.add_argument('--rows', type=int, default=rows, help='Объём тестовых данных.')
+    parser.add_argument('--repeat', type=int, default=20, help='Количество замеров каждого сценария.')
+    parser.add_argument('--keepdb', action='store_true', help='Не удалять тестовую БД после запуска.')
+    return parser
+
+
+@contextmanager
+def benchmark_database(keepdb=False):
+    """Создаёт тестовую БД с применёнными миграциями на время бенчмарка."""
+    from django.db import connection
+    from django.test.utils import setup_test_environment, teardown_test_environment
+
+    setup_test_environment()
+    old_name = connection.settings_dict['NAME']
+    connection.creation.create_test_db(verbosity=0, keepdb=keepdb)
+    try:
+        yield connection
+    finally:
+        connection.creation.destroy_test_db(old_name, verbosity=0, keepdb=keepdb)
+        teardown_test_environment()
+
+
+def measure(func, repeat):
+    """Возвращает длительности `repeat` вызовов func в секундах."""
+    timings = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        func()
+        timings.append(time.perf_counter() - start)
+    return timings
+
+
+def percentile(values, percent):
+    """Процентиль методом ближайшего ранга."""
+    ordered = sorted(values)
+    index = max(0, int(round(percent / 100 * len(ordered) + 0.5)) - 1)
+    return ordered[min(index, len(ordered) - 1)]
+
+
+def report(label, timings, items=None):
+    """Печатает медиану, p95 и p99 в миллисекундах и, если задано, пропускную способность в items/sec."""
+    line = (
+        f'{label:<48} median {statistics.median(timings) * 1000:9.2f} ms'
+        f'  p95 {percentile(timings, 95) * 1000:9.2f} ms'
+        f'  p99 {percentile(timings, 99) * 1000:9.2f} ms'
+    )
+    if items is not None:
+        line += f'  {items * len(timings) / sum(timings):12.0f} /sec'
+    print(line)
+
+
+WORDS = (
+    'смартфон', 'ноутбук', 'чехол', 'кабель', 'зарядка', 'наушники', 'колонка', 'клавиатура', 'мышь', 'монитор',
+    'чайник', 'кружка', 'тарелка', 'лампа', 'рюкзак', 'куртка', 'кроссовки', 'часы', 'фонарь', 'палатка',
+    'phone', 'laptop', 'case', 'cable', 'charger', 'headphones', 'speaker', 'keyboard', 'mouse', 'display',
+    'black', 'white', 'wireless', 'portable', 'steel', 'leather', 'compact', 'professional', 'mini', 'pro',
+)
+
+
+def seed_products(connection, rows):
+    """
+    Заполняет таблицу товаров до `rows` записей одним INSERT ... SELECT из generate_series
+    и пересчитывает поисковые документы.
+    """
+    from marketplace.models import Product
+
+    missing = rows - Product.objects.count()
+    if missing <= 0:
+        return
+
+    with connection.cursor() as cursor:
+        cursor.execute(
+            """
+            INSERT INTO marketplace_product (created_at, updated_at, title, description, price, review_count, mark_sum,
+                                             mark_1_count, mark_2_count, mark_3_count, mark_4_count, mark_5_count)
+            SELECT now() - make_interval(secs => i), now() - make_interval(secs => i),
+                   w[1 + (i * 7) %% cardinality(w)] || ' ' || w[1 + (i * 13) %% cardinality(w)]
+                       || ' ' || (i %% 1000)::text,
+                   w[1 + (i * 3) %% cardinality(w)] || ' ' || w[1 + (i * 11) %% cardinality(w)] || ' '
+                       || w[1 + (i * 17) %% cardinality(w)] || ' ' || w[1 + (i * 19) %% cardinality(w)],
+                   round((random() * 100000)::numeric, 2), 0, 0, 0, 0, 0, 0, 0
+            FROM generate_series(1, %s) AS i, (SELECT %s::text[] AS w) AS words
+            """,
+            [missing, list(WORDS)]
+        )
+    Product.objects.filter(search_document__isnull=True).update_search_document()
+    with connection.cursor() as cursor:
+        cursor.execute('ANALYZE marketplace_product')
+
+
+def seed_orders(connection, positions, positions_per_order=5, users=10):
+    """
+    Заполняет таблицы заказов и позиций до `positions` позиций (по positions_per_order на заказ)
+    с товарами, выбранными случайно из уже созданных seed_products. Возвращает id пользователей-владельцев.
+    """
+    from django.contrib.auth import get_user_model
+    from marketplace.models import OrderProduct
+
+    user_ids = [
+        get_user_model().objects.get_or_create(username=f'bench-user-{i}')[0].pk for i in range(users)
+    ]
+    missing_orders = (positions - OrderProduct.objects.count()) // positions_per_order
+    if missing_orders <= 0:
+        return user_ids
+
+    with connection.cursor() as cursor:
+        cursor.execute('SELECT min(id), max(id) FROM marketplace_product')
+        first, last = cursor.fetchone()
+        cursor.execute(
+            """
+            WITH new_orders AS (
+                INSERT INTO marketplace_order (created_at, updated_at, creator_id, amount, status)
+                SELECT now() - make_interval(secs => i), now() - make_interval(secs => i),
+                       (%(users)s::int[])[1 + i %% cardinality(%(users)s::int[])], 100 * %(per_order)s,
+                       (ARRAY['NEW', 'IN_PROGRESS', 'DONE'])[1 + i %% 3]
+                FROM generate_series(1, %(orders)s) AS i
+                RETURNING id
+            )
+            INSERT INTO marketplace_orderproduct (order_id, product_id, quantity, unit_price, line_total)
+            SELECT o.id, %(first)s + floor(random() * (%(last)s - %(first)s + 1))::int, 1, 100, 100
+            FROM new_orders AS o, generate_series(1, %(per_order)s)
+            """,
+            {'users': user_ids, 'per_order': positions_per_order, 'orders': missing_orders,
+             'first': first, 'last': last}
+        )
+        cursor.execute('ANALYZE marketplace_order')
+        cursor.execute('ANALYZE marketplace_orderproduct')
+    return user_ids
@@ -1,5 +1,6 @@
 from django.contrib import admin
 
+from marketplace.counting import EstimatedCountPaginator
 from marketplace.models import Product, Collection, Order, Review, OrderProduct, CollectionProduct
 
 admin.site.register(Review)
@@ -17,6 +18,8 @@ class CollectionAdmin(admin.ModelAdmin):
 @admin.register(Product)
 class ProductAdmin(admin.ModelAdmin):
     search_fields = ['title', 'description']
+    paginator = EstimatedCountPaginator
+    show_full_result_count = False
 
 
 class OrderProductInline(admin.TabularInline):
@@ -26,5 +29,7 @@ class OrderProductInline(admin.TabularInline):
 @admin.register(Order)
 class OrderAdmin(admin.ModelAdmin):
     ordering = ['created_at']
+    paginator = EstimatedCountPaginator
+    show_full_result_count = False
     # readonly_fields = ('amount',)
     inlines = [OrderProductInline]
@@ -0,0 +1,95 @@
+from datetime import datetime, time, timedelta
+from functools import reduce
+from operator import or_
+
+from django.db import connection, transaction
+from django.db.models import Count, Q, Sum
+from django.db.models.functions import TruncDate
+from django.utils import timezone
+
+from marketplace.idempotency import advisory_lock_id
+from marketplace.models import OrderHistory, OrderHistoryProduct, SalesChange, DailySales, DailyProductSales, \
+    DailyStatusSales
+
+ANALYTICS_BATCH_SIZE = 1000
+
+
+def mark_sales_change(order):
+    """ Отмечает день заказа для пересчёта аналитики. Вызывается в транзакции изменения заказа. """
+    SalesChange.objects.create(day=timezone.localdate(order.created_at))
+
+
+def day_ranges(days):
+    """ Диапазоны [начало, конец) подряд идущих дней в текущем часовом поясе. """
+    ranges = []
+    for day in sorted(days):
+        if ranges and ranges[-1][1] == day:
+            ranges[-1][1] = day + timedelta(days=1)
+        else:
+            ranges.append([day, day + timedelta(days=1)])
+    return [
+        (timezone.make_aware(datetime.combine(start, time.min)), timezone.make_aware(datetime.combine(end, time.min)))
+        for start, end in ranges
+    ]
+
+
+def created_in(days, field='created_at'):
+    """ Условие попадания даты создания в дни: диапазоны по индексу вместо приведения к дате. """
+    return reduce(or_, (Q(**{f'{field}__gte': start, f'{field}__lt': end}) for start, end in day_ranges(days)))
+
+
+def rebuild_days(days):
+    """ Пересчитывает строки аналитики за дни по заказам и позициям, включая архивные. """
+    for model in (DailySales, DailyProductSales, DailyStatusSales):
+        model.objects.filter(day__in=days).delete()
+
+    orders = OrderHistory.objects.filter(created_in(days)).annotate(day=TruncDate('created_at'))
+    DailySales.objects.bulk_create(
+        (DailySales(**row) for row in orders.values('day').annotate(
+            orders_count=Count('id'), revenue=Sum('amount')
+        ).order_by('day')),
+        batch_size=ANALYTICS_BATCH_SIZE
+    )
+    DailyStatusSales.objects.bulk_create(
+        (DailyStatusSales(**row) for row in orders.values('day', 'status').annotate(
+            orders_count=Count('id')
+        ).order_by('day', 'status')),
+        batch_size=ANALYTICS_BATCH_SIZE
+    )
+
+    positions = OrderHistoryProduct.objects.filter(created_in(days, 'order__created_at')).annotate(
+        day=TruncDate('order__created_at')
+    )
+    DailyProductSales.objects.bulk_create(
+        (DailyProductSales(day=row['day'], product_id=row['product'], quantity=row['quantity'],
+                           revenue=row['revenue'] or 0)
+         for row in positions.values('day', 'product').annotate(
+            quantity=Sum('quantity'), revenue=Sum('line_total')
+        ).order_by('day', 'product')),
+        batch_size=ANALYTICS_BATCH_SIZE
+    )
+
+
+def refresh_sales(full=False):
+    """
+    Пересчитывает аналитику продаж за дни с отметками SalesChange (или за все дни при full=True)
+    в одной транзакции и возвращает отсортированный список пересчитанных дней.
+
+    Отметки видны только после коммита изменивших заказы транзакций, поэтому всё, что они отмечают,
+    видно и запросам пересчёта. Одновременные пересчёты выполняются по очереди (advisory lock).
+    """
+    with transaction.atomic():
+        with connection.cursor() as cursor:
+            cursor.execute('SELECT pg_advisory_xact_lock(%s)', [advisory_lock_id('refresh_sales')])
+
+        changes = list(SalesChange.objects.values_list('id', 'day'))
+        days = {day for _, day in changes}
+        if full:
+            history_days = OrderHistory.objects.annotate(day=TruncDate('created_at')).values_list('day', flat=True)
+            days |= set(history_days.distinct())
+            days |= set(DailySales.objects.values_list('day', flat=True))
+
+        if days:
+            rebuild_days(days)
+        SalesChange.objects.filter(id__in=[pk for pk, _ in changes]).delete()
+    return sorted(days)
@@ -4,3 +4,14 @@ from django.apps import AppConfig
 class ApiStoreConfig(AppConfig):
     default_auto_field = 'django.db.models.BigAutoField'
     name = 'marketplace'
+
+    def ready(self):
+        from django.db.models import CharField, TextField
+
+        from marketplace.lookups import TrigramWordSimilar
+
+        CharField.register_lookup(TrigramWordSimilar)
+        TextField.register_lookup(TrigramWordSimilar)
+
+        # Регистрация обработчиков сигналов.
+        from marketplace import signals  # noqa: F401
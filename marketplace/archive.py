@@ -0,0 +1,71 @@
+from django.db import connection, transaction
+from rest_framework.permissions import SAFE_METHODS
+
+# Перенос пачки выполненных заказов в архив. Строки блокируются с SKIP LOCKED, чтобы не ждать заказы,
+# которые в это время меняются, и удаляются с RETURNING: чтение и удаление выполняются одним проходом.
+ARCHIVE_ORDERS_SQL = """
+    WITH batch AS (
+        SELECT id FROM marketplace_order
+        WHERE status = %(status)s AND created_at < %(cutoff)s
+        ORDER BY status, created_at, id
+        LIMIT %(batch_size)s
+        FOR UPDATE SKIP LOCKED
+    ), moved AS (
+        DELETE FROM marketplace_order AS o USING batch WHERE o.id = batch.id
+        RETURNING o.id, o.created_at, o.updated_at, o.amount, o.status, o.creator_id
+    )
+    INSERT INTO marketplace_archivedorder (id, created_at, updated_at, amount, status, creator_id, archived_at)
+    SELECT id, created_at, updated_at, amount, status, creator_id, now() FROM moved
+    RETURNING id
+"""
+
+ARCHIVE_POSITIONS_SQL = """
+    WITH moved AS (
+        DELETE FROM marketplace_orderproduct WHERE order_id = ANY(%(ids)s)
+        RETURNING id, product_id, order_id, quantity, unit_price, line_total
+    )
+    INSERT INTO marketplace_archivedorderproduct (id, product_id, order_id, quantity, unit_price, line_total)
+    SELECT id, product_id, order_id, quantity, unit_price, line_total FROM moved
+"""
+
+# Заявки асинхронного приёма теряют ссылку на заказ так же, как при удалении заказа (SET_NULL).
+DETACH_TICKETS_SQL = 'UPDATE marketplace_orderticket SET order_id = NULL WHERE order_id = ANY(%(ids)s)'
+
+
+def archive_order_batch(status, cutoff, batch_size):
+    """
+    Переносит в архив до batch_size заказов со статусом status, созданных раньше cutoff, вместе с позициями
+    в одной транзакции. Возвращает количество перенесённых заказов.
+    Внешние ключи Django проверяются при коммите (DEFERRABLE INITIALLY DEFERRED), поэтому заказы можно
+    удалить раньше их позиций.
+    """
+    with transaction.atomic(), connection.cursor() as cursor:
+        cursor.execute(ARCHIVE_ORDERS_SQL, {'status': status, 'cutoff': cutoff, 'batch_size': batch_size})
+        ids = [row[0] for row in cursor.fetchall()]
+        if ids:
+            cursor.execute(ARCHIVE_POSITIONS_SQL, {'ids': ids})
+            cursor.execute(DETACH_TICKETS_SQL, {'ids': ids})
+    return len(ids)
+
+
+class ArchiveQuerysetMixin:
+    """
+    Для GET запросов с фильтром по датам (`archive_query_params`) и для действий `archive_actions`
+    viewset работает с `archive_queryset` и `archive_filterset_class`, которые включают и архивные записи.
+    Остальные запросы идут только к действующим записям.
+    """
+
+    archive_queryset = None
+    archive_filterset_class = None
+    archive_query_params = ()
+    archive_actions = ()
+
+    def includes_archive(self):
+        return self.request.method in SAFE_METHODS and (self.action in self.archive_actions or any(
+            self.request.query_params.get(param) for param in self.archive_query_params
+        ))
+
+    def initial(self, request, *args, **kwargs):
+        super().initial(request, *args, **kwargs)
+        if self.includes_archive():
+            self.queryset, self.filterset_class = self.archive_queryset, self.archive_filterset_class
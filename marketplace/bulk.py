@@ -0,0 +1,98 @@
+from collections import defaultdict
+
+from django.db import transaction
+from django.utils import timezone
+from rest_framework import serializers
+
+from marketplace.cache import bump_version
+from marketplace.models import Product
+from marketplace.serializers import ProductSerializer
+
+BULK_BATCH_SIZE = 1000
+
+
+def validate_products(rows, context=None):
+    """
+    Проверяет строки массовой загрузки товаров через ProductSerializer(many=True).
+    Строки с `id` обновляют существующие товары (частично), строки без `id` создают новые.
+
+    Возвращает (creates, updates): списки validated_data и пар (id, validated_data).
+    При ошибках выбрасывает ValidationError со списком ошибок по строкам в порядке входных данных
+    (пустой словарь для корректной строки).
+    """
+    if not isinstance(rows, list):
+        raise serializers.ValidationError(
+            {'non_field_errors': [f'Expected a list of items but got type "{type(rows).__name__}".']}
+        )
+    if not rows:
+        raise serializers.ValidationError({'non_field_errors': ['This list may not be empty.']})
+
+    errors = [{} for _ in rows]
+    create_indexes, update_indexes = [], []
+    for index, row in enumerate(rows):
+        if isinstance(row, dict) and row.get('id') is not None:
+            update_indexes.append(index)
+        else:
+            create_indexes.append(index)
+
+    # Идентификаторы обновляемых товаров: целые, без повторов и существующие в БД.
+    seen = set()
+    for index in update_indexes:
+        pk = rows[index]['id']
+        if not isinstance(pk, int) or isinstance(pk, bool):
+            errors[index]['id'] = ['A valid integer is required.']
+        elif pk in seen:
+            errors[index]['id'] = ['Duplicate id in the request.']
+        else:
+            seen.add(pk)
+    existing = set(Product.objects.filter(pk__in=seen).values_list('pk', flat=True))
+    for index in update_indexes:
+        if 'id' not in errors[index] and rows[index]['id'] not in existing:
+            errors[index]['id'] = [f'Invalid pk "{rows[index]["id"]}" - object does not exist.']
+
+    create_serializer = ProductSerializer(data=[rows[i] for i in create_indexes], many=True, context=context)
+    update_serializer = ProductSerializer(
+        data=[rows[i] for i in update_indexes], many=True, partial=True, context=context
+    )
+    for indexes, serializer in ((create_indexes, create_serializer), (update_indexes, update_serializer)):
+        if not serializer.is_valid():
+            for index, row_errors in zip(indexes, serializer.errors):
+                errors[index].update(row_errors)
+
+    if any(errors):
+        raise serializers.ValidationError(errors)
+
+    updates = [(rows[index]['id'], data) for index, data in zip(update_indexes, update_serializer.validated_data)]
+    return list(create_serializer.validated_data), updates
+
+
+def save_products(creates, updates, batch_size=BULK_BATCH_SIZE):
+    """
+    Записывает проверенные товары в одной транзакции: bulk_create для новых и bulk_update для существующих.
+
+    Обновления группируются по набору переданных полей, чтобы в каждом UPDATE участвовали только они
+    и товары не нужно было предварительно читать. Сигналы при массовой записи не вызываются, поэтому
+    поисковые документы, подсказки и версия кеша обновляются здесь же.
+    Возвращает (created_ids, updated_ids).
+    """
+    now = timezone.now()
+    groups = defaultdict(list)
+    for pk, data in updates:
+        groups[tuple(sorted(data))].append(Product(pk=pk, updated_at=now, **data))
+
+    with transaction.atomic():
+        created = Product.objects.bulk_create([Product(**data) for data in creates], batch_size=batch_size)
+        for fields, products in groups.items():
+            Product.objects.bulk_update(products, fields=[*fields, 'updated_at'], batch_size=batch_size)
+
+        created_ids = [product.pk for product in created]
+        search_ids = created_ids + [
+            product.pk
+            for fields, products in groups.items() if {'title', 'description'} & set(fields)
+            for product in products
+        ]
+        for start in range(0, len(search_ids), batch_size):
+            Product.objects.filter(pk__in=search_ids[start:start + batch_size]).update_search_document()
+
+        bump_version('product')
+    return created_ids, [pk for pk, _ in updates]
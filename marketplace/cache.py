@@ -0,0 +1,99 @@
+import hashlib
+import time
+
+from django.core.cache import cache
+from django.db import transaction
+from rest_framework.response import Response
+
+VERSION_KEY = 'marketplace:version:{}'
+MODIFIED_KEY = 'marketplace:modified:{}'
+RESPONSE_KEY = 'marketplace:response:{}'
+
+
+def get_versions(*names):
+    """
+    Текущие версии данных по именам (например 'product', 'collection').
+    Отсутствующая версия инициализируется текущим временем в миллисекундах, чтобы после вытеснения ключа
+    из кеша счётчик не повторил старое значение и не оживил устаревшие ответы.
+    """
+    keys = [VERSION_KEY.format(name) for name in names]
+    versions = cache.get_many(keys)
+    for key in keys:
+        if key not in versions:
+            cache.add(key, int(time.time() * 1000), timeout=None)
+            versions[key] = cache.get(key)
+    return tuple(versions[key] for key in keys)
+
+
+def get_modified(*names):
+    """ Время (unix timestamp) последнего изменения данных по именам или None, если оно неизвестно. """
+    modified = cache.get_many([MODIFIED_KEY.format(name) for name in names])
+    return max(modified.values(), default=None)
+
+
+def bump_version(name):
+    """
+    Увеличивает версию данных сразу и ещё раз после коммита транзакции. Второе увеличение отсекает ответы,
+    закешированные параллельными запросами по данным, ещё не видимым до коммита.
+    """
+    def bump():
+        key = VERSION_KEY.format(name)
+        try:
+            cache.incr(key)
+        except ValueError:
+            get_versions(name)
+        cache.set(MODIFIED_KEY.format(name), time.time(), timeout=None)
+
+    bump()
+    transaction.on_commit(bump)
+
+
+class CachedResponseMixin:
+    """
+    Кеширует данные ответов list и retrieve viewset.
+
+    Ключ строится из действия, нормализованных параметров запроса и версий данных `cache_versions`,
+    которые увеличиваются сигналами при изменении моделей, поэтому явная инвалидация не нужна.
+    При промахе ответ пересчитывает только один запрос (блокировка через cache.add),
+    остальные в это время получают последний закешированный ответ для тех же параметров.
+    """
+
+    cache_versions = ()
+    cache_timeout = 60 * 60
+    cache_lock_timeout = 30
+
+    def list(self, request, *args, **kwargs):
+        return self.cached_response(super().list, request, *args, **kwargs)
+
+    def retrieve(self, request, *args, **kwargs):
+        return self.cached_response(super().retrieve, request, *args, **kwargs)
+
+    def get_response_cache_key(self, request, kwargs):
+        params = sorted((key, sorted(values)) for key, values in request.query_params.lists())
+        raw = repr((self.basename, self.action, request.get_host(), sorted(kwargs.items()), params))
+        return RESPONSE_KEY.format(hashlib.md5(raw.encode('utf-8')).hexdigest())
+
+    def cached_response(self, handler, request, *args, **kwargs):
+        versions = get_versions(*self.cache_versions)
+        base_key = self.get_response_cache_key(request, kwargs)
+        key = f'{base_key}:{":".join(map(str, versions))}'
+        latest_key, lock_key = f'{base_key}:latest', f'{base_key}:lock'
+
+        data = cache.get(key)
+        if data is not None:
+            return Response(data)
+
+        if not cache.add(lock_key, 1, timeout=self.cache_lock_timeout):
+            # Ответ уже пересчитывается другим запросом: отдаём последний известный.
+            latest = cache.get(latest_key)
+            if latest is not None:
+                return Response(latest)
+            return handler(request, *args, **kwargs)
+
+        try:
+            response = handler(request, *args, **kwargs)
+            if response.status_code == 200:
+                cache.set_many({key: response.data, latest_key: response.data}, timeout=self.cache_timeout)
+            return response
+        finally:
+            cache.delete(lock_key)
@@ -0,0 +1,73 @@
+import hashlib
+
+from django.core.exceptions import ValidationError as DjangoValidationError
+from django.db.models import Count, Max
+from django.utils.cache import get_conditional_response
+from django.utils.http import http_date, quote_etag
+
+from marketplace.cache import get_modified, get_versions
+
+
+class ConditionalGetMixin:
+    """
+    Условные GET запросы (ETag / Last-Modified, ответ 304) для list и retrieve viewset.
+
+    Валидаторы вычисляются без загрузки и сериализации записей: из версий данных `etag_versions`
+    (см. marketplace.cache) и, если включено `etag_probe_queryset`, из одного запроса
+    MAX(updated_at) / COUNT(*) по отфильтрованному queryset.
+    """
+
+    etag_versions = ()
+    etag_probe_queryset = False
+
+    def list(self, request, *args, **kwargs):
+        return self.conditional_response(super().list, request, *args, **kwargs)
+
+    def retrieve(self, request, *args, **kwargs):
+        return self.conditional_response(super().retrieve, request, *args, **kwargs)
+
+    def get_validators(self, request, kwargs):
+        """Возвращает (etag, last_modified) или (None, None), если объекта нет."""
+        params = sorted((key, sorted(values)) for key, values in request.query_params.lists())
+        parts = [self.basename, self.action, request.user.pk, sorted(kwargs.items()), params]
+        modified = []
+
+        if self.etag_versions:
+            parts.append(get_versions(*self.etag_versions))
+            modified.append(get_modified(*self.etag_versions))
+
+        if self.etag_probe_queryset:
+            queryset = self.filter_queryset(self.get_queryset())
+            lookup_url_kwarg = self.lookup_url_kwarg or self.lookup_field
+            try:
+                if lookup_url_kwarg in kwargs:
+                    queryset = queryset.filter(**{self.lookup_field: kwargs[lookup_url_kwarg]})
+                probe = queryset.aggregate(updated_at=Max('updated_at'), count=Count('*'))
+            except (TypeError, ValueError, DjangoValidationError):
+                # Некорректный ключ в URL: ответ 404 даст обычная обработка (get_object_or_404).
+                return None, None
+            if not probe['count'] and lookup_url_kwarg in kwargs:
+                return None, None
+            parts += [probe['count'], probe['updated_at']]
+            if probe['updated_at'] is not None:
+                modified.append(probe['updated_at'].timestamp())
+
+        etag = quote_etag(hashlib.md5(repr(parts).encode('utf-8')).hexdigest())
+        last_modified = max(filter(None, modified), default=None)
+        return etag, last_modified and int(last_modified)
+
+    def conditional_response(self, handler, request, *args, **kwargs):
+        etag, last_modified = self.get_validators(request, kwargs)
+        if etag is None:
+            return handler(request, *args, **kwargs)
+
+        not_modified = get_conditional_response(request, etag=etag, last_modified=last_modified)
+        if not_modified is not None:
+            return not_modified
+
+        response = handler(request, *args, **kwargs)
+        if response.status_code == 200:
+            response['ETag'] = etag
+            if last_modified is not None:
+                response['Last-Modified'] = http_date(last_modified)
+        return response
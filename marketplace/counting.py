@@ -0,0 +1,56 @@
+from django.conf import settings
+from django.core.paginator import Paginator
+from django.db import connection
+from django.utils.functional import cached_property
+
+# Оценка числа строк таблицы по статистике (ANALYZE / autovacuum) без чтения таблицы.
+# reltuples < 0 у таблицы, которую ещё не анализировали.
+TABLE_ESTIMATE_SQL = 'SELECT reltuples::bigint FROM pg_class WHERE oid = %s::regclass'
+
+EXPLAIN_SQL = 'EXPLAIN (FORMAT JSON) {}'
+
+
+def estimate_count(queryset):
+    """
+    Оценка количества записей queryset планировщиком PostgreSQL: для всей таблицы — reltuples из pg_class,
+    для запроса с условиями — число строк верхнего узла плана EXPLAIN.
+    """
+    queryset = queryset.order_by()
+    if not queryset.query.where and not queryset.query.distinct and queryset.model._meta.managed:
+        with connection.cursor() as cursor:
+            cursor.execute(TABLE_ESTIMATE_SQL, [connection.ops.quote_name(queryset.model._meta.db_table)])
+            row = cursor.fetchone()
+        if row is not None and row[0] >= 0:
+            return row[0]
+
+    # QuerySet.explain() отдаёт план текстом, а psycopg2 сам разбирает JSON результата EXPLAIN.
+    sql, params = queryset.query.sql_with_params()
+    with connection.cursor() as cursor:
+        cursor.execute(EXPLAIN_SQL.format(sql), params)
+        plan = cursor.fetchone()[0]
+    return int(plan[0]['Plan']['Plan Rows'])
+
+
+def get_count(queryset, threshold=None):
+    """
+    (количество, оценка ли это) для queryset: оценка планировщика, если она не меньше threshold
+    (по умолчанию settings.COUNT_ESTIMATE_THRESHOLD), иначе точный COUNT(*).
+    """
+    if threshold is None:
+        threshold = settings.COUNT_ESTIMATE_THRESHOLD
+    estimate = estimate_count(queryset)
+    if estimate >= threshold:
+        return estimate, True
+    return queryset.count(), False
+
+
+class EstimatedCountPaginator(Paginator):
+    """
+    Paginator списка в интерфейсе администратора с оценкой количества записей для больших таблиц.
+    Номер последней страницы при оценке приблизителен.
+    """
+
+    @cached_property
+    def count(self):
+        count, self.count_estimated = get_count(self.object_list)
+        return count
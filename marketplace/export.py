@@ -0,0 +1,51 @@
+from itertools import islice
+
+from django.db.models import prefetch_related_objects
+from django.http import StreamingHttpResponse
+from rest_framework.decorators import action
+
+from marketplace.renderers import CSVRenderer, NDJSONRenderer
+
+
+class ExportMixin:
+    """
+    Потоковая выгрузка списка viewset: GET <list>/export/?format=ndjson|csv.
+
+    Применяются те же фильтры, что и для list, но без пагинации. Записи читаются серверным курсором
+    (`iterator(chunk_size=...)`) пачками по `export_chunk_size`, prefetch_related выполняется для каждой пачки,
+    поэтому расход памяти не зависит от количества выгружаемых строк.
+    """
+
+    export_chunk_size = 2000
+
+    @action(detail=False, methods=['get'], renderer_classes=[NDJSONRenderer, CSVRenderer])
+    def export(self, request):
+        queryset = self.filter_queryset(self.get_queryset())
+        renderer = request.accepted_renderer
+
+        response = StreamingHttpResponse(
+            self.stream_export(renderer, queryset),
+            content_type=f'{renderer.media_type}; charset={renderer.charset}'
+        )
+        response['Content-Disposition'] = f'attachment; filename="{self.basename}.{renderer.format}"'
+        return response
+
+    def iter_export_chunks(self, queryset):
+        """ Сериализованные данные пачками по export_chunk_size записей. """
+        lookups = queryset._prefetch_related_lookups
+        iterator = queryset.prefetch_related(None).iterator(chunk_size=self.export_chunk_size)
+        while True:
+            chunk = list(islice(iterator, self.export_chunk_size))
+            if not chunk:
+                return
+            prefetch_related_objects(chunk, *lookups)
+            yield self.get_serializer(chunk, many=True).data
+
+    def stream_export(self, renderer, queryset):
+        header = None
+        for rows in self.iter_export_chunks(queryset):
+            if isinstance(renderer, CSVRenderer):
+                content, header = renderer.render_rows(rows, header)
+            else:
+                content = renderer.render_rows(rows)
+            yield content.encode(renderer.charset)
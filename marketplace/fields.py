@@ -0,0 +1,163 @@
+from collections.abc import Mapping
+
+from django.core.exceptions import ValidationError as DjangoValidationError
+from django.db import models
+from rest_framework import serializers
+
+
+def to_pk(model, data):
+    """ Значение первичного ключа model или None, если data не может им быть. """
+    if isinstance(data, bool):
+        return None
+    try:
+        return model._meta.pk.to_python(data)
+    except (TypeError, DjangoValidationError):
+        return None
+
+
+class BatchedPrimaryKeyRelatedField(serializers.PrimaryKeyRelatedField):
+    """
+    PrimaryKeyRelatedField, который внутри BatchedRelatedListSerializer берёт объекты из заранее
+    загруженного одним запросом словаря вместо отдельного SELECT на каждое значение.
+    Вне такого списка работает как обычный PrimaryKeyRelatedField.
+    """
+
+    def __init__(self, **kwargs):
+        super().__init__(**kwargs)
+        self.resolved = None
+
+    def to_pk(self, data):
+        return to_pk(self.get_queryset().model, data)
+
+    def resolve(self, values):
+        """ Загружает объекты для всех значений одним запросом `pk IN (...)`. """
+        pks = set()
+        for value in values:
+            pk = self.to_pk(value)
+            if pk is not None:
+                pks.add(pk)
+        self.resolved = self.get_queryset().in_bulk(pks) if pks else {}
+
+    def to_internal_value(self, data):
+        if self.resolved is None:
+            return super().to_internal_value(data)
+
+        pk = self.to_pk(data)
+        if pk is None:
+            self.fail('incorrect_type', data_type=type(data).__name__)
+        try:
+            return self.resolved[pk]
+        except KeyError:
+            self.fail('does_not_exist', pk_value=data)
+
+
+class BatchedRelatedListSerializer(serializers.ListSerializer):
+    """
+    ListSerializer, который перед проверкой элементов собирает значения всех BatchedPrimaryKeyRelatedField
+    дочернего serializer и разрешает их одним запросом на поле. Ошибки (в том числе несуществующие id)
+    возвращаются по элементам, как у обычного ListSerializer.
+
+    Подключается через `Meta.list_serializer_class`.
+    """
+
+    def to_internal_value(self, data):
+        fields = [
+            field for field in self.child.fields.values()
+            if isinstance(field, BatchedPrimaryKeyRelatedField) and not field.read_only
+        ]
+        if isinstance(data, list):
+            items = [item for item in data if isinstance(item, Mapping)]
+            for field in fields:
+                field.resolve(item[field.field_name] for item in items if field.field_name in item)
+
+        try:
+            return super().to_internal_value(data)
+        finally:
+            for field in fields:
+                field.resolved = None
+
+
+class CappedRelatedListSerializer(BatchedRelatedListSerializer):
+    """
+    BatchedRelatedListSerializer, который выводит вложенный список связанных объектов (менеджер связи)
+    не длиннее `nested_limit` из контекста serializer. Списки, переданные напрямую (страница вложенного
+    ресурса), выводятся целиком.
+    """
+
+    def to_representation(self, data):
+        limit = self.context.get('nested_limit')
+        if limit is not None and isinstance(data, models.Manager):
+            data = data.all()[:limit]
+        return super().to_representation(data)
+
+
+class RelatedCountField(serializers.Field):
+    """
+    Количество связанных объектов `relation`: длина загруженного prefetch_related списка, если он не длиннее
+    `nested_limit` (NestedLimitMixin загружает на одну запись больше), иначе COUNT(*) по связи.
+    Количества для всех таких записей списка (страницы) считаются одним запросом с GROUP BY.
+    """
+
+    def __init__(self, relation, **kwargs):
+        kwargs['read_only'] = True
+        kwargs['source'] = '*'
+        super().__init__(**kwargs)
+        self.relation = relation
+        self.counts = {}
+
+    def get_prefetched_count(self, instance):
+        """ Длина загруженного списка или None, если списка нет или он обрезан. """
+        prefetched = getattr(instance, '_prefetched_objects_cache', {}).get(self.relation)
+        limit = self.context.get('nested_limit')
+        if prefetched is not None and (limit is None or len(prefetched) <= limit):
+            return len(prefetched)
+        return None
+
+    def get_siblings(self, instance):
+        """ Записи списка, который выводится вместе с instance (для retrieve — только она сама). """
+        list_serializer = getattr(self.parent, 'parent', None)
+        if isinstance(list_serializer, serializers.ListSerializer) and isinstance(list_serializer.instance, (
+            list, models.QuerySet
+        )):
+            siblings = list(list_serializer.instance)
+            if instance in siblings:
+                return siblings
+        return [instance]
+
+    def count_related(self, instances):
+        """ {pk записи: количество} одним запросом `GROUP BY` по внешнему ключу связи. """
+        field = instances[0]._meta.get_field(self.relation).field
+        counts = field.model._default_manager.filter(**{f'{field.name}__in': instances}).order_by().values(
+            field.attname
+        ).annotate(count=models.Count('*')).values_list(field.attname, 'count')
+        return {**{instance.pk: 0 for instance in instances}, **dict(counts)}
+
+    def to_representation(self, instance):
+        count = self.get_prefetched_count(instance)
+        if count is not None:
+            return count
+        if instance.pk not in self.counts:
+            # Менеджер связи считал бы загруженный (обрезанный) список, поэтому COUNT(*) по внешнему ключу.
+            self.counts = self.count_related([
+                sibling for sibling in self.get_siblings(instance) if self.get_prefetched_count(sibling) is None
+            ])
+        return self.counts[instance.pk]
+
+
+class UncheckedPrimaryKeyRelatedField(serializers.PrimaryKeyRelatedField):
+    """
+    PrimaryKeyRelatedField без запроса к БД: проверяет только тип значения и возвращает сам первичный ключ.
+    Существование объекта проверяет запись (число обновлённых строк или ограничение внешнего ключа),
+    ошибку для ответа даёт `does_not_exist_error`.
+    """
+
+    def to_internal_value(self, data):
+        pk = to_pk(self.get_queryset().model, data)
+        if pk is None:
+            self.fail('incorrect_type', data_type=type(data).__name__)
+        return pk
+
+    def does_not_exist_error(self, pk):
+        return serializers.ValidationError(
+            {self.field_name: [self.error_messages['does_not_exist'].format(pk_value=pk)]}
+        )
@@ -0,0 +1,183 @@
+from django.core.exceptions import FieldDoesNotExist
+from django.db.models import Prefetch
+from rest_framework import serializers
+from rest_framework.exceptions import ValidationError
+from rest_framework.permissions import SAFE_METHODS
+
+FIELDS_PARAM = 'fields'
+EXPAND_PARAM = 'expand'
+
+
+def parse_paths(values):
+    """ Список значений вида 'id,product.title' в дерево {'id': {}, 'product': {'title': {}}}. """
+    tree = {}
+    for value in values:
+        for path in filter(None, (part.strip() for part in value.split(','))):
+            node = tree
+            for name in path.split('.'):
+                node = node.setdefault(name, {})
+    return tree
+
+
+def get_request_fieldset(request):
+    """
+    (fields, expand) из параметров GET запроса. fields=None означает все поля:
+    для изменяющих запросов, которым нужны и поля только для записи, выборка не применяется.
+    """
+    if request is None or request.method not in SAFE_METHODS:
+        return None, {}
+    fields = parse_paths(request.query_params.getlist(FIELDS_PARAM))
+    return fields or None, parse_paths(request.query_params.getlist(EXPAND_PARAM))
+
+
+def get_nested(field):
+    """ Вложенный serializer с поддержкой выборки полей (для many=True — child) или None. """
+    serializer = getattr(field, 'child', field)
+    return serializer if isinstance(serializer, SparseFieldsMixin) else None
+
+
+def get_model_field(model, name):
+    try:
+        return model._meta.get_field(name)
+    except FieldDoesNotExist:
+        return None
+
+
+def check_fieldset(fields, fieldset, path=''):
+    """ Ошибка 400 для запрошенных полей, которых нет среди полей ответа serializer. """
+    unknown = [name for name in fieldset if name not in fields or fields[name].write_only]
+    if unknown:
+        raise ValidationError({FIELDS_PARAM: [f'Unknown field "{path}{name}".' for name in unknown]})
+
+
+class SparseFieldsMixin:
+    """
+    Выборка полей ответа ModelSerializer параметрами GET запроса `?fields=` и `?expand=`.
+
+    `fields=id,product.title` оставляет перечисленные поля, вложенные поля задаются через точку.
+    Вложенный объект по внешнему ключу, указанный без уточнения полей, заменяется его id,
+    а целиком встраивается, если он указан и в `expand`. Вложенные списки (позиции заказа, товары подборки)
+    без уточнения полей встраиваются целиком. Без `fields` ответ не меняется.
+    """
+
+    # Колонки модели, из которых вычисляются поля без своей колонки (SerializerMethodField).
+    sparse_columns = {}
+
+    def get_fieldset(self):
+        """ (fields, expand) этого serializer: вложенным их задаёт родитель, корневому — запрос. """
+        if hasattr(self, 'sparse_fieldset'):
+            return self.sparse_fieldset
+        return get_request_fieldset(self.context.get('request'))
+
+    def get_all_fields(self):
+        """ Все поля serializer без выборки. """
+        return super().get_fields()
+
+    def get_fields(self):
+        fields = self.get_all_fields()
+        fieldset, expand = self.get_fieldset()
+        if fieldset is not None:
+            check_fieldset(fields, fieldset)
+            fields = {name: field for name, field in fields.items() if name in fieldset}
+
+        for name, field in fields.items():
+            nested = get_nested(field)
+            if nested is None:
+                continue
+            subset = None if fieldset is None else fieldset[name] or None
+            if fieldset is not None and subset is None and name not in expand and self.is_reference(name, field):
+                source = {'source': field.source} if field.source else {}
+                fields[name] = serializers.PrimaryKeyRelatedField(read_only=True, **source)
+            else:
+                nested.sparse_fieldset = (subset, expand.get(name, {}))
+        return fields
+
+    def is_reference(self, name, field):
+        """ Поле — вложенный объект по внешнему ключу модели. """
+        model_field = get_model_field(self.Meta.model, field.source or name)
+        return model_field is not None and model_field.many_to_one
+
+    def get_projection(self, fieldset, expand, prefix='', model=None):
+        """
+        Колонки для only(), пути select_related и Prefetch, нужные для полей fieldset
+        (None — все поля) с учётом замены вложенных объектов на id.
+        model — модель queryset, если это не Meta.model, а модель с теми же полями.
+        """
+        model = model or self.Meta.model
+        fields = self.get_all_fields()
+        if fieldset is None:
+            fieldset = {name: None for name, field in fields.items() if not field.write_only}
+        else:
+            check_fieldset(fields, fieldset, prefix.replace('__', '.'))
+
+        columns, related, prefetches = [prefix + model._meta.pk.name], [], []
+        for name, subset in fieldset.items():
+            field = fields[name]
+            source = field.source or name
+            model_field = get_model_field(model, source)
+            nested = get_nested(field)
+
+            if nested is None:
+                # Количество по связи (RelatedCountField) без самого списка Prefetch не требует:
+                # оно считается для всей страницы одним запросом с GROUP BY.
+                if model_field is not None and model_field.concrete:
+                    columns.append(prefix + source)
+                columns += [prefix + column for column in self.sparse_columns.get(name, ())]
+            elif model_field.many_to_one:
+                columns.append(prefix + source)
+                if subset is None or subset or name in expand:
+                    # Встраиваемый объект выбирается тем же запросом через JOIN.
+                    related.append(prefix + source)
+                    sub_columns, sub_related, sub_prefetches = nested.get_projection(
+                        subset or None, expand.get(name, {}), prefix=f'{prefix}{source}__',
+                        model=model_field.related_model
+                    )
+                    columns += sub_columns
+                    related += sub_related
+                    prefetches += sub_prefetches
+            else:
+                # Обратная связь (вложенный список): отдельный Prefetch со своей выборкой колонок.
+                sub_columns, sub_related, sub_prefetches = nested.get_projection(
+                    subset or None, expand.get(name, {}), model=model_field.related_model
+                )
+                queryset = model_field.related_model._default_manager.only(model_field.field.name, *sub_columns)
+                if sub_related:
+                    queryset = queryset.select_related(*sub_related)
+                prefetches.append(Prefetch(prefix + source, queryset=queryset.prefetch_related(*sub_prefetches)))
+        return columns, related, prefetches
+
+
+class SparseQuerysetMixin:
+    """
+    Переносит выборку полей `?fields=` / `?expand=` serializer (SparseFieldsMixin) в queryset viewset:
+    only() по нужным колонкам, select_related и Prefetch только для встраиваемых связей.
+    Колонки сортировки пагинации и `ordering_fields` выбираются всегда.
+    """
+
+    def get_queryset(self):
+        queryset = super().get_queryset()
+        fieldset, expand = get_request_fieldset(self.request)
+        if fieldset is None:
+            return queryset
+
+        columns, related, prefetches = self.get_serializer().get_projection(fieldset, expand, model=queryset.model)
+        queryset = queryset.select_related(None).prefetch_related(None).only(
+            *columns, *self.get_sparse_columns(queryset.model)
+        )
+        if related:
+            queryset = queryset.select_related(*related)
+        return queryset.prefetch_related(*prefetches)
+
+    def get_sparse_columns(self, model):
+        """ Колонки, которые нужны view независимо от полей ответа. """
+        names = list(getattr(self.pagination_class, 'ordering', ()))
+        ordering_fields = getattr(self, 'ordering_fields', None)
+        if not isinstance(ordering_fields, str):
+            names += ordering_fields or []
+
+        columns = []
+        for name in names:
+            model_field = get_model_field(model, name.lstrip('-'))
+            if model_field is not None and model_field.concrete:
+                columns.append(model_field.name)
+        return columns
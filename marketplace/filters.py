@@ -1,12 +1,29 @@
+from django import forms
+from django.contrib.postgres.search import SearchQuery, SearchRank
+from django.db.models import Exists, F, FloatField, OuterRef
+from django.db.models.functions import Cast
 from django_filters import rest_framework as filters, DateTimeFromToRangeFilter
+from rest_framework.exceptions import ValidationError
 from rest_framework.filters import SearchFilter, BaseFilterBackend
+from rest_framework.settings import api_settings
 
-from marketplace.models import Product, Review, Order
+from marketplace.models import Product, Review, Order, OrderHistory, DailySales, DailyProductSales, DailyStatusSales, \
+    SEARCH_CONFIG
+
+
+class NumberInFilter(filters.BaseInFilter, filters.NumberFilter):
+    """Список целых чисел через запятую, например `?product=1,2,3`."""
+
+    field_class = forms.IntegerField
 
 
 class ProductFilter(filters.FilterSet):
     """Фильтры для товаров."""
 
+    # rating - аннотация ProductQuerySet.with_rating()
+    rating__gte = filters.NumberFilter(field_name='rating', lookup_expr='gte')
+    rating__lte = filters.NumberFilter(field_name='rating', lookup_expr='lte')
+
     class Meta:
         model = Product
         fields = {
@@ -27,13 +44,76 @@ class ReviewFilter(filters.FilterSet):
 class OrderFilter(filters.FilterSet):
     """Фильтры для товаров."""
 
+    MAX_PRODUCTS = 100
+
     created_at = DateTimeFromToRangeFilter()
     updated_at = DateTimeFromToRangeFilter()
+    # Заказы, в позициях которых есть любой (product_match=any, по умолчанию) или каждый (all) из товаров
+    product = NumberInFilter(method='filter_product')
+    product_match = filters.ChoiceFilter(
+        choices=(('any', 'any'), ('all', 'all')), empty_label=None, method='filter_product_match'
+    )
 
     class Meta:
         model = Order
         fields = ['status', 'created_at', 'updated_at', 'amount']
 
+    def filter_product(self, queryset, name, value):
+        """
+        EXISTS подзапрос к позициям по индексу (product, order): заказ попадает в выдачу один раз,
+        сколько бы позиций с товаром в нём ни было.
+        """
+        product_ids = set(value)
+        if not product_ids:
+            return queryset
+        if len(product_ids) > self.MAX_PRODUCTS:
+            raise ValidationError({name: [f'Ensure this value has at most {self.MAX_PRODUCTS} elements.']})
+
+        # Позиции модели queryset: OrderProduct для Order, OrderHistoryProduct для OrderHistory
+        positions = queryset.model.positions.rel.related_model.objects.filter(order=OuterRef('pk'))
+        if self.form.cleaned_data.get('product_match') == 'all':
+            for product_id in sorted(product_ids):
+                queryset = queryset.filter(Exists(positions.filter(product=product_id)))
+            return queryset
+        return queryset.filter(Exists(positions.filter(product__in=product_ids)))
+
+    def filter_product_match(self, queryset, name, value):
+        """Режим сопоставления учитывается в filter_product."""
+        return queryset
+
+
+class OrderHistoryFilter(OrderFilter):
+    """Фильтры для заказов вместе с архивными."""
+
+    class Meta(OrderFilter.Meta):
+        model = OrderHistory
+
+
+class DailySalesFilter(filters.FilterSet):
+    """Фильтр аналитики продаж по дням: `?day_after=2024-01-01&day_before=2024-01-31`."""
+
+    day = filters.DateFromToRangeFilter()
+
+    class Meta:
+        model = DailySales
+        fields = ['day']
+
+
+class DailyProductSalesFilter(DailySalesFilter):
+    """Фильтр продаж товаров по дням."""
+
+    class Meta:
+        model = DailyProductSales
+        fields = ['day']
+
+
+class DailyStatusSalesFilter(DailySalesFilter):
+    """Фильтр количества заказов по статусам и дням."""
+
+    class Meta:
+        model = DailyStatusSales
+        fields = ['day']
+
 
 class IsOwnerOrAdminFilterBackend(BaseFilterBackend):
     """
@@ -44,3 +124,33 @@ class IsOwnerOrAdminFilterBackend(BaseFilterBackend):
             return queryset
         else:
             return queryset.filter(creator=request.user)
+
+
+class ProductSearchFilter(BaseFilterBackend):
+    """
+    Полнотекстовый поиск товаров по параметру `search`.
+    Использует GIN индекс по `search_document` и ранжирует результаты по ts_rank.
+    """
+    search_param = api_settings.SEARCH_PARAM
+
+    def get_search_query(self, request):
+        term = request.query_params.get(self.search_param, '').replace('\x00', '').strip()
+        if not term:
+            return None
+        return SearchQuery(term, config=SEARCH_CONFIG, search_type='websearch')
+
+    def filter_queryset(self, request, queryset, view):
+        query = self.get_search_query(request)
+        if query is None:
+            return queryset
+
+        # ts_rank возвращает real, приводим к double precision, чтобы значение в курсоре пагинации
+        # без потерь сравнивалось с рангом в БД.
+        rank = Cast(SearchRank(F('search_document'), query), FloatField())
+        return queryset.filter(search_document=query).annotate(rank=rank).order_by('-rank', '-id')
+
+    def get_ordering(self, request, queryset, view):
+        """Сортировка для пагинации: по убыванию релевантности."""
+        if self.get_search_query(request) is None:
+            return None
+        return ('-rank', '-id')
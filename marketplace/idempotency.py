@@ -0,0 +1,71 @@
+import hashlib
+import json
+from datetime import timedelta
+
+from django.conf import settings
+from django.core.serializers.json import DjangoJSONEncoder
+from django.db import connection, transaction
+from django.utils import timezone
+from rest_framework.exceptions import ValidationError
+from rest_framework.response import Response
+from rest_framework.status import HTTP_422_UNPROCESSABLE_ENTITY
+
+from marketplace.models import IdempotencyKey
+
+IDEMPOTENCY_HEADER = 'Idempotency-Key'
+
+
+def advisory_lock_id(*parts):
+    """ 64-битный идентификатор advisory lock из частей ключа. """
+    digest = hashlib.md5(':'.join(map(str, parts)).encode('utf-8')).digest()
+    return int.from_bytes(digest[:8], 'big', signed=True)
+
+
+def request_hash(data):
+    return hashlib.sha256(json.dumps(data, sort_keys=True, cls=DjangoJSONEncoder).encode('utf-8')).hexdigest()
+
+
+class IdempotentCreateMixin:
+    """
+    Поддержка заголовка Idempotency-Key для create.
+
+    Первый запрос с ключом выполняется, успешный ответ сохраняется в IdempotencyKey; повтор с тем же ключом
+    в течение IDEMPOTENCY_KEY_TTL получает сохранённый ответ без повторной записи. Одновременные запросы
+    с одним ключом выполняются по очереди: транзакционный advisory lock по (scope, пользователь, ключ)
+    удерживается до коммита, поэтому второй запрос уже видит сохранённый ответ.
+    """
+
+    def create(self, request, *args, **kwargs):
+        return self.idempotent_response(super().create, request, *args, **kwargs)
+
+    def idempotent_response(self, handler, request, *args, **kwargs):
+        key = request.headers.get(IDEMPOTENCY_HEADER)
+        if key is None or not request.user.is_authenticated:
+            return handler(request, *args, **kwargs)
+        if not 0 < len(key) <= IdempotencyKey._meta.get_field('key').max_length:
+            raise ValidationError({IDEMPOTENCY_HEADER: ['Ensure this value has 1 to 255 characters.']})
+
+        scope, digest = self.basename, request_hash(request.data)
+        with transaction.atomic():
+            with connection.cursor() as cursor:
+                cursor.execute('SELECT pg_advisory_xact_lock(%s)', [advisory_lock_id(scope, request.user.pk, key)])
+
+            stored = IdempotencyKey.objects.filter(user=request.user, scope=scope, key=key).first()
+            expired = timezone.now() - timedelta(seconds=settings.IDEMPOTENCY_KEY_TTL)
+            if stored is not None and stored.created_at >= expired:
+                if stored.request_hash != digest:
+                    return Response(
+                        {'detail': f'{IDEMPOTENCY_HEADER} has already been used with a different request.'},
+                        status=HTTP_422_UNPROCESSABLE_ENTITY
+                    )
+                return Response(stored.response, status=stored.status_code, headers={'Idempotent-Replayed': 'true'})
+
+            response = handler(request, *args, **kwargs)
+            if 200 <= response.status_code < 300:
+                if stored is not None:
+                    stored.delete()
+                IdempotencyKey.objects.create(
+                    user=request.user, scope=scope, key=key, request_hash=digest,
+                    status_code=response.status_code, response=response.data
+                )
+        return response
@@ -0,0 +1,106 @@
+import logging
+from datetime import timedelta
+
+from django.db import DatabaseError, transaction
+from django.db.models import Q
+from django.http import HttpRequest
+from django.utils import timezone
+from rest_framework.exceptions import ValidationError
+from rest_framework.request import Request
+
+from marketplace.models import OrderTicket
+from marketplace.serializers import OrderSerializer
+
+ORDER_TICKET_BATCH_SIZE = 100
+# Заявка в статусе PROCESSING дольше этого времени считается брошенной (воркер упал) и разбирается снова.
+ORDER_TICKET_LEASE = timedelta(minutes=5)
+
+logger = logging.getLogger(__name__)
+
+
+def is_async_intake(request, default=False):
+    """ Асинхронный приём заказа включён настройкой или запрошен заголовком `Prefer: respond-async`. """
+    preferences = request.headers.get('Prefer', '')
+    return default or any(
+        preference.split(';')[0].strip().lower() == 'respond-async' for preference in preferences.split(',')
+    )
+
+
+def intake_request(user):
+    """ Запрос от имени автора заявки, в контексте которого OrderSerializer создаёт заказ. """
+    http_request = HttpRequest()
+    http_request.method = 'POST'
+    request = Request(http_request)
+    request.user = user
+    return request
+
+
+def process_ticket(ticket):
+    """ Создаёт заказ по заявке через OrderSerializer и записывает результат в заявку. """
+    serializer = OrderSerializer(data=ticket.payload, context={'request': intake_request(ticket.creator)})
+    try:
+        with transaction.atomic():
+            if serializer.is_valid():
+                ticket.order = serializer.save()
+                ticket.status, ticket.errors = OrderTicket.TicketStatus.DONE, None
+            else:
+                ticket.status, ticket.errors = OrderTicket.TicketStatus.FAILED, serializer.errors
+    except ValidationError as exc:
+        # Ошибки при записи заказа, например нехватка остатка при резервировании
+        ticket.status, ticket.errors = OrderTicket.TicketStatus.FAILED, exc.detail
+    except DatabaseError as exc:
+        ticket.status, ticket.errors = OrderTicket.TicketStatus.FAILED, {'non_field_errors': [str(exc)]}
+    except Exception:
+        # Заявка, на которой падает обработка, не должна возвращаться в очередь и разбираться бесконечно.
+        logger.exception('Order ticket %s failed', ticket.pk)
+        ticket.status, ticket.errors = OrderTicket.TicketStatus.FAILED, {'non_field_errors': ['Internal error.']}
+    ticket.save(update_fields=['order', 'status', 'errors', 'updated_at'])
+
+
+def claim_order_tickets(batch_size=ORDER_TICKET_BATCH_SIZE):
+    """
+    Забирает до batch_size заявок из очереди в короткой транзакции: переводит их в PROCESSING и возвращает id.
+
+    Заявки выбираются через SELECT ... FOR UPDATE SKIP LOCKED, поэтому параллельные воркеры не ждут
+    друг друга и не забирают одну заявку дважды. Заявки, брошенные упавшим воркером, забираются снова
+    через ORDER_TICKET_LEASE.
+    """
+    now = timezone.now()
+    with transaction.atomic():
+        ids = list(
+            OrderTicket.objects
+            .select_for_update(skip_locked=True)
+            .filter(
+                Q(status=OrderTicket.TicketStatus.PENDING)
+                | Q(status=OrderTicket.TicketStatus.PROCESSING, updated_at__lt=now - ORDER_TICKET_LEASE)
+            )
+            .order_by('id')
+            .values_list('id', flat=True)[:batch_size]
+        )
+        OrderTicket.objects.filter(id__in=ids).update(status=OrderTicket.TicketStatus.PROCESSING, updated_at=now)
+    return ids
+
+
+def process_order_tickets(batch_size=ORDER_TICKET_BATCH_SIZE):
+    """
+    Обрабатывает до batch_size заявок из очереди и возвращает количество обработанных.
+
+    Каждая заявка обрабатывается в своей транзакции вместе с созданием заказа, поэтому блокировки строк
+    товаров при резервировании держатся только до коммита этой заявки, а ошибка одной заявки не откатывает
+    остальные. Строка заявки блокируется на время обработки: заявку, которую забрали повторно после
+    ORDER_TICKET_LEASE, пока её ещё обрабатывает другой воркер, пропускают.
+    """
+    processed = 0
+    for pk in claim_order_tickets(batch_size):
+        with transaction.atomic():
+            ticket = (
+                OrderTicket.objects
+                .select_related('creator')
+                .select_for_update(skip_locked=True, of=('self',))
+                .filter(pk=pk, status=OrderTicket.TicketStatus.PROCESSING)
+                .first()
+            )
+            if ticket is not None:
+                process_ticket(ticket)
+                processed += 1
+    return processed
@@ -0,0 +1,22 @@
+from django.db.models import FloatField, Func, Value
+from django.db.models.lookups import PostgresOperatorLookup
+
+
+class TrigramWordSimilar(PostgresOperatorLookup):
+    """
+    `field %> 'строка'`: в поле есть слово, похожее на строку (pg_trgm word_similarity).
+    Поддерживается GIN индексом с gin_trgm_ops. В Django 3.2 такого lookup ещё нет.
+    """
+    lookup_name = 'trigram_word_similar'
+    postgres_operator = '%%>'
+
+
+class TrigramWordSimilarity(Func):
+    """ word_similarity('строка', field): похожесть строки на наиболее близкое слово поля. """
+    function = 'WORD_SIMILARITY'
+    output_field = FloatField()
+
+    def __init__(self, string, expression, **extra):
+        if not hasattr(string, 'resolve_expression'):
+            string = Value(string)
+        super().__init__(string, expression, **extra)
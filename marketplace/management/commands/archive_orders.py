@@ -0,0 +1,33 @@
+from datetime import timedelta
+
+from django.core.management.base import BaseCommand
+from django.utils import timezone
+
+from marketplace.archive import archive_order_batch
+from marketplace.models import Order
+
+
+class Command(BaseCommand):
+    help = (
+        'Переносит выполненные заказы старше --days дней вместе с позициями в архивные таблицы. '
+        'Архивные заказы доступны в API при фильтре по дате.'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--days', type=int, default=90, help='Возраст заказа (по дате создания) в днях.')
+        parser.add_argument(
+            '--batch-size', type=int, default=1000,
+            help='Количество заказов, переносимых одной транзакцией.'
+        )
+
+    def handle(self, *args, **options):
+        cutoff = timezone.now() - timedelta(days=options['days'])
+
+        archived = 0
+        while True:
+            moved = archive_order_batch(Order.OrderStatus.DONE, cutoff, options['batch_size'])
+            if not moved:
+                break
+            archived += moved
+
+        self.stdout.write(self.style.SUCCESS(f'Перенесено в архив заказов: {archived}.'))
@@ -0,0 +1,46 @@
+from django.core.management.base import BaseCommand
+from django.db import connection, transaction
+
+from marketplace.models import OrderProduct
+
+# Заполнение цены и стоимости позиций из диапазона id, у которых они не заданы.
+# Для заказа из одной позиции цена восстанавливается точно из суммы заказа,
+# для остальных берётся текущая цена товара (историческая цена не сохранилась).
+BACKFILL_SQL = """
+    UPDATE marketplace_orderproduct AS op
+    SET (unit_price, line_total) = (
+        SELECT CASE WHEN count(*) = 1 THEN round(o.amount / op.quantity, 2) ELSE p.price END,
+               CASE WHEN count(*) = 1 THEN o.amount ELSE p.price * op.quantity END
+        FROM marketplace_orderproduct AS other
+        WHERE other.order_id = op.order_id
+    )
+    FROM marketplace_product AS p, marketplace_order AS o
+    WHERE op.id >= %(start)s AND op.id < %(stop)s AND op.unit_price IS NULL
+      AND p.id = op.product_id AND o.id = op.order_id
+"""
+
+
+class Command(BaseCommand):
+    help = 'Заполняет цену на момент заказа (unit_price) и стоимость (line_total) у позиций заказов без них.'
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--batch-size', type=int, default=10000,
+            help='Количество позиций (по диапазону id), заполняемых одним запросом.'
+        )
+
+    def handle(self, *args, **options):
+        batch_size = options['batch_size']
+        bounds = OrderProduct.objects.filter(unit_price__isnull=True).order_by('id').values_list('id', flat=True)
+        first, last = bounds.first(), bounds.last()
+        if first is None:
+            self.stdout.write('Нет позиций без цены.')
+            return
+
+        filled = 0
+        for start in range(first, last + 1, batch_size):
+            with transaction.atomic(), connection.cursor() as cursor:
+                cursor.execute(BACKFILL_SQL, {'start': start, 'stop': start + batch_size})
+                filled += cursor.rowcount
+
+        self.stdout.write(self.style.SUCCESS(f'Заполнены цены у {filled} позиций заказов.'))
@@ -0,0 +1,184 @@
+import csv
+import io
+import json
+import sys
+import time
+from itertools import islice
+
+from django.core.management.base import BaseCommand, CommandError
+from django.db import DatabaseError, connection, transaction
+from django.db.models.expressions import RawSQL
+
+from marketplace.cache import bump_version
+from marketplace.models import Product
+
+COLUMNS = ('id', 'title', 'description', 'price')
+
+CREATE_STAGING_SQL = """
+    CREATE TEMP TABLE import_product (
+        line bigint NOT NULL, id bigint, title text, description text, price numeric
+    ) ON COMMIT DROP;
+    CREATE TEMP TABLE import_product_merged (id bigint NOT NULL) ON COMMIT DROP;
+"""
+
+COPY_SQL = 'COPY import_product (line, id, title, description, price) FROM STDIN WITH (FORMAT csv)'
+
+# Строки, которые не пройдут валидаторы модели Product.
+INVALID_ROWS_SQL = """
+    SELECT line FROM import_product
+    WHERE title IS NULL OR length(title) > 255 OR price IS NULL OR price < 0 OR price > 100000
+    ORDER BY line LIMIT 10
+"""
+
+# Последовательность id сдвигается за явно заданные в файле id до слияния, иначе nextval для строк без id
+# может выдать id новой строки того же INSERT.
+SEQUENCE_SQL = """
+    SELECT setval(seq, greatest(coalesce(pg_sequence_last_value(seq), 0), max_id))
+    FROM (
+        SELECT pg_get_serial_sequence('marketplace_product', 'id')::regclass AS seq, max(id) AS max_id
+        FROM import_product
+    ) AS source
+    WHERE max_id > 0
+"""
+
+# Новые товары (без id или с несуществующим id) добавляются, существующие обновляются, если изменились.
+# При повторе id в файле используется последняя строка.
+MERGE_SQL = """
+    WITH source AS (
+        SELECT id, title, description, price FROM import_product WHERE id IS NULL
+        UNION ALL
+        SELECT * FROM (
+            SELECT DISTINCT ON (id) id, title, description, price
+            FROM import_product WHERE id IS NOT NULL ORDER BY id, line DESC
+        ) AS with_id
+    ), merged AS (
+        INSERT INTO marketplace_product (
+            id, created_at, updated_at, title, description, price, review_count, mark_sum,
+            mark_1_count, mark_2_count, mark_3_count, mark_4_count, mark_5_count
+        )
+        SELECT coalesce(id, nextval(pg_get_serial_sequence('marketplace_product', 'id'))), now(), now(),
+               title, coalesce(description, ''), price, 0, 0, 0, 0, 0, 0, 0
+        FROM source
+        ON CONFLICT (id) DO UPDATE
+        SET title = excluded.title, description = excluded.description, price = excluded.price,
+            updated_at = excluded.updated_at
+        WHERE (marketplace_product.title, marketplace_product.description, marketplace_product.price)
+              IS DISTINCT FROM (excluded.title, excluded.description, excluded.price)
+        RETURNING id
+    )
+    INSERT INTO import_product_merged (id) SELECT id FROM merged
+"""
+
+
+def read_csv(file):
+    for row in csv.DictReader(file):
+        yield tuple(row.get(column) for column in COLUMNS)
+
+
+def read_ndjson(file):
+    for number, line in enumerate(file, start=1):
+        if not line.strip():
+            continue
+        try:
+            row = json.loads(line)
+        except ValueError as exc:
+            raise CommandError(f'Строка {number}: некорректный JSON - {exc}')
+        if not isinstance(row, dict):
+            raise CommandError(f'Строка {number}: ожидается JSON объект.')
+        yield tuple(row.get(column) for column in COLUMNS)
+
+
+READERS = {'csv': read_csv, 'ndjson': read_ndjson}
+
+
+class Command(BaseCommand):
+    help = (
+        'Загружает каталог товаров из CSV (с заголовком) или NDJSON файла с полями id, title, description, price. '
+        'Строки с существующим id обновляют товар, остальные добавляются.'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('path', help='Путь к файлу или "-" для чтения из stdin.')
+        parser.add_argument(
+            '--format', choices=sorted(READERS),
+            help='Формат файла. По умолчанию определяется по расширению (.csv, .ndjson, .jsonl).'
+        )
+        parser.add_argument(
+            '--batch-size', type=int, default=50000,
+            help='Количество строк, передаваемых одной командой COPY (и между сообщениями о прогрессе).'
+        )
+
+    def get_format(self, path, file_format):
+        if file_format:
+            return file_format
+        if path.endswith('.csv'):
+            return 'csv'
+        if path.endswith(('.ndjson', '.jsonl')):
+            return 'ndjson'
+        raise CommandError('Не удалось определить формат файла, укажите --format.')
+
+    def handle(self, *args, **options):
+        path, batch_size = options['path'], options['batch_size']
+        reader = READERS[self.get_format(path, options['format'])]
+
+        file = sys.stdin if path == '-' else open(path, newline='', encoding='utf-8')
+        try:
+            with transaction.atomic():
+                loaded = self.copy_rows(reader(file), batch_size)
+                merged = self.merge()
+        finally:
+            if file is not sys.stdin:
+                file.close()
+
+        with connection.cursor() as cursor:
+            cursor.execute('ANALYZE marketplace_product')
+        bump_version('product')
+        self.stdout.write(self.style.SUCCESS(f'Загружено строк: {loaded}, добавлено или изменено товаров: {merged}.'))
+
+    def copy_rows(self, rows, batch_size):
+        """ Передаёт строки во временную таблицу пачками через COPY FROM STDIN. """
+        loaded, started = 0, time.monotonic()
+        with connection.cursor() as cursor:
+            cursor.execute(CREATE_STAGING_SQL)
+            while True:
+                batch = list(islice(rows, batch_size))
+                if not batch:
+                    break
+                buffer = io.StringIO()
+                writer = csv.writer(buffer)
+                for line, row in enumerate(batch, start=loaded + 1):
+                    writer.writerow((line, *row))
+                buffer.seek(0)
+                try:
+                    with connection.wrap_database_errors:
+                        cursor.copy_expert(COPY_SQL, buffer)
+                except DatabaseError as exc:
+                    raise CommandError(f'Ошибка загрузки строк {loaded + 1}-{loaded + len(batch)}: {exc}')
+
+                loaded += len(batch)
+                elapsed = time.monotonic() - started
+                self.stdout.write(f'Загружено {loaded} строк, {loaded / elapsed:.0f} строк/сек')
+
+            cursor.execute(INVALID_ROWS_SQL)
+            invalid = [line for line, in cursor.fetchall()]
+            if invalid:
+                raise CommandError(
+                    'Некорректные название или цена в строках: ' + ', '.join(map(str, invalid))
+                )
+        return loaded
+
+    def merge(self):
+        """ Переносит строки в marketplace_product одним INSERT ... ON CONFLICT и обновляет производные данные. """
+        started = time.monotonic()
+        with connection.cursor() as cursor:
+            cursor.execute(SEQUENCE_SQL)
+            cursor.execute(MERGE_SQL)
+            merged = cursor.rowcount
+        self.stdout.write(f'Объединение с каталогом: {merged} товаров за {time.monotonic() - started:.1f} сек')
+
+        # Поисковые документы пересчитываются одним UPDATE для всех изменённых товаров.
+        # Агрегаты рейтинга новых товаров нулевые, у существующих не меняются.
+        started = time.monotonic()
+        Product.objects.filter(pk__in=RawSQL('SELECT id FROM import_product_merged', [])).update_search_document()
+        self.stdout.write(f'Поисковые документы обновлены за {time.monotonic() - started:.1f} сек')
+        return merged
@@ -0,0 +1,60 @@
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+from django.core.management.base import BaseCommand
+from django.db import connection
+
+from marketplace.intake import process_order_tickets, ORDER_TICKET_BATCH_SIZE
+
+
+class Command(BaseCommand):
+    help = (
+        'Обрабатывает очередь заявок на создание заказов, принятых в асинхронном режиме. '
+        'Несколько воркеров в потоках разбирают очередь пачками, не мешая друг другу (FOR UPDATE SKIP LOCKED).'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--workers', type=int, default=4, help='Количество параллельных воркеров.')
+        parser.add_argument(
+            '--batch-size', type=int, default=ORDER_TICKET_BATCH_SIZE,
+            help='Количество заявок, которые воркер забирает из очереди за раз.'
+        )
+        parser.add_argument(
+            '--poll-interval', type=float, default=1.0,
+            help='Пауза в секундах, если очередь пуста.'
+        )
+        parser.add_argument('--once', action='store_true', help='Завершиться, когда очередь опустеет.')
+
+    def handle(self, *args, **options):
+        self.stop = threading.Event()
+        self.lock = threading.Lock()
+        self.processed = 0
+        started = time.monotonic()
+
+        with ThreadPoolExecutor(max_workers=options['workers']) as pool:
+            futures = [pool.submit(self.work, options) for _ in range(options['workers'])]
+            try:
+                for future in futures:
+                    future.result()
+            except KeyboardInterrupt:
+                self.stop.set()
+
+        elapsed = time.monotonic() - started
+        self.stdout.write(self.style.SUCCESS(
+            f'Обработано заявок: {self.processed} за {elapsed:.1f} сек ({self.processed / elapsed:.0f} в сек).'
+        ))
+
+    def work(self, options):
+        """ Цикл воркера. У каждого потока своё соединение с БД, оно закрывается при выходе. """
+        try:
+            while not self.stop.is_set():
+                processed = process_order_tickets(options['batch_size'])
+                with self.lock:
+                    self.processed += processed
+                if not processed:
+                    if options['once']:
+                        return
+                    self.stop.wait(options['poll_interval'])
+        finally:
+            connection.close()
@@ -0,0 +1,31 @@
+from datetime import timedelta
+
+from django.conf import settings
+from django.core.management.base import BaseCommand
+from django.utils import timezone
+
+from marketplace.models import IdempotencyKey
+
+
+class Command(BaseCommand):
+    help = 'Удаляет сохранённые ответы Idempotency-Key старше IDEMPOTENCY_KEY_TTL.'
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--batch-size', type=int, default=10000,
+            help='Количество ключей, удаляемых одним запросом.'
+        )
+
+    def handle(self, *args, **options):
+        expired = IdempotencyKey.objects.filter(
+            created_at__lt=timezone.now() - timedelta(seconds=settings.IDEMPOTENCY_KEY_TTL)
+        )
+
+        deleted = 0
+        while True:
+            batch = list(expired.order_by('created_at').values_list('pk', flat=True)[:options['batch_size']])
+            if not batch:
+                break
+            deleted += IdempotencyKey.objects.filter(pk__in=batch).delete()[0]
+
+        self.stdout.write(self.style.SUCCESS(f'Удалено ключей идемпотентности: {deleted}.'))
@@ -0,0 +1,62 @@
+from django.core.management.base import BaseCommand
+from django.db import connection, transaction
+
+from marketplace.cache import bump_version
+from marketplace.models import Product
+
+# Пересчёт агрегатов для товаров из диапазона id, у которых они разошлись с отзывами.
+REBUILD_SQL = """
+    UPDATE marketplace_product AS p
+    SET review_count = coalesce(r.review_count, 0), mark_sum = coalesce(r.mark_sum, 0),
+        mark_1_count = coalesce(r.mark_1_count, 0), mark_2_count = coalesce(r.mark_2_count, 0),
+        mark_3_count = coalesce(r.mark_3_count, 0), mark_4_count = coalesce(r.mark_4_count, 0),
+        mark_5_count = coalesce(r.mark_5_count, 0)
+    FROM marketplace_product AS src
+    LEFT JOIN (
+        SELECT product_id, count(*) AS review_count, sum(mark) AS mark_sum,
+               count(*) FILTER (WHERE mark = 1) AS mark_1_count,
+               count(*) FILTER (WHERE mark = 2) AS mark_2_count,
+               count(*) FILTER (WHERE mark = 3) AS mark_3_count,
+               count(*) FILTER (WHERE mark = 4) AS mark_4_count,
+               count(*) FILTER (WHERE mark = 5) AS mark_5_count
+        FROM marketplace_review
+        WHERE product_id >= %(start)s AND product_id < %(stop)s
+        GROUP BY product_id
+    ) AS r ON r.product_id = src.id
+    WHERE p.id = src.id AND src.id >= %(start)s AND src.id < %(stop)s
+      AND (p.review_count, p.mark_sum, p.mark_1_count, p.mark_2_count, p.mark_3_count, p.mark_4_count,
+           p.mark_5_count)
+          IS DISTINCT FROM
+          (coalesce(r.review_count, 0), coalesce(r.mark_sum, 0), coalesce(r.mark_1_count, 0),
+           coalesce(r.mark_2_count, 0), coalesce(r.mark_3_count, 0), coalesce(r.mark_4_count, 0),
+           coalesce(r.mark_5_count, 0))
+"""
+
+
+class Command(BaseCommand):
+    help = 'Пересчитывает агрегаты рейтинга товаров (количество отзывов, сумма и распределение оценок).'
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--batch-size', type=int, default=10000,
+            help='Количество товаров (по диапазону id), пересчитываемых одним запросом.'
+        )
+
+    def handle(self, *args, **options):
+        batch_size = options['batch_size']
+        bounds = Product.objects.order_by('id').values_list('id', flat=True)
+        first, last = bounds.first(), bounds.last()
+        if first is None:
+            self.stdout.write('Нет товаров.')
+            return
+
+        fixed = 0
+        for start in range(first, last + 1, batch_size):
+            with transaction.atomic(), connection.cursor() as cursor:
+                cursor.execute(REBUILD_SQL, {'start': start, 'stop': start + batch_size})
+                fixed += cursor.rowcount
+        # UPDATE в обход ORM не вызывает сигналы, поэтому закешированные рейтинги сбрасываются явно.
+        if fixed:
+            bump_version('product')
+
+        self.stdout.write(self.style.SUCCESS(f'Исправлены агрегаты рейтинга у {fixed} товаров.'))
@@ -0,0 +1,23 @@
+from django.core.management.base import BaseCommand
+
+from marketplace.analytics import refresh_sales
+
+
+class Command(BaseCommand):
+    help = (
+        'Пересчитывает аналитику продаж (по дням, товарам и статусам) за дни, в которые менялись заказы '
+        'с прошлого запуска.'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--full', action='store_true',
+            help='Пересчитать все дни, например после первого развёртывания или backfill_order_prices.'
+        )
+
+    def handle(self, *args, **options):
+        days = refresh_sales(full=options['full'])
+        if days:
+            self.stdout.write(self.style.SUCCESS(f'Пересчитано дней: {len(days)} ({days[0]} — {days[-1]}).'))
+        else:
+            self.stdout.write(self.style.SUCCESS('Изменений нет.'))
@@ -0,0 +1,88 @@
+from django.db import connection
+from django.utils import timezone
+
+from marketplace.cache import bump_version
+
+# Добавление товаров в подборку одним запросом. Строки вставляются, только если найдены все товары,
+# уже входящие в подборку пропускаются. Дата изменения подборки (по часам приложения, как auto_now)
+# обновляется, если что-то добавлено.
+ADD_PRODUCTS_SQL = """
+    WITH found AS (
+        SELECT id FROM marketplace_product WHERE id = ANY(%(ids)s)
+    ), added AS (
+        INSERT INTO marketplace_collection_products (collection_id, product_id)
+        SELECT %(collection)s, id FROM found
+        WHERE (SELECT count(*) FROM found) = cardinality(%(ids)s::bigint[])
+        ORDER BY id
+        ON CONFLICT (collection_id, product_id) DO NOTHING
+        RETURNING product_id
+    ), touched AS (
+        UPDATE marketplace_collection SET updated_at = %(now)s
+        WHERE id = %(collection)s AND EXISTS (SELECT 1 FROM added)
+    )
+    SELECT array(SELECT id FROM found), array(SELECT product_id FROM added ORDER BY product_id)
+"""
+
+# Удаление товаров из подборки одним запросом. Подборка не может остаться пустой: если удаление
+# затрагивает все её товары, ничего не удаляется.
+REMOVE_PRODUCTS_SQL = """
+    WITH remaining AS (
+        SELECT EXISTS (
+            SELECT 1 FROM marketplace_collection_products
+            WHERE collection_id = %(collection)s AND product_id <> ALL(%(ids)s)
+        ) AS value
+    ), removed AS (
+        DELETE FROM marketplace_collection_products
+        WHERE collection_id = %(collection)s AND product_id = ANY(%(ids)s) AND (SELECT value FROM remaining)
+        RETURNING product_id
+    ), touched AS (
+        UPDATE marketplace_collection SET updated_at = %(now)s
+        WHERE id = %(collection)s AND EXISTS (SELECT 1 FROM removed)
+    )
+    SELECT (SELECT value FROM remaining), array(SELECT product_id FROM removed ORDER BY product_id)
+"""
+
+# Удаление товаров из подборки без проверок, сигналов post_delete и чтения удаляемых строк.
+DELETE_PRODUCTS_SQL = 'DELETE FROM marketplace_collection_products WHERE collection_id = %s AND product_id = ANY(%s)'
+
+
+def add_collection_products(collection_id, product_ids):
+    """
+    Добавляет товары в подборку. Возвращает (id добавленных товаров, id несуществующих товаров):
+    если хотя бы одного товара нет, ничего не добавляется.
+    """
+    ids = sorted(set(product_ids))
+    with connection.cursor() as cursor:
+        cursor.execute(ADD_PRODUCTS_SQL, {'collection': collection_id, 'ids': ids, 'now': timezone.now()})
+        found, added = cursor.fetchone()
+
+    if added:
+        bump_version('collection')
+    return added, sorted(set(ids).difference(found))
+
+
+def remove_collection_products(collection_id, product_ids):
+    """
+    Удаляет товары из подборки. Возвращает id удалённых товаров или None, если подборка осталась бы пустой.
+    Товары, которых нет в подборке, пропускаются.
+    """
+    with connection.cursor() as cursor:
+        cursor.execute(REMOVE_PRODUCTS_SQL, {
+            'collection': collection_id, 'ids': sorted(set(product_ids)), 'now': timezone.now()
+        })
+        remaining, removed = cursor.fetchone()
+
+    if not remaining:
+        return None
+    if removed:
+        bump_version('collection')
+    return removed
+
+
+def delete_collection_products(collection_id, product_ids):
+    """
+    Удаляет товары из подборки одним DELETE. Версию данных подборок сбрасывает вызывающий код
+    (например, сохранением подборки).
+    """
+    with connection.cursor() as cursor:
+        cursor.execute(DELETE_PRODUCTS_SQL, [collection_id, sorted(product_ids)])
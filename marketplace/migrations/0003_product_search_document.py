@@ -0,0 +1,35 @@
+# Generated by Django 3.2.25 on 2026-10-18 19:09
+
+import django.contrib.postgres.indexes
+import django.contrib.postgres.search
+from django.db import migrations
+
+
+def fill_search_document(apps, schema_editor):
+    Product = apps.get_model('marketplace', 'Product')
+    Product.objects.update(
+        search_document=(
+            django.contrib.postgres.search.SearchVector('title', weight='A', config='russian')
+            + django.contrib.postgres.search.SearchVector('description', weight='B', config='russian')
+        )
+    )
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('marketplace', '0002_keyset_pagination_indexes'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='product',
+            name='search_document',
+            field=django.contrib.postgres.search.SearchVectorField(editable=False, null=True),
+        ),
+        migrations.AddIndex(
+            model_name='product',
+            index=django.contrib.postgres.indexes.GinIndex(fields=['search_document'], name='product_search_document_idx'),
+        ),
+        migrations.RunPython(fill_search_document, migrations.RunPython.noop),
+    ]
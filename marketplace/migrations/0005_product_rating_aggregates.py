@@ -0,0 +1,74 @@
+# Generated by Django 3.2.25 on 2026-10-18 19:13
+
+from django.db import migrations, models
+import django.db.models.expressions
+import django.db.models.functions.comparison
+
+
+FILL_RATING_AGGREGATES = '''
+    UPDATE marketplace_product AS p
+    SET review_count = r.review_count, mark_sum = r.mark_sum,
+        mark_1_count = r.mark_1_count, mark_2_count = r.mark_2_count, mark_3_count = r.mark_3_count,
+        mark_4_count = r.mark_4_count, mark_5_count = r.mark_5_count
+    FROM (
+        SELECT product_id, count(*) AS review_count, sum(mark) AS mark_sum,
+               count(*) FILTER (WHERE mark = 1) AS mark_1_count,
+               count(*) FILTER (WHERE mark = 2) AS mark_2_count,
+               count(*) FILTER (WHERE mark = 3) AS mark_3_count,
+               count(*) FILTER (WHERE mark = 4) AS mark_4_count,
+               count(*) FILTER (WHERE mark = 5) AS mark_5_count
+        FROM marketplace_review
+        GROUP BY product_id
+    ) AS r
+    WHERE p.id = r.product_id
+'''
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('marketplace', '0004_product_title_trigram_index'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='product',
+            name='mark_1_count',
+            field=models.IntegerField(default=0, editable=False, verbose_name='Оценок 1'),
+        ),
+        migrations.AddField(
+            model_name='product',
+            name='mark_2_count',
+            field=models.IntegerField(default=0, editable=False, verbose_name='Оценок 2'),
+        ),
+        migrations.AddField(
+            model_name='product',
+            name='mark_3_count',
+            field=models.IntegerField(default=0, editable=False, verbose_name='Оценок 3'),
+        ),
+        migrations.AddField(
+            model_name='product',
+            name='mark_4_count',
+            field=models.IntegerField(default=0, editable=False, verbose_name='Оценок 4'),
+        ),
+        migrations.AddField(
+            model_name='product',
+            name='mark_5_count',
+            field=models.IntegerField(default=0, editable=False, verbose_name='Оценок 5'),
+        ),
+        migrations.AddField(
+            model_name='product',
+            name='mark_sum',
+            field=models.IntegerField(default=0, editable=False, verbose_name='Сумма оценок'),
+        ),
+        migrations.AddField(
+            model_name='product',
+            name='review_count',
+            field=models.IntegerField(default=0, editable=False, verbose_name='Количество отзывов'),
+        ),
+        migrations.RunSQL(FILL_RATING_AGGREGATES, migrations.RunSQL.noop),
+        migrations.AddIndex(
+            model_name='product',
+            index=models.Index(django.db.models.functions.comparison.Coalesce(django.db.models.expressions.CombinedExpression(django.db.models.functions.comparison.Cast('mark_sum', models.FloatField()), '/', django.db.models.functions.comparison.NullIf('review_count', 0)), django.db.models.expressions.Value(0.0)), django.db.models.expressions.F('id'), name='product_rating_id_idx'),
+        ),
+    ]
@@ -0,0 +1,43 @@
+# Generated by Django 3.2.25 on 2026-10-18 19:28
+
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('marketplace', '0007_review_updated_at_index'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='orderproduct',
+            name='line_total',
+            field=models.DecimalField(decimal_places=2, editable=False, max_digits=12, null=True, verbose_name='Стоимость'),
+        ),
+        migrations.AddField(
+            model_name='orderproduct',
+            name='unit_price',
+            field=models.DecimalField(decimal_places=2, editable=False, max_digits=9, null=True, verbose_name='Цена'),
+        ),
+        migrations.AddIndex(
+            model_name='orderproduct',
+            index=models.Index(fields=['order'], include=('line_total',), name='orderproduct_order_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='orderproduct',
+            index=models.Index(fields=['product', 'order'], include=('quantity', 'line_total'), name='orderproduct_product_idx'),
+        ),
+        # Старые индексы внешних ключей удаляются после создания покрывающих индексов с теми же ведущими колонками.
+        migrations.AlterField(
+            model_name='orderproduct',
+            name='order',
+            field=models.ForeignKey(db_index=False, on_delete=django.db.models.deletion.CASCADE, related_name='positions', to='marketplace.order'),
+        ),
+        migrations.AlterField(
+            model_name='orderproduct',
+            name='product',
+            field=models.ForeignKey(db_index=False, on_delete=django.db.models.deletion.CASCADE, to='marketplace.product'),
+        ),
+    ]
@@ -0,0 +1,37 @@
+# Generated by Django 3.2.25 on 2026-10-18 19:32
+
+from django.conf import settings
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+        ('marketplace', '0008_order_product_price_snapshot'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='OrderTicket',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('created_at', models.DateTimeField(auto_now_add=True, verbose_name='Дата создания')),
+                ('updated_at', models.DateTimeField(auto_now=True, verbose_name='Дата обновления')),
+                ('payload', models.JSONField(verbose_name='Данные заказа')),
+                ('status', models.TextField(choices=[('PENDING', 'Ожидает обработки'), ('DONE', 'Заказ создан'), ('FAILED', 'Ошибка')], default='PENDING', verbose_name='Статус')),
+                ('errors', models.JSONField(blank=True, null=True, verbose_name='Ошибки')),
+                ('creator', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, to=settings.AUTH_USER_MODEL, verbose_name='Пользователь')),
+                ('order', models.ForeignKey(blank=True, null=True, on_delete=django.db.models.deletion.SET_NULL, to='marketplace.order', verbose_name='Заказ')),
+            ],
+            options={
+                'verbose_name': 'Заявка на заказ',
+                'verbose_name_plural': 'Заявки на заказ',
+            },
+        ),
+        migrations.AddIndex(
+            model_name='orderticket',
+            index=models.Index(condition=models.Q(('status', 'PENDING')), fields=['id'], name='orderticket_pending_idx'),
+        ),
+    ]
@@ -0,0 +1,123 @@
+# Generated by Django 3.2.25 on 2026-10-18 19:45
+
+from django.conf import settings
+from django.db import migrations, models
+import django.db.models.deletion
+
+# Представления всех заказов и позиций: условия запросов PostgreSQL переносит в обе ветви UNION ALL,
+# поэтому они выполняются по индексам marketplace_order и marketplace_archivedorder.
+HISTORY_SQL = """
+    CREATE VIEW marketplace_orderhistory AS
+        SELECT id, created_at, updated_at, amount, status, creator_id, false AS archived
+        FROM marketplace_order
+        UNION ALL
+        SELECT id, created_at, updated_at, amount, status, creator_id, true AS archived
+        FROM marketplace_archivedorder;
+
+    CREATE VIEW marketplace_orderhistoryproduct AS
+        SELECT id, product_id, order_id, quantity, unit_price, line_total
+        FROM marketplace_orderproduct
+        UNION ALL
+        SELECT id, product_id, order_id, quantity, unit_price, line_total
+        FROM marketplace_archivedorderproduct;
+"""
+
+DROP_HISTORY_SQL = """
+    DROP VIEW marketplace_orderhistoryproduct;
+    DROP VIEW marketplace_orderhistory;
+"""
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+        ('marketplace', '0011_sales_analytics'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='OrderHistory',
+            fields=[
+                ('id', models.BigIntegerField(primary_key=True, serialize=False)),
+                ('created_at', models.DateTimeField()),
+                ('updated_at', models.DateTimeField()),
+                ('amount', models.DecimalField(decimal_places=2, max_digits=12)),
+                ('status', models.TextField(choices=[('NEW', 'Новый'), ('IN_PROGRESS', 'В процессе'), ('DONE', 'Выполнен')])),
+                ('archived', models.BooleanField()),
+            ],
+            options={
+                'db_table': 'marketplace_orderhistory',
+                'managed': False,
+            },
+        ),
+        migrations.CreateModel(
+            name='OrderHistoryProduct',
+            fields=[
+                ('id', models.BigIntegerField(primary_key=True, serialize=False)),
+                ('quantity', models.PositiveIntegerField()),
+                ('unit_price', models.DecimalField(decimal_places=2, max_digits=9, null=True)),
+                ('line_total', models.DecimalField(decimal_places=2, max_digits=12, null=True)),
+            ],
+            options={
+                'db_table': 'marketplace_orderhistoryproduct',
+                'managed': False,
+            },
+        ),
+        migrations.CreateModel(
+            name='ArchivedOrder',
+            fields=[
+                ('id', models.BigIntegerField(primary_key=True, serialize=False)),
+                ('created_at', models.DateTimeField()),
+                ('updated_at', models.DateTimeField()),
+                ('amount', models.DecimalField(decimal_places=2, max_digits=12)),
+                ('status', models.TextField(choices=[('NEW', 'Новый'), ('IN_PROGRESS', 'В процессе'), ('DONE', 'Выполнен')])),
+                ('archived_at', models.DateTimeField(auto_now_add=True)),
+                ('creator', models.ForeignKey(db_index=False, on_delete=django.db.models.deletion.CASCADE, to=settings.AUTH_USER_MODEL)),
+            ],
+            options={
+                'verbose_name': 'Архивный заказ',
+                'verbose_name_plural': 'Архивные заказы',
+            },
+        ),
+        migrations.CreateModel(
+            name='ArchivedOrderProduct',
+            fields=[
+                ('id', models.BigIntegerField(primary_key=True, serialize=False)),
+                ('quantity', models.PositiveIntegerField()),
+                ('unit_price', models.DecimalField(decimal_places=2, max_digits=9, null=True)),
+                ('line_total', models.DecimalField(decimal_places=2, max_digits=12, null=True)),
+                ('order', models.ForeignKey(db_index=False, on_delete=django.db.models.deletion.CASCADE, related_name='positions', to='marketplace.archivedorder')),
+                ('product', models.ForeignKey(db_index=False, on_delete=django.db.models.deletion.CASCADE, to='marketplace.product')),
+            ],
+        ),
+        migrations.AddIndex(
+            model_name='archivedorderproduct',
+            index=models.Index(fields=['order'], include=('line_total',), name='archivedposition_order_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='archivedorderproduct',
+            index=models.Index(fields=['product', 'order'], include=('quantity', 'line_total'), name='archivedposition_product_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='archivedorder',
+            index=models.Index(fields=['created_at', 'id'], name='archivedorder_created_at_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='archivedorder',
+            index=models.Index(fields=['amount', 'id'], name='archivedorder_amount_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='archivedorder',
+            index=models.Index(fields=['creator', 'status', 'created_at'], name='archivedorder_creator_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='archivedorder',
+            index=models.Index(fields=['status', 'created_at', 'id'], name='archivedorder_status_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='archivedorder',
+            index=models.Index(fields=['updated_at'], name='archivedorder_updated_at_idx'),
+        ),
+        migrations.RunSQL(HISTORY_SQL, DROP_HISTORY_SQL),
+    ]
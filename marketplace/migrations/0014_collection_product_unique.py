@@ -0,0 +1,25 @@
+# Generated by Django 3.2.25 on 2026-10-18 19:58
+
+from django.db import migrations, models
+
+# Повторные строки одного товара в подборке (создание подборки их не исключало), остаётся первая.
+DELETE_DUPLICATES = '''
+    DELETE FROM marketplace_collection_products AS cp
+    USING marketplace_collection_products AS first
+    WHERE first.collection_id = cp.collection_id AND first.product_id = cp.product_id AND first.id < cp.id
+'''
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('marketplace', '0013_product_stock'),
+    ]
+
+    operations = [
+        migrations.RunSQL(DELETE_DUPLICATES, migrations.RunSQL.noop),
+        migrations.AddConstraint(
+            model_name='collectionproduct',
+            constraint=models.UniqueConstraint(fields=('collection', 'product'), name='collection_product_unique'),
+        ),
+    ]
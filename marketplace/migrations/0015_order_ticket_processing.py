@@ -0,0 +1,26 @@
+# Generated by Django 3.2.25 on 2026-10-18 20:20
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('marketplace', '0014_collection_product_unique'),
+    ]
+
+    operations = [
+        migrations.RemoveIndex(
+            model_name='orderticket',
+            name='orderticket_pending_idx',
+        ),
+        migrations.AlterField(
+            model_name='orderticket',
+            name='status',
+            field=models.TextField(choices=[('PENDING', 'Ожидает обработки'), ('PROCESSING', 'Обрабатывается'), ('DONE', 'Заказ создан'), ('FAILED', 'Ошибка')], default='PENDING', verbose_name='Статус'),
+        ),
+        migrations.AddIndex(
+            model_name='orderticket',
+            index=models.Index(condition=models.Q(('status__in', ['PENDING', 'PROCESSING'])), fields=['id'], name='orderticket_queue_idx'),
+        ),
+    ]
@@ -1,6 +1,15 @@
 from django.conf import settings
 from django.contrib.postgres import validators
-from django.db import models
+from django.contrib.postgres.indexes import GinIndex
+from django.contrib.postgres.search import SearchVector, SearchVectorField
+from django.core.serializers.json import DjangoJSONEncoder
+from django.db import connection, models
+from django.db.models import F, FloatField, Q, Sum, Value, Window
+from django.db.models.expressions import RawSQL
+from django.db.models.functions import Cast, Coalesce, NullIf, RowNumber
+
+# Конфигурация полнотекстового поиска: russian_stem для кириллицы и english_stem для латиницы.
+SEARCH_CONFIG = 'russian'
 
 
 class DateInfo(models.Model):
@@ -19,12 +28,97 @@ class DateInfo(models.Model):
     )
 
 
+class PartitionLimitQuerySet(models.QuerySet):
+    """
+    QuerySet, который оставляет первые записи каждой группы: `limit_per('collection', 20)` — не больше 20 записей
+    (в порядке queryset, по умолчанию по id) на каждую подборку. Ограничение применяется при выполнении,
+    то есть и к условию по родительским записям, которое добавляет prefetch_related, и выполняется тем же
+    запросом через row_number() OVER (PARTITION BY ...).
+    """
+
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.partition_limit = None
+
+    def _clone(self):
+        clone = super()._clone()
+        clone.partition_limit = self.partition_limit
+        return clone
+
+    def limit_per(self, field, limit):
+        clone = self._chain()
+        clone.partition_limit = (field, limit)
+        return clone
+
+    def _fetch_all(self):
+        if self._result_cache is None and self.partition_limit is not None:
+            field, limit = self.partition_limit
+            self.partition_limit = None
+            self.query = self.partition_limited(field, limit).query
+        super()._fetch_all()
+
+    def partition_limited(self, field, limit):
+        ordering = self.query.order_by or self.model._meta.ordering or ('pk',)
+        ranked = self.order_by().annotate(partition_row=Window(
+            RowNumber(),
+            partition_by=F(field),
+            order_by=[F(name.lstrip('-')).desc() if name.startswith('-') else F(name).asc() for name in ordering],
+        )).values('pk', 'partition_row')
+        sql, params = ranked.query.sql_with_params()
+        pk_column = connection.ops.quote_name(self.model._meta.pk.column)
+        return self.order_by(*ordering).filter(pk__in=RawSQL(
+            f'SELECT ranked.{pk_column} FROM ({sql}) AS ranked WHERE ranked.partition_row <= %s', (*params, limit)
+        ))
+
+
+def rating_expression():
+    """ Средняя оценка товара по агрегатам отзывов, 0 для товаров без отзывов. """
+    return Coalesce(Cast('mark_sum', FloatField()) / NullIf('review_count', 0), Value(0.0))
+
+
+class ProductQuerySet(models.QuerySet):
+    """ QuerySet для товаров """
+
+    def with_rating(self):
+        """ Добавляет аннотацию `rating` для фильтрации и сортировки. """
+        return self.annotate(rating=rating_expression())
+
+    def add_review_mark(self, mark, delta=1):
+        """
+        Учитывает (delta=1) или исключает (delta=-1) оценку отзыва в агрегатах рейтинга товаров.
+        Обновление атомарное (F-выражения), без чтения текущих значений.
+        """
+        return self.update(**{
+            'review_count': F('review_count') + delta,
+            'mark_sum': F('mark_sum') + delta * mark,
+            f'mark_{mark}_count': F(f'mark_{mark}_count') + delta,
+        })
+
+    def update_search_document(self):
+        """ Пересчитывает поисковый документ товаров одним UPDATE. Название весомее описания. """
+        return self.update(
+            search_document=(
+                SearchVector('title', weight='A', config=SEARCH_CONFIG)
+                + SearchVector('description', weight='B', config=SEARCH_CONFIG)
+            )
+        )
+
+
 class Product(DateInfo):
     """ Товар """
 
     class Meta:
         verbose_name = 'Товар'
         verbose_name_plural = 'Товары'
+        indexes = [
+            models.Index(fields=['created_at', 'id'], name='product_created_at_id_idx'),
+            GinIndex(fields=['search_document'], name='product_search_document_idx'),
+            GinIndex(fields=['title'], opclasses=['gin_trgm_ops'], name='product_title_trgm_idx'),
+            models.Index(rating_expression(), F('id'), name='product_rating_id_idx'),
+            models.Index(fields=['price'], name='product_price_idx'),
+        ]
+
+    objects = ProductQuerySet.as_manager()
 
     title = models.CharField(
         max_length=255,
@@ -49,6 +143,38 @@ class Product(DateInfo):
         validators=[validators.MinValueValidator(0), validators.MaxValueValidator(100000)]
     )
 
+    # Остаток на складе; пусто — остаток не отслеживается и заказы товара не ограничиваются.
+    # Уменьшается при оформлении заказа (marketplace.stock.reserve_stock).
+    stock = models.PositiveIntegerField(
+        null=True,
+        blank=True,
+        verbose_name='Остаток'
+    )
+
+    # Поддерживается сигналом post_save и update_search_document() для массовых операций.
+    search_document = SearchVectorField(
+        null=True,
+        editable=False,
+    )
+
+    # Агрегаты оценок отзывов. Обновляются при записи отзывов через API (add_review_mark),
+    # полностью пересчитываются командой rebuild_product_ratings.
+    review_count = models.IntegerField(
+        default=0,
+        editable=False,
+        verbose_name='Количество отзывов'
+    )
+    mark_sum = models.IntegerField(
+        default=0,
+        editable=False,
+        verbose_name='Сумма оценок'
+    )
+    mark_1_count = models.IntegerField(default=0, editable=False, verbose_name='Оценок 1')
+    mark_2_count = models.IntegerField(default=0, editable=False, verbose_name='Оценок 2')
+    mark_3_count = models.IntegerField(default=0, editable=False, verbose_name='Оценок 3')
+    mark_4_count = models.IntegerField(default=0, editable=False, verbose_name='Оценок 4')
+    mark_5_count = models.IntegerField(default=0, editable=False, verbose_name='Оценок 5')
+
     # collections = models.ManyToManyField(
     #     'Collection',
     #     related_name='products',
@@ -67,6 +193,13 @@ class Review(DateInfo):
         verbose_name = 'Отзыв'
         verbose_name_plural = 'Отзывы'
         unique_together = ('creator', 'product',)
+        indexes = [
+            models.Index(fields=['created_at', 'id'], name='review_created_at_id_idx'),
+            models.Index(fields=['product', 'created_at', 'id'], name='review_product_created_at_idx'),
+            models.Index(fields=['creator', 'created_at', 'id'], name='review_creator_created_at_idx'),
+            # MAX(updated_at) для ETag / Last-Modified списка отзывов
+            models.Index(fields=['updated_at'], name='review_updated_at_idx'),
+        ]
 
     class ProductMarks(models.IntegerChoices):
         """ Оценка товара """
@@ -111,16 +244,60 @@ class Review(DateInfo):
         return f'{self.creator}: {self.product} - {self.mark}'
 
 
+class OrderProductQuerySet(PartitionLimitQuerySet):
+    """ QuerySet для позиций заказов """
+
+    def order_totals(self):
+        """ Суммы заказов по зафиксированным ценам позиций: [{'order': id, 'total': ...}]. """
+        return self.values('order').annotate(total=Sum('line_total')).order_by('order')
+
+    def product_revenue(self):
+        """ Выручка и количество проданного по товарам: [{'product': id, 'quantity': ..., 'revenue': ...}]. """
+        return (
+            self.values('product')
+            .annotate(quantity=Sum('quantity'), revenue=Sum('line_total'))
+            .order_by('product')
+        )
+
+
 class OrderProduct(models.Model):
     """ Позиции. Промежуточная таблица между товаром и заказом """
 
-    product = models.ForeignKey(Product, on_delete=models.CASCADE)
-    order = models.ForeignKey('Order', on_delete=models.CASCADE, related_name='positions')
+    class Meta:
+        indexes = [
+            # Покрывающие индексы: суммы по заказам и выручка по товарам считаются только по индексу.
+            models.Index(fields=['order'], include=['line_total'], name='orderproduct_order_idx'),
+            models.Index(
+                fields=['product', 'order'], include=['quantity', 'line_total'], name='orderproduct_product_idx'
+            ),
+        ]
+
+    objects = OrderProductQuerySet.as_manager()
+
+    product = models.ForeignKey(Product, on_delete=models.CASCADE, db_index=False)
+    order = models.ForeignKey('Order', on_delete=models.CASCADE, related_name='positions', db_index=False)
     quantity = models.PositiveIntegerField(
         default=1,
         validators=[validators.MinValueValidator(1), validators.MaxValueValidator(10000)]
     )
 
+    # Цена товара на момент оформления заказа и стоимость позиции (unit_price * quantity).
+    # Пусто у позиций, созданных до появления полей, пока не выполнена команда backfill_order_prices.
+    unit_price = models.DecimalField(
+        null=True,
+        max_digits=9,
+        decimal_places=2,
+        editable=False,
+        verbose_name='Цена'
+    )
+    line_total = models.DecimalField(
+        null=True,
+        max_digits=12,
+        decimal_places=2,
+        editable=False,
+        verbose_name='Стоимость'
+    )
+
 
 class Order(DateInfo):
     """ Заказы. """
@@ -128,6 +305,13 @@ class Order(DateInfo):
     class Meta:
         verbose_name = 'Заказ'
         verbose_name_plural = 'Заказы'
+        indexes = [
+            models.Index(fields=['created_at', 'id'], name='order_created_at_id_idx'),
+            models.Index(fields=['amount', 'id'], name='order_amount_id_idx'),
+            models.Index(fields=['creator', 'status', 'created_at'], name='order_creator_status_idx'),
+            models.Index(fields=['status', 'created_at', 'id'], name='order_status_created_at_idx'),
+            models.Index(fields=['updated_at'], name='order_updated_at_idx'),
+        ]
 
     class OrderStatus(models.TextChoices):
         """ Статус заказа """
@@ -170,12 +354,233 @@ class Order(DateInfo):
         return f'{self.status}, {self.amount} - {self.updated_at}'
 
 
+class OrderTicket(DateInfo):
+    """ Заявка на создание заказа, принятая в асинхронном режиме и ожидающая обработки воркером. """
+
+    class Meta:
+        verbose_name = 'Заявка на заказ'
+        verbose_name_plural = 'Заявки на заказ'
+        indexes = [
+            # Очередь: воркеры выбирают ожидающие и зависшие в обработке заявки по возрастанию id.
+            models.Index(
+                fields=['id'], condition=Q(status__in=['PENDING', 'PROCESSING']), name='orderticket_queue_idx'
+            ),
+        ]
+
+    class TicketStatus(models.TextChoices):
+        """ Статус заявки """
+
+        PENDING = 'PENDING', 'Ожидает обработки'
+        PROCESSING = 'PROCESSING', 'Обрабатывается'
+        DONE = 'DONE', 'Заказ создан'
+        FAILED = 'FAILED', 'Ошибка'
+
+    creator = models.ForeignKey(
+        settings.AUTH_USER_MODEL,
+        on_delete=models.CASCADE,
+        verbose_name='Пользователь'
+    )
+
+    payload = models.JSONField(
+        verbose_name='Данные заказа'
+    )
+
+    status = models.TextField(
+        choices=TicketStatus.choices,
+        default=TicketStatus.PENDING,
+        verbose_name='Статус'
+    )
+
+    order = models.ForeignKey(
+        'Order',
+        on_delete=models.SET_NULL,
+        null=True,
+        blank=True,
+        verbose_name='Заказ'
+    )
+
+    errors = models.JSONField(
+        null=True,
+        blank=True,
+        verbose_name='Ошибки'
+    )
+
+    def __str__(self):
+        return f'{self.id}: {self.status}'
+
+
+class IdempotencyKey(models.Model):
+    """
+    Сохранённый ответ на запрос создания с заголовком Idempotency-Key.
+    Повтор запроса с тем же ключом в течение IDEMPOTENCY_KEY_TTL получает сохранённый ответ.
+    """
+
+    class Meta:
+        verbose_name = 'Ключ идемпотентности'
+        verbose_name_plural = 'Ключи идемпотентности'
+        constraints = [
+            models.UniqueConstraint(fields=['user', 'scope', 'key'], name='idempotency_key_unique'),
+        ]
+        indexes = [
+            # Удаление устаревших ключей
+            models.Index(fields=['created_at'], name='idempotency_key_created_idx'),
+        ]
+
+    # Отдельный индекс по user не нужен: его покрывает уникальное ограничение (user, scope, key)
+    user = models.ForeignKey(settings.AUTH_USER_MODEL, on_delete=models.CASCADE, db_index=False)
+    # Область действия ключа (basename viewset), чтобы ключи разных ресурсов не пересекались
+    scope = models.CharField(max_length=50)
+    key = models.CharField(max_length=255)
+    # sha256 тела запроса: повтор ключа с другими данными отклоняется
+    request_hash = models.CharField(max_length=64)
+    status_code = models.PositiveSmallIntegerField()
+    response = models.JSONField(encoder=DjangoJSONEncoder)
+    created_at = models.DateTimeField(auto_now_add=True)
+
+
+class ArchivedOrder(models.Model):
+    """ Выполненный заказ, перенесённый из marketplace_order командой archive_orders (id сохраняется). """
+
+    class Meta:
+        verbose_name = 'Архивный заказ'
+        verbose_name_plural = 'Архивные заказы'
+        # Те же индексы, что у Order: запросы к OrderHistory выполняются по обеим таблицам.
+        indexes = [
+            models.Index(fields=['created_at', 'id'], name='archivedorder_created_at_idx'),
+            models.Index(fields=['amount', 'id'], name='archivedorder_amount_idx'),
+            models.Index(fields=['creator', 'status', 'created_at'], name='archivedorder_creator_idx'),
+            models.Index(fields=['status', 'created_at', 'id'], name='archivedorder_status_idx'),
+            models.Index(fields=['updated_at'], name='archivedorder_updated_at_idx'),
+        ]
+
+    id = models.BigIntegerField(primary_key=True)
+    created_at = models.DateTimeField()
+    updated_at = models.DateTimeField()
+    amount = models.DecimalField(max_digits=12, decimal_places=2)
+    status = models.TextField(choices=Order.OrderStatus.choices)
+    creator = models.ForeignKey(settings.AUTH_USER_MODEL, on_delete=models.CASCADE, db_index=False)
+    archived_at = models.DateTimeField(auto_now_add=True)
+
+
+class ArchivedOrderProduct(models.Model):
+    """ Позиция архивного заказа. """
+
+    class Meta:
+        indexes = [
+            models.Index(fields=['order'], include=['line_total'], name='archivedposition_order_idx'),
+            models.Index(
+                fields=['product', 'order'], include=['quantity', 'line_total'], name='archivedposition_product_idx'
+            ),
+        ]
+
+    id = models.BigIntegerField(primary_key=True)
+    product = models.ForeignKey(Product, on_delete=models.CASCADE, db_index=False)
+    order = models.ForeignKey(ArchivedOrder, on_delete=models.CASCADE, related_name='positions', db_index=False)
+    quantity = models.PositiveIntegerField()
+    unit_price = models.DecimalField(null=True, max_digits=9, decimal_places=2)
+    line_total = models.DecimalField(null=True, max_digits=12, decimal_places=2)
+
+
+class OrderHistory(models.Model):
+    """
+    Все заказы: действующие и архивные (представление UNION ALL, миграция 0012).
+    При изменении колонок Order / OrderProduct представления нужно пересоздать.
+    """
+
+    class Meta:
+        managed = False
+        db_table = 'marketplace_orderhistory'
+
+    id = models.BigIntegerField(primary_key=True)
+    created_at = models.DateTimeField()
+    updated_at = models.DateTimeField()
+    amount = models.DecimalField(max_digits=12, decimal_places=2)
+    status = models.TextField(choices=Order.OrderStatus.choices)
+    creator = models.ForeignKey(settings.AUTH_USER_MODEL, on_delete=models.DO_NOTHING, related_name='+')
+    archived = models.BooleanField()
+
+
+class OrderHistoryProduct(models.Model):
+    """ Позиции действующих и архивных заказов (представление UNION ALL). """
+
+    class Meta:
+        managed = False
+        db_table = 'marketplace_orderhistoryproduct'
+
+    id = models.BigIntegerField(primary_key=True)
+    product = models.ForeignKey(Product, on_delete=models.DO_NOTHING, related_name='+')
+    order = models.ForeignKey(OrderHistory, on_delete=models.DO_NOTHING, related_name='positions')
+    quantity = models.PositiveIntegerField()
+    unit_price = models.DecimalField(null=True, max_digits=9, decimal_places=2)
+    line_total = models.DecimalField(null=True, max_digits=12, decimal_places=2)
+
+    objects = PartitionLimitQuerySet.as_manager()
+
+
+class SalesChange(models.Model):
+    """
+    Отметка об изменении заказов за день, которую пересчёт аналитики (refresh_sales_analytics) ещё не учёл.
+    Добавляется в транзакции изменения заказа, поэтому видимая отметка означает видимые изменения.
+    """
+
+    day = models.DateField()
+
+
+class DailySales(models.Model):
+    """ Предрасчитанные продажи за день: количество и сумма заказов. """
+
+    class Meta:
+        verbose_name = 'Продажи за день'
+        verbose_name_plural = 'Продажи по дням'
+
+    day = models.DateField(unique=True)
+    orders_count = models.PositiveIntegerField()
+    revenue = models.DecimalField(max_digits=14, decimal_places=2)
+
+
+class DailyProductSales(models.Model):
+    """ Предрасчитанные продажи товара за день по зафиксированным стоимостям позиций. """
+
+    class Meta:
+        verbose_name = 'Продажи товара за день'
+        verbose_name_plural = 'Продажи товаров по дням'
+        constraints = [
+            models.UniqueConstraint(fields=['day', 'product'], name='daily_product_sales_unique'),
+        ]
+
+    day = models.DateField()
+    product = models.ForeignKey(Product, on_delete=models.CASCADE)
+    quantity = models.PositiveIntegerField()
+    revenue = models.DecimalField(max_digits=14, decimal_places=2)
+
+
+class DailyStatusSales(models.Model):
+    """ Предрасчитанное количество заказов за день по статусам. """
+
+    class Meta:
+        verbose_name = 'Заказы за день по статусу'
+        verbose_name_plural = 'Заказы по дням и статусам'
+        constraints = [
+            models.UniqueConstraint(fields=['day', 'status'], name='daily_status_sales_unique'),
+        ]
+
+    day = models.DateField()
+    status = models.TextField(choices=Order.OrderStatus.choices)
+    orders_count = models.PositiveIntegerField()
+
+
 class CollectionProduct(models.Model):
     product = models.ForeignKey(Product, on_delete=models.CASCADE)
     collection = models.ForeignKey('Collection', on_delete=models.CASCADE, related_name='products')
 
+    objects = PartitionLimitQuerySet.as_manager()
+
     class Meta:
         db_table = "marketplace_collection_products"
+        constraints = [
+            # Товар входит в подборку один раз: изменение состава подборки вставляет строки с ON CONFLICT DO NOTHING
+            models.UniqueConstraint(fields=['collection', 'product'], name='collection_product_unique'),
+        ]
 
 
 class Collection(DateInfo):
@@ -184,6 +589,9 @@ class Collection(DateInfo):
     class Meta:
         verbose_name = 'Коллекция'
         verbose_name_plural = 'Коллекции'
+        indexes = [
+            models.Index(fields=['created_at', 'id'], name='collection_created_at_id_idx'),
+        ]
 
     title = models.CharField(
         null=False,
@@ -0,0 +1,51 @@
+from django.conf import settings
+from django.db.models import Prefetch
+
+from marketplace.models import PartitionLimitQuerySet
+from marketplace.pagination import NestedKeysetPagination
+
+
+def limit_prefetch(model, lookup, limit):
+    """
+    Prefetch вложенного списка model (обратной связи первого уровня), загружающий не больше limit записей
+    на родительскую запись. Остальные lookups возвращаются без изменений.
+    """
+    if not isinstance(lookup, Prefetch) or '__' in lookup.prefetch_through:
+        return lookup
+    if not isinstance(lookup.queryset, PartitionLimitQuerySet):
+        return lookup
+    field = model._meta.get_field(lookup.prefetch_through).field.name
+    return Prefetch(lookup.prefetch_through, queryset=lookup.queryset.limit_per(field, limit), to_attr=lookup.to_attr)
+
+
+class NestedLimitMixin:
+    """
+    Ограничивает вложенные списки ответов list и retrieve (товары подборки, позиции заказа) первыми
+    NESTED_LIST_LIMIT элементами: prefetch_related загружает на запись не больше чем на одну строку больше,
+    а serializer (CappedRelatedListSerializer) выводит не больше NESTED_LIST_LIMIT. Полные списки отдаются
+    вложенными ресурсами с пагинацией.
+    """
+
+    nested_limit_actions = ('list', 'retrieve')
+
+    def get_nested_limit(self):
+        return settings.NESTED_LIST_LIMIT if self.action in self.nested_limit_actions else None
+
+    def get_serializer_context(self):
+        return {**super().get_serializer_context(), 'nested_limit': self.get_nested_limit()}
+
+    def get_queryset(self):
+        queryset = super().get_queryset()
+        limit = self.get_nested_limit()
+        if limit is None or not queryset._prefetch_related_lookups:
+            return queryset
+        # Лишняя запись показывает, что список обрезан и его длину нужно посчитать отдельно (RelatedCountField).
+        lookups = [limit_prefetch(queryset.model, lookup, limit + 1) for lookup in queryset._prefetch_related_lookups]
+        return queryset.prefetch_related(None).prefetch_related(*lookups)
+
+    def get_nested_response(self, queryset, serializer_class):
+        """ Страница полного вложенного списка (keyset пагинация по id). """
+        paginator = NestedKeysetPagination()
+        page = paginator.paginate_queryset(queryset, self.request)
+        serializer = serializer_class(page, many=True, context=self.get_serializer_context())
+        return paginator.get_paginated_response(serializer.data)
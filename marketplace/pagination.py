@@ -0,0 +1,242 @@
+import json
+from base64 import urlsafe_b64decode, urlsafe_b64encode
+from collections import OrderedDict
+from functools import reduce
+from operator import or_
+
+from django.core.exceptions import FieldDoesNotExist, ValidationError as DjangoValidationError
+from django.db.models import Q
+from rest_framework.exceptions import NotFound
+from rest_framework.pagination import BasePagination
+from rest_framework.response import Response
+from rest_framework.utils.urls import replace_query_param
+
+from marketplace.counting import get_count
+
+
+def positive_int(value, cutoff=None):
+    """ Целое число больше нуля из параметра запроса, не больше cutoff. Иначе ValueError. """
+    number = int(value)
+    if number <= 0:
+        raise ValueError(f'{value!r} is not a positive integer')
+    return min(number, cutoff) if cutoff else number
+
+
+def _reverse_ordering(ordering):
+    """Разворачивает направление сортировки каждого поля."""
+    return tuple(field[1:] if field.startswith('-') else '-' + field for field in ordering)
+
+
+class KeysetPagination(BasePagination):
+    """
+    Keyset (cursor) пагинация по уникальному кортежу сортировки, например (created_at, id).
+
+    Курсор хранит сортировку и значения её полей у граничной записи страницы, поэтому любая страница
+    выбирается условием `(created_at, id) > (...)` по индексу без OFFSET и без COUNT(*).
+    Курсор другой сортировки или со значениями, не подходящими к полям сортировки, даёт 404.
+    """
+
+    cursor_query_param = 'cursor'
+    page_size = 20
+    page_size_query_param = 'page_size'
+    max_page_size = 100
+    # Сортировка по умолчанию, если фильтры view не задали её для запроса.
+    ordering = ('created_at', 'id')
+    # Уникальное поле, которое добавляется в конец сортировки для однозначной позиции.
+    unique_field = 'id'
+    invalid_cursor_message = 'Invalid cursor'
+
+    def paginate_queryset(self, queryset, request, view=None):
+        self.page_size = self.get_page_size(request)
+        self.base_url = request.build_absolute_uri()
+        self.ordering = self.get_ordering(request, queryset, view)
+
+        position, reverse = self.decode_cursor(request)
+        ordering = _reverse_ordering(self.ordering) if reverse else self.ordering
+
+        queryset = queryset.order_by(*ordering)
+        if position is not None:
+            queryset = self.filter_after(queryset, ordering, self.to_python_position(queryset, position))
+
+        # Берём на одну запись больше, чтобы узнать, есть ли следующая страница.
+        results = list(queryset[:self.page_size + 1])
+        has_more = len(results) > self.page_size
+        self.page = results[:self.page_size]
+
+        if reverse:
+            self.page.reverse()
+            self.has_next, self.has_previous = True, has_more
+        else:
+            self.has_next, self.has_previous = has_more, position is not None
+        self.position = position
+
+        return self.page
+
+    def filter_after(self, queryset, ordering, position):
+        """
+        Оставляет записи, идущие строго после позиции в заданной сортировке.
+
+        Для (a, b, id) это `a > va OR (a = va AND b > vb) OR (a = va AND b = vb AND id > vid)`,
+        дополнительное условие `a >= va` задаёт начало диапазона сканирования индекса.
+        """
+        conditions = []
+        equal = {}
+        for field, value in zip(ordering, position):
+            name = field.lstrip('-')
+            lookup = 'lt' if field.startswith('-') else 'gt'
+            conditions.append(Q(**equal, **{f'{name}__{lookup}': value}))
+            equal[name] = value
+
+        first = ordering[0]
+        bound = {f"{first.lstrip('-')}__{'lte' if first.startswith('-') else 'gte'}": position[0]}
+        return queryset.filter(**bound).filter(reduce(or_, conditions))
+
+    def get_page_size(self, request):
+        try:
+            return positive_int(request.query_params[self.page_size_query_param], cutoff=self.max_page_size)
+        except (KeyError, ValueError):
+            return self.page_size
+
+    def get_ordering(self, request, queryset, view):
+        """
+        Сортировка берётся из первого фильтра view с `get_ordering` (OrderingFilter, полнотекстовый поиск),
+        который вернул её для запроса, иначе из `ordering`.
+        В конец всегда добавляется уникальное поле с тем же направлением, что и у первого поля.
+        """
+        ordering = None
+        for backend in getattr(view, 'filter_backends', []):
+            if hasattr(backend, 'get_ordering'):
+                ordering = backend().get_ordering(request, queryset, view)
+                if ordering:
+                    break
+
+        ordering = tuple(ordering or self.ordering)
+        if self.unique_field not in (field.lstrip('-') for field in ordering):
+            prefix = '-' if ordering[0].startswith('-') else ''
+            ordering += (prefix + self.unique_field,)
+        return ordering
+
+    def decode_cursor(self, request):
+        """Возвращает (position, reverse) из курсора запроса."""
+        encoded = request.query_params.get(self.cursor_query_param)
+        if encoded is None:
+            return None, False
+
+        try:
+            cursor = json.loads(urlsafe_b64decode(encoded.encode('ascii')))
+            ordering = cursor['o']
+            position = cursor['p']
+            reverse = bool(cursor.get('r', False))
+        except (TypeError, ValueError, KeyError):
+            raise NotFound(self.invalid_cursor_message)
+
+        # Курсор, выданный для другой сортировки (например, после смены ?ordering=), не задаёт позицию.
+        if ordering != list(self.ordering):
+            raise NotFound(self.invalid_cursor_message)
+        if not isinstance(position, list) or len(position) != len(self.ordering):
+            raise NotFound(self.invalid_cursor_message)
+        return position, reverse
+
+    def to_python_position(self, queryset, position):
+        """ Значения позиции курсора, приведённые и проверенные полями сортировки (модели или аннотаций). """
+        values = []
+        for name, value in zip(self.ordering, position):
+            name = name.lstrip('-')
+            try:
+                annotation = queryset.query.annotations.get(name)
+                field = annotation.output_field if annotation is not None else queryset.model._meta.get_field(name)
+                value = field.to_python(value)
+                if value is None:
+                    raise DjangoValidationError('Empty cursor value')
+                field.run_validators(value)
+            except (FieldDoesNotExist, DjangoValidationError, TypeError, ValueError):
+                raise NotFound(self.invalid_cursor_message)
+            values.append(value)
+        return values
+
+    def encode_cursor(self, position, reverse):
+        cursor = {'o': list(self.ordering), 'p': position}
+        if reverse:
+            cursor['r'] = 1
+        encoded = urlsafe_b64encode(json.dumps(cursor).encode('ascii')).decode('ascii')
+        return replace_query_param(self.base_url, self.cursor_query_param, encoded)
+
+    def get_position(self, instance):
+        position = []
+        for field in self.ordering:
+            value = getattr(instance, field.lstrip('-'))
+            position.append(value if isinstance(value, int) else str(value))
+        return position
+
+    def get_next_link(self):
+        if not self.has_next:
+            return None
+        if not self.page:
+            return self.encode_cursor(self.position, reverse=False)
+        return self.encode_cursor(self.get_position(self.page[-1]), reverse=False)
+
+    def get_previous_link(self):
+        if not self.has_previous:
+            return None
+        if not self.page:
+            return self.encode_cursor(self.position, reverse=True)
+        return self.encode_cursor(self.get_position(self.page[0]), reverse=True)
+
+    def get_paginated_response(self, data):
+        return Response(OrderedDict([
+            ('next', self.get_next_link()),
+            ('previous', self.get_previous_link()),
+            ('results', data)
+        ]))
+
+    def get_paginated_response_schema(self, schema):
+        return {
+            'type': 'object',
+            'properties': {
+                'next': {
+                    'type': 'string',
+                    'nullable': True,
+                },
+                'previous': {
+                    'type': 'string',
+                    'nullable': True,
+                },
+                'results': schema,
+            },
+        }
+
+
+class NestedKeysetPagination(KeysetPagination):
+    """ Keyset пагинация вложенных ресурсов (товары подборки, позиции заказа) по id. """
+
+    ordering = ('id',)
+
+
+class CountedKeysetPagination(KeysetPagination):
+    """
+    Keyset пагинация с общим количеством записей запроса (`count`). Для больших выборок вместо
+    COUNT(*) возвращается оценка планировщика PostgreSQL, тогда `count_estimated` равен true.
+    Порог задаёт settings.COUNT_ESTIMATE_THRESHOLD.
+    """
+
+    def paginate_queryset(self, queryset, request, view=None):
+        self.count, self.count_estimated = get_count(queryset)
+        return super().paginate_queryset(queryset, request, view)
+
+    def get_paginated_response(self, data):
+        return Response(OrderedDict([
+            ('count', self.count),
+            ('count_estimated', self.count_estimated),
+            ('next', self.get_next_link()),
+            ('previous', self.get_previous_link()),
+            ('results', data)
+        ]))
+
+    def get_paginated_response_schema(self, schema):
+        response_schema = super().get_paginated_response_schema(schema)
+        response_schema['properties'] = {
+            'count': {'type': 'integer'},
+            'count_estimated': {'type': 'boolean'},
+            **response_schema['properties'],
+        }
+        return response_schema
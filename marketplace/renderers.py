@@ -0,0 +1,65 @@
+import csv
+import io
+import json
+
+from rest_framework.renderers import BaseRenderer
+from rest_framework.utils import encoders
+
+
+def flatten(data, prefix=''):
+    """
+    Разворачивает вложенные словари в плоскую строку с ключами через точку ("creator.id").
+    Вложенные списки (например позиции заказа) записываются JSON строкой.
+    """
+    row = {}
+    for key, value in data.items():
+        name = f'{prefix}{key}'
+        if isinstance(value, dict):
+            row.update(flatten(value, f'{name}.'))
+        elif isinstance(value, list):
+            row[name] = json.dumps(value, cls=encoders.JSONEncoder, ensure_ascii=False)
+        else:
+            row[name] = value
+    return row
+
+
+class NDJSONRenderer(BaseRenderer):
+    """ Рендерер NDJSON: по одному JSON объекту на строку. """
+
+    media_type = 'application/x-ndjson'
+    format = 'ndjson'
+    charset = 'utf-8'
+
+    def render_rows(self, rows):
+        return ''.join(json.dumps(row, cls=encoders.JSONEncoder, ensure_ascii=False) + '\n' for row in rows)
+
+    def render(self, data, accepted_media_type=None, renderer_context=None):
+        if data is None:
+            return b''
+        rows = data if isinstance(data, list) else [data]
+        return self.render_rows(rows).encode(self.charset)
+
+
+class CSVRenderer(BaseRenderer):
+    """ Рендерер CSV: заголовок из ключей первой строки, вложенные объекты разворачиваются через flatten. """
+
+    media_type = 'text/csv'
+    format = 'csv'
+    charset = 'utf-8'
+
+    def render_rows(self, rows, header=None):
+        """ Возвращает (текст, заголовок). Заголовок выводится, только если он не передан. """
+        rows = [flatten(row) for row in rows]
+        buffer = io.StringIO()
+        if header is None and rows:
+            header = list(rows[0])
+            csv.writer(buffer).writerow(header)
+        writer = csv.DictWriter(buffer, fieldnames=header or [], restval='', extrasaction='ignore')
+        writer.writerows(rows)
+        return buffer.getvalue(), header
+
+    def render(self, data, accepted_media_type=None, renderer_context=None):
+        if data is None:
+            return b''
+        rows = data if isinstance(data, list) else [data]
+        return self.render_rows(rows)[0].encode(self.charset)
@@ -1,10 +1,23 @@
+from collections import Counter
+
 from django.contrib.auth import get_user_model
+from django.db import IntegrityError, transaction
+from psycopg2 import errorcodes
 from rest_framework import serializers
 
-from marketplace.models import Product, Review, Order, OrderProduct, Collection, CollectionProduct
+from marketplace.fields import BatchedPrimaryKeyRelatedField, CappedRelatedListSerializer, RelatedCountField, \
+    UncheckedPrimaryKeyRelatedField
+from marketplace.fieldsets import SparseFieldsMixin
+from marketplace.membership import delete_collection_products
+from marketplace.models import Product, Review, Order, OrderProduct, OrderTicket, Collection, CollectionProduct, \
+    DailySales
+from marketplace.stock import reserve_stock
+
+# Строк подборки в одном INSERT (по 2 параметра на строку при лимите 65535 параметров запроса).
+COLLECTION_BATCH_SIZE = 10000
 
 
-class UserSerializer(serializers.ModelSerializer):
+class UserSerializer(SparseFieldsMixin, serializers.ModelSerializer):
     """Serializer для пользователя."""
 
     class Meta:
@@ -13,19 +26,38 @@ class UserSerializer(serializers.ModelSerializer):
                   'last_name',)
 
 
-class ProductSerializer(serializers.ModelSerializer):
+class ProductSerializer(SparseFieldsMixin, serializers.ModelSerializer):
     """Serializer для товара."""
 
+    rating = serializers.SerializerMethodField()
+    marks = serializers.SerializerMethodField()
+
+    sparse_columns = {
+        'rating': ('review_count', 'mark_sum'),
+        'marks': tuple(f'mark_{mark}_count' for mark in Review.ProductMarks.values),
+    }
+
     class Meta:
         model = Product
-        fields = ('id', 'title', 'description', 'price', 'created_at', 'updated_at',)
+        fields = ('id', 'title', 'description', 'price', 'stock', 'created_at', 'updated_at',
+                  'review_count', 'mark_sum', 'rating', 'marks',)
         extra_kwargs = {
             'created_at': {'read_only': True},
             'updated_at': {'read_only': True},
         }
 
+    def get_rating(self, obj):
+        """Средняя оценка или None, если отзывов нет."""
+        if not obj.review_count:
+            return None
+        return round(obj.mark_sum / obj.review_count, 2)
 
-class ReviewSerializer(serializers.ModelSerializer):
+    def get_marks(self, obj):
+        """Распределение оценок: {"1": количество, ..., "5": количество}."""
+        return {str(mark): getattr(obj, f'mark_{mark}_count') for mark in Review.ProductMarks.values}
+
+
+class ReviewSerializer(SparseFieldsMixin, serializers.ModelSerializer):
     """Serializer для отзыва."""
     partial = True
     creator = UserSerializer(
@@ -34,12 +66,17 @@ class ReviewSerializer(serializers.ModelSerializer):
     product = ProductSerializer(
         read_only=True
     )
-    product_id = serializers.PrimaryKeyRelatedField(
+    # Существование товара и уникальность (creator, product) проверяются самой записью, без запросов до неё.
+    product_id = UncheckedPrimaryKeyRelatedField(
         required=True,
         queryset=Product.objects.all(),
         write_only=True,
     )
 
+    unique_error_message = 'The fields creator, product_id must make a unique set.'
+    # Агрегаты рейтинга, которые меняет add_review_mark в обход загруженного вложенного товара.
+    product_rating_fields = ('review_count', 'mark_sum', *ProductSerializer.sparse_columns['marks'])
+
     class Meta:
         model = Review
         fields = ('id', 'text', 'mark', 'created_at', 'updated_at', 'creator', 'product', 'product_id',)
@@ -47,12 +84,6 @@ class ReviewSerializer(serializers.ModelSerializer):
             'created_at': {'read_only': True},
             'updated_at': {'read_only': True},
         }
-        validators = [
-            serializers.UniqueTogetherValidator(
-                queryset=Review.objects.only('creator', 'product_id'),
-                fields=['creator', 'product_id']
-            )
-        ]
 
     def __init__(self, *args, **kwargs):
 
@@ -64,51 +95,88 @@ class ReviewSerializer(serializers.ModelSerializer):
             self.fields['creator'].read_only = True
 
     def to_internal_value(self, data):
-
-        # TODO eсли делать в методе create не пройдет валидация на required field в UniqueTogetherValidator.
         ret = super().to_internal_value(data)
         ret['creator'] = self.context["request"].user
 
         return ret
 
+    def unique_error(self):
+        return serializers.ValidationError({"non_field_errors": [self.unique_error_message]})
+
+    def add_mark(self, product_id, mark):
+        """
+        Учитывает оценку в агрегатах товара. Обновление заодно проверяет существование товара:
+        внешние ключи проверяются только при коммите, а UPDATE несуществующего товара не меняет строк.
+        """
+        if not Product.objects.filter(pk=product_id).add_review_mark(mark):
+            raise self.fields['product_id'].does_not_exist_error(product_id)
+
+    def save_review(self, write):
+        """
+        Выполняет write в транзакции. Нарушение уникальности (creator, product) возвращается как ошибка 400
+        вместо проверки запросом до записи.
+        """
+        try:
+            with transaction.atomic():
+                return write()
+        except IntegrityError as exc:
+            if getattr(exc.__cause__, 'pgcode', None) == errorcodes.UNIQUE_VIOLATION:
+                raise self.unique_error()
+            raise
+
     def create(self, validated_data):
         """Метод для создания"""
 
-        validated_data['product'] = validated_data.pop('product_id')
-        return Review.objects.create(**validated_data)
+        product_id = validated_data.pop('product_id')
+
+        def write():
+            self.add_mark(product_id, validated_data['mark'])
+            return Review.objects.create(product_id=product_id, **validated_data)
+
+        return self.save_review(write)
 
     def update(self, instance, validated_data):
         """Метод для обновления"""
-        product_id = validated_data.pop('product_id', False)
-        if product_id:
-            validated_data['product'] = product_id
-        return super().update(instance, validated_data)
+        old_product_id, old_mark = instance.product_id, instance.mark
+        product_id = validated_data.pop('product_id', old_product_id)
+        mark = validated_data.get('mark', old_mark)
+
+        def write():
+            # Переносим оценку в агрегатах рейтинга, если сменились товар или оценка.
+            moved = (product_id, mark) != (old_product_id, old_mark)
+            if moved:
+                Product.objects.filter(pk=old_product_id).add_review_mark(old_mark, delta=-1)
+                self.add_mark(product_id, mark)
+            validated_data['product_id'] = product_id
+            review = super(ReviewSerializer, self).update(instance, validated_data)
+            # При смене товара загруженный товар сбрасывается сам, при смене оценки его агрегаты устарели.
+            if moved and Review.product.is_cached(review):
+                review.product.refresh_from_db(fields=self.product_rating_fields)
+            return review
+
+        return self.save_review(write)
 
     def validate(self, data):
-        """ Calculate and validate amount of order."""
+        """ Отзыв на тот же товар уже есть: это сам изменяемый отзыв. """
 
-        if self.context["request"].method in ['PUT', 'PATCH']:
-            if data.get('product_id'):
-                if Review.objects.filter(creator=data['creator'],
-                                         product=data['product_id']).exists():
-                    raise serializers.ValidationError(
-                        {"non_field_errors": ["The fields creator, product_id must make a unique set."]}
-                    )
+        if self.instance is not None and data.get('product_id') == self.instance.product_id:
+            raise self.unique_error()
 
         return data
 
 
-class ProductOrderSerializer(serializers.ModelSerializer):
+class ProductOrderSerializer(SparseFieldsMixin, serializers.ModelSerializer):
 
     product = ProductSerializer(read_only=True)
-    product_id = serializers.PrimaryKeyRelatedField(required=True, queryset=Product.objects.all(), write_only=True)
+    product_id = BatchedPrimaryKeyRelatedField(required=True, queryset=Product.objects.all(), write_only=True)
 
     class Meta:
         model = OrderProduct
-        fields = ('product', 'quantity', 'product_id',)
+        fields = ('product', 'quantity', 'product_id', 'unit_price', 'line_total',)
+        list_serializer_class = CappedRelatedListSerializer
 
 
-class OrderSerializer(serializers.ModelSerializer):
+class OrderSerializer(SparseFieldsMixin, serializers.ModelSerializer):
     """Serializer для заказа."""
 
     MAX_AMOUNT_VALUE = 100000000
@@ -119,10 +187,14 @@ class OrderSerializer(serializers.ModelSerializer):
     )
 
     positions = ProductOrderSerializer(many=True)
+    # Количество позиций и ссылка на их полный список с пагинацией
+    positions_count = RelatedCountField('positions')
+    positions_url = serializers.HyperlinkedIdentityField(view_name='orders-positions')
 
     class Meta:
         model = Order
-        fields = ('id', 'amount',  'status', 'created_at', 'updated_at', 'creator', 'positions',)
+        fields = ('id', 'amount',  'status', 'created_at', 'updated_at', 'creator', 'positions', 'positions_count',
+                  'positions_url',)
         extra_kwargs = {
             'status': {'read_only': True},
             'amount': {'read_only': True},
@@ -145,20 +217,61 @@ class OrderSerializer(serializers.ModelSerializer):
 
         validated_data['creator'] = self.context["request"].user
 
-        positions = validated_data.pop('positions')
-        order = Order.objects.create(**validated_data)
-
-        for item in positions:
-            item['product'] = item.pop('product_id')
-            OrderProduct.objects.create(order=order, **item)
+        items = validated_data.pop('positions')
+        with transaction.atomic():
+            order = Order.objects.create(**validated_data)
+            positions = OrderProduct.objects.bulk_create(
+                self.build_position(order, item['product_id'], item.get('quantity', 1)) for item in items
+            )
+            # Резервирование последним запросом транзакции: строки товаров заблокированы только до коммита.
+            shortage = reserve_stock(self.product_quantities(items))
+            if shortage:
+                raise serializers.ValidationError({'positions': self.stock_errors(items, shortage)})
 
+        # Позиции с товарами уже в памяти: ответ сериализуется без повторного чтения из БД.
+        order._prefetched_objects_cache = {'positions': positions}
         return order
 
+    @staticmethod
+    def build_position(order, product, quantity):
+        """Позиция заказа с ценой товара на момент оформления."""
+        return OrderProduct(
+            order=order, product=product, quantity=quantity,
+            unit_price=product.price, line_total=product.price * quantity
+        )
+
+    @staticmethod
+    def product_quantities(items):
+        """Количество по товарам заказа: {id товара: количество}."""
+        quantities = Counter()
+        for item in items:
+            quantities[item['product_id'].pk] += item.get('quantity', 1)
+        return quantities
+
+    @staticmethod
+    def stock_errors(items, available):
+        """Ошибки по позициям для товаров, остатка которых {id товара: остаток} не хватает."""
+        return [
+            {'quantity': [f'Not enough stock: {available[item["product_id"].pk]} left.']}
+            if item['product_id'].pk in available else {}
+            for item in items
+        ]
+
     def validate(self, data):
         """Calculate and validate amount of order."""
 
         if self.context["request"].method == "POST":
             positions = data.get('positions')
+            # Предварительная проверка по уже загруженным товарам: заказ закончившегося товара отклоняется
+            # без блокировок. Окончательно остатки проверяются при резервировании в create.
+            quantities = self.product_quantities(positions)
+            products = {item['product_id'].pk: item['product_id'] for item in positions}
+            shortage = {
+                pk: product.stock for pk, product in products.items()
+                if product.stock is not None and quantities[pk] > product.stock
+            }
+            if shortage:
+                raise serializers.ValidationError({'positions': self.stock_errors(positions, shortage)})
             data['amount'] = sum(order_data['product_id'].price * order_data.get('quantity', 1) for order_data in positions)
             # min and max possible amount of order
             if data['amount'] < self.MIN_AMOUNT_VALUE:
@@ -176,44 +289,117 @@ class OrderSerializer(serializers.ModelSerializer):
         return data
 
 
-class CollectionProductSerializer(serializers.ModelSerializer):
+class PositionIntakeSerializer(serializers.Serializer):
+    """Serializer формы позиции заказа без обращений к БД."""
+
+    product_id = serializers.IntegerField(min_value=1)
+    quantity = serializers.IntegerField(min_value=1, max_value=10000, default=1)
+
+
+class OrderIntakeSerializer(serializers.Serializer):
+    """
+    Serializer для асинхронного приёма заказа: проверяет только форму данных, без запросов к БД.
+    Существование товаров и сумма заказа проверяются воркером через OrderSerializer.
+    """
+
+    positions = PositionIntakeSerializer(many=True)
+
+    def validate_positions(self, data):
+        """Checks positions for empty list."""
+        if not len(data):
+            raise serializers.ValidationError(['The field cannot be an empty list'])
+
+        return data
+
+
+class OrderTicketSerializer(serializers.ModelSerializer):
+    """Serializer для заявки на создание заказа."""
+
+    url = serializers.HyperlinkedIdentityField(view_name='order-tickets-detail')
+
+    class Meta:
+        model = OrderTicket
+        fields = ('id', 'url', 'status', 'order', 'errors', 'created_at', 'updated_at',)
+        read_only_fields = fields
+
+
+class DailySalesSerializer(serializers.ModelSerializer):
+    """Serializer для продаж за день."""
+
+    class Meta:
+        model = DailySales
+        fields = ('day', 'orders_count', 'revenue',)
+
+
+class ProductSalesSerializer(serializers.Serializer):
+    """Serializer для продаж товара за период."""
+
+    product = serializers.IntegerField()
+    title = serializers.CharField()
+    quantity = serializers.IntegerField()
+    revenue = serializers.DecimalField(max_digits=14, decimal_places=2)
+
+
+class StatusSalesSerializer(serializers.Serializer):
+    """Serializer для количества заказов по статусу за период."""
+
+    status = serializers.ChoiceField(choices=Order.OrderStatus.choices)
+    orders_count = serializers.IntegerField()
+
+
+class CollectionProductSerializer(SparseFieldsMixin, serializers.ModelSerializer):
 
     product = ProductSerializer(read_only=True)
-    product_id = serializers.PrimaryKeyRelatedField(required=True, queryset=Product.objects.all(), write_only=True)
+    product_id = BatchedPrimaryKeyRelatedField(required=True, queryset=Product.objects.all(), write_only=True)
 
     class Meta:
         model = CollectionProduct
         fields = ('product', 'product_id',)
+        list_serializer_class = CappedRelatedListSerializer
 
 
-class CollectionSerializer(serializers.ModelSerializer):
+class CollectionSerializer(SparseFieldsMixin, serializers.ModelSerializer):
     """Serializer для подборки товаров."""
 
     products = CollectionProductSerializer(many=True)
+    # Количество товаров и ссылка на их полный список с пагинацией
+    products_count = RelatedCountField('products')
+    products_url = serializers.HyperlinkedIdentityField(view_name='product-collections-products')
 
     class Meta:
         model = Collection
-        fields = ('id', 'title', 'text', 'created_at', 'updated_at', 'products',)
+        fields = ('id', 'title', 'text', 'created_at', 'updated_at', 'products', 'products_count', 'products_url',)
         extra_kwargs = {
             'created_at': {'read_only': True},
             'updated_at': {'read_only': True},
         }
 
+    @staticmethod
+    def add_products(collection, product_ids):
+        """ Добавляет товары в подборку одним INSERT, товары, которые уже в подборке, пропускаются. """
+        CollectionProduct.objects.bulk_create(
+            [CollectionProduct(collection=collection, product_id=product_id) for product_id in product_ids],
+            batch_size=COLLECTION_BATCH_SIZE,
+            ignore_conflicts=True,
+        )
+
     def create(self, validated_data):
         """Метод для создания"""
 
         products = validated_data.pop('products')
-        collection = Collection.objects.create(**validated_data)
-
-        for item in products:
-            CollectionProduct.objects.create(collection=collection, product=item.pop('product_id'))
+        with transaction.atomic():
+            collection = Collection.objects.create(**validated_data)
+            self.add_products(collection, dict.fromkeys(item['product_id'].pk for item in products))
 
         return collection
 
     def update(self, instance, validated_data):
-        """Метод для создания"""
+        """
+        Метод для обновления. Состав подборки меняется по разнице множеств: текущие товары читаются
+        одним запросом, новые добавляются одним INSERT, лишние удаляются одним DELETE. Сигналы по строкам
+        подборки не отправляются: версию данных подборок один раз сбрасывает сохранение самой подборки.
+        """
 
-        instance_products = CollectionProduct.objects.filter(collection=instance)
         data_products = {}
         for item in validated_data.pop('products'):
             product = item.get('product_id', False)
@@ -221,17 +407,16 @@ class CollectionSerializer(serializers.ModelSerializer):
                 raise serializers.ValidationError({"products": [{"product_id": ["This field is required."]}]})
             data_products[product.id] = product
 
-        # Perform creations
-        for product_id, product in data_products.items():
-            if not instance_products.filter(product=product).exists():
-                CollectionProduct.objects.create(collection=instance, product=product)
-
-        # Perform deletions.
-        for obj in instance_products:
-            if obj.product_id not in data_products:
-                obj.delete()
+        with transaction.atomic():
+            current = set(
+                CollectionProduct.objects.filter(collection=instance).values_list('product_id', flat=True)
+            )
+            self.add_products(instance, [product_id for product_id in data_products if product_id not in current])
+            removed = current.difference(data_products)
+            if removed:
+                delete_collection_products(instance.pk, removed)
 
-        return super().update(instance, validated_data)
+            return super().update(instance, validated_data)
 
     def validate_products(self, data):
         """Checks products for empty list"""
@@ -241,3 +426,11 @@ class CollectionSerializer(serializers.ModelSerializer):
         return data
 
 
+class CollectionProductIdsSerializer(serializers.Serializer):
+    """Serializer для списка id товаров, добавляемых в подборку или удаляемых из неё."""
+
+    product_ids = serializers.ListField(
+        child=serializers.IntegerField(min_value=1), allow_empty=False, max_length=COLLECTION_BATCH_SIZE
+    )
+
+
@@ -0,0 +1,39 @@
+from django.db.models.signals import post_save, post_delete
+from django.dispatch import receiver
+
+from marketplace.analytics import mark_sales_change
+from marketplace.cache import bump_version
+from marketplace.models import Product, Review, Order, Collection, CollectionProduct
+
+
+@receiver(post_save, sender=Product)
+def update_product_search_document(sender, instance, update_fields=None, **kwargs):
+    """ Пересчитывает поисковый документ товара после сохранения. """
+    if update_fields is not None and not {'title', 'description'} & set(update_fields):
+        return
+    Product.objects.filter(pk=instance.pk).update_search_document()
+
+
+@receiver(post_save, sender=Product)
+@receiver(post_delete, sender=Product)
+@receiver(post_save, sender=Review)
+@receiver(post_delete, sender=Review)
+def bump_product_version(sender, **kwargs):
+    """ Инвалидирует закешированные ответы и подсказки по товарам (отзывы меняют агрегаты рейтинга товара). """
+    bump_version('product')
+
+
+@receiver(post_save, sender=Collection)
+@receiver(post_delete, sender=Collection)
+@receiver(post_save, sender=CollectionProduct)
+@receiver(post_delete, sender=CollectionProduct)
+def bump_collection_version(sender, **kwargs):
+    """ Инвалидирует закешированные ответы по подборкам. """
+    bump_version('collection')
+
+
+@receiver(post_save, sender=Order)
+@receiver(post_delete, sender=Order)
+def mark_order_sales_change(sender, instance, **kwargs):
+    """ Отмечает день заказа для пересчёта аналитики продаж. """
+    mark_sales_change(instance)
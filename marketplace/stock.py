@@ -0,0 +1,48 @@
+from django.db import connection
+
+from marketplace.cache import bump_version
+from marketplace.models import Product
+
+# Резервирование остатков всех товаров заказа одним запросом. Строки товаров с отслеживаемым остатком
+# блокируются в порядке id (Sort под LockRows), поэтому встречные заказы с общими товарами не взаимоблокируются.
+# Условие `stock >= quantity` проверяется на последней версии строки после получения блокировки.
+RESERVE_STOCK_SQL = """
+    WITH requested AS (
+        SELECT id, quantity FROM unnest(%(ids)s::bigint[], %(quantities)s::integer[]) AS r(id, quantity)
+    ), locked AS (
+        SELECT p.id FROM marketplace_product AS p
+        WHERE p.id = ANY(%(ids)s) AND p.stock IS NOT NULL
+        ORDER BY p.id
+        FOR UPDATE
+    ), reserved AS (
+        UPDATE marketplace_product AS p SET stock = p.stock - r.quantity
+        FROM locked AS l, requested AS r
+        WHERE p.id = l.id AND r.id = l.id AND p.stock >= r.quantity
+        RETURNING p.id, p.stock
+    )
+    SELECT l.id, reserved.id IS NOT NULL, reserved.stock
+    FROM locked AS l LEFT JOIN reserved ON reserved.id = l.id
+"""
+
+
+def reserve_stock(quantities):
+    """
+    Уменьшает остатки товаров {id товара: количество} одним запросом в текущей транзакции.
+    Возвращает {id товара: остаток} для товаров, которых не хватило: в этом случае часть остатков уже
+    уменьшена и транзакцию нужно откатить. Товары без отслеживаемого остатка не ограничиваются.
+
+    Остаток входит в ответы по товарам, поэтому после успешного резервирования увеличивается отдельная
+    версия 'stock' (и ещё раз после коммита, см. bump_version). Версия 'product' не меняется, чтобы заказы
+    не сбрасывали кеш каталога и автодополнения.
+    """
+    ids = sorted(quantities)
+    with connection.cursor() as cursor:
+        cursor.execute(RESERVE_STOCK_SQL, {'ids': ids, 'quantities': [quantities[pk] for pk in ids]})
+        rows = cursor.fetchall()
+
+    failed = [pk for pk, reserved, _ in rows if not reserved]
+    if failed:
+        return dict(Product.objects.filter(pk__in=failed).values_list('pk', 'stock'))
+    if rows:
+        bump_version('stock')
+    return {}
@@ -0,0 +1,47 @@
+import hashlib
+
+from django.core.cache import cache
+
+from marketplace.cache import get_versions
+from marketplace.lookups import TrigramWordSimilarity
+from marketplace.models import Product
+
+SUGGEST_LIMIT = 10
+MAX_SUGGEST_LIMIT = 20
+
+SUGGEST_KEY = 'marketplace:suggest:{}:{}'
+SUGGEST_TIMEOUT = 60 * 60
+
+
+def normalize_prefix(prefix):
+    """ Приводит введённую строку к виду ключа кеша: нижний регистр, одиночные пробелы. """
+    return ' '.join(prefix.lower().split())
+
+
+def suggest_products(prefix, limit=SUGGEST_LIMIT):
+    """
+    Товары с названием, похожим на prefix, по убыванию похожести (pg_trgm word_similarity).
+    Поиск идёт по GIN индексу `product_title_trgm_idx`, поэтому опечатки допустимы.
+
+    Результат кешируется в общем кеше Django с ключом по версии данных товаров (см. marketplace.cache),
+    поэтому изменение товаров в любом процессе сбрасывает подсказки во всех процессах.
+    """
+    digest = hashlib.md5(repr((prefix, limit)).encode('utf-8')).hexdigest()
+    key = SUGGEST_KEY.format(*get_versions('product'), digest)
+    products = cache.get(key)
+    if products is None:
+        products = find_products(prefix, limit)
+        cache.set(key, products, timeout=SUGGEST_TIMEOUT)
+    return products
+
+
+def find_products(prefix, limit):
+    """ Запрос подсказок к БД без кеша. """
+    products = (
+        Product.objects
+        .filter(title__trigram_word_similar=prefix)
+        .annotate(similarity=TrigramWordSimilarity(prefix, 'title'))
+        .order_by('-similarity', 'id')
+        .values('id', 'title')[:limit]
+    )
+    return list(products)
@@ -1,12 +1,17 @@
 from rest_framework.routers import DefaultRouter
 
-from marketplace.views import ReviewViewSet, ProductViewSet, CollectionViewSet, OrderViewSet
+from marketplace.views import ReviewViewSet, ProductViewSet, CollectionViewSet, OrderViewSet, OrderTicketViewSet, \
+    DailySalesViewSet, ProductSalesViewSet, StatusSalesViewSet
 
 router = DefaultRouter()
 router.register('product-reviews', ReviewViewSet, basename='product-reviews')
 router.register('products', ProductViewSet, basename='products')
 router.register('orders', OrderViewSet, basename='orders')
+router.register('order-tickets', OrderTicketViewSet, basename='order-tickets')
 router.register('product-collections', CollectionViewSet, basename='product-collections')
+router.register('analytics/sales', DailySalesViewSet, basename='analytics-sales')
+router.register('analytics/products', ProductSalesViewSet, basename='analytics-products')
+router.register('analytics/statuses', StatusSalesViewSet, basename='analytics-statuses')
 
 
 urlpatterns = router.urls
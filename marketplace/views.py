@@ -1,34 +1,90 @@
-from django.db.models import Prefetch
+from django.conf import settings
+from django.db import transaction
+from django.db.models import F, Prefetch, Sum
 from django_filters.rest_framework import DjangoFilterBackend
-from rest_framework import filters
+from rest_framework import filters, mixins
+from rest_framework.decorators import action
+from rest_framework.exceptions import ValidationError
+from rest_framework.parsers import JSONParser
 from rest_framework.permissions import IsAuthenticated, IsAuthenticatedOrReadOnly, IsAdminUser, OR, AND
-from rest_framework.viewsets import ModelViewSet
+from rest_framework.response import Response
+from rest_framework.status import HTTP_202_ACCEPTED
+from rest_framework.viewsets import GenericViewSet, ModelViewSet
 
-from marketplace.filters import ProductFilter, ReviewFilter, OrderFilter, IsOwnerOrAdminFilterBackend
-from marketplace.models import Product, Review, Order, Collection, OrderProduct, CollectionProduct
+from marketplace.archive import ArchiveQuerysetMixin
+from marketplace.bulk import validate_products, save_products
+from marketplace.cache import CachedResponseMixin
+from marketplace.conditional import ConditionalGetMixin
+from marketplace.export import ExportMixin
+from marketplace.fieldsets import SparseQuerysetMixin
+from marketplace.filters import ProductFilter, ReviewFilter, OrderFilter, IsOwnerOrAdminFilterBackend, \
+    ProductSearchFilter, DailySalesFilter, DailyProductSalesFilter, DailyStatusSalesFilter, OrderHistoryFilter
+from marketplace.idempotency import IdempotentCreateMixin
+from marketplace.intake import is_async_intake
+from marketplace.membership import add_collection_products, remove_collection_products
+from marketplace.models import Product, Review, Order, Collection, OrderProduct, OrderTicket, CollectionProduct, \
+    DailySales, DailyProductSales, DailyStatusSales, OrderHistory, OrderHistoryProduct
+from marketplace.nested import NestedLimitMixin
+from marketplace.pagination import KeysetPagination, CountedKeysetPagination, positive_int
+from marketplace.parsers import NDJSONParser
 from marketplace.permissions import IsAdminUserOrReadOnly, IsOwnerUser, IsOwnerOrAdminUser
-from marketplace.serializers import CollectionSerializer, OrderSerializer, ProductSerializer, ReviewSerializer
+from marketplace.serializers import CollectionSerializer, OrderSerializer, ProductSerializer, ReviewSerializer, \
+    OrderIntakeSerializer, OrderTicketSerializer, DailySalesSerializer, ProductSalesSerializer, StatusSalesSerializer, \
+    CollectionProductIdsSerializer, CollectionProductSerializer, ProductOrderSerializer
+from marketplace.suggest import normalize_prefix, suggest_products, SUGGEST_LIMIT, MAX_SUGGEST_LIMIT
 
 
-class ProductViewSet(ModelViewSet):
+class ProductViewSet(ConditionalGetMixin, CachedResponseMixin, ExportMixin, SparseQuerysetMixin, ModelViewSet):
     """ Viewset для товаров. """
 
-    queryset = Product.objects.all()
+    queryset = Product.objects.with_rating()
     permission_classes = [IsAuthenticatedOrReadOnly & IsAdminUserOrReadOnly]
     serializer_class = ProductSerializer
-    # Search filter
-    filter_backends = [DjangoFilterBackend, filters.SearchFilter]
-    search_fields = ['title', 'description']
+    pagination_class = CountedKeysetPagination
+    # Явная сортировка (?ordering=) важнее сортировки по релевантности полнотекстового поиска
+    filter_backends = [DjangoFilterBackend, filters.OrderingFilter, ProductSearchFilter]
+    ordering_fields = ['rating', ]
+    # Остатки меняются при каждом заказе и версионируются отдельно от остальных данных товаров
+    cache_versions = etag_versions = ('product', 'stock')
 
     filterset_class = ProductFilter
 
+    @action(detail=False, methods=['get'])
+    def suggest(self, request):
+        """Подсказки названий товаров для автодополнения: ?q=<ввод>&limit=<N>."""
+        prefix = normalize_prefix(request.query_params.get('q', ''))
+        try:
+            limit = positive_int(request.query_params['limit'], cutoff=MAX_SUGGEST_LIMIT)
+        except (KeyError, ValueError):
+            limit = SUGGEST_LIMIT
 
-class ReviewViewSet(ModelViewSet):
+        if not prefix:
+            return Response([])
+        return Response(suggest_products(prefix, limit))
+
+    @action(detail=False, methods=['post'], permission_classes=[IsAuthenticated & IsAdminUser],
+            parser_classes=[JSONParser, NDJSONParser])
+    def bulk(self, request):
+        """
+        Массовое создание и обновление товаров: JSON массив или NDJSON поток объектов товара.
+        Объекты с `id` частично обновляют товар, без `id` создают новый. При ошибке хотя бы в одной строке
+        ничего не записывается, ответ 400 содержит ошибки по строкам.
+        """
+        creates, updates = validate_products(request.data, context=self.get_serializer_context())
+        created_ids, updated_ids = save_products(creates, updates)
+        return Response({'created': created_ids, 'updated': updated_ids})
+
+
+class ReviewViewSet(ConditionalGetMixin, ExportMixin, IdempotentCreateMixin, SparseQuerysetMixin, ModelViewSet):
     """ Viewset для отзывов. """
 
     queryset = Review.objects.select_related('creator', 'product')
     permission_classes = [IsAuthenticatedOrReadOnly]
     serializer_class = ReviewSerializer
+    pagination_class = KeysetPagination
+    # Отзывы содержат вложенный товар
+    etag_versions = ('product', 'stock')
+    etag_probe_queryset = True
 
     filterset_class = ReviewFilter
 
@@ -41,32 +97,38 @@ class ReviewViewSet(ModelViewSet):
         else:
             return super(ReviewViewSet, self).get_permissions()
 
+    def perform_destroy(self, instance):
+        with transaction.atomic():
+            super().perform_destroy(instance)
+            Product.objects.filter(pk=instance.product_id).add_review_mark(instance.mark, delta=-1)
 
-class OrderViewSet(ModelViewSet):
+
+class OrderViewSet(ConditionalGetMixin, ExportMixin, IdempotentCreateMixin, NestedLimitMixin, SparseQuerysetMixin,
+                   ArchiveQuerysetMixin, ModelViewSet):
     """ Viewset для заказов. """
 
     order_product_set = OrderProduct.objects.select_related('product')
-    queryset = Order.objects.prefetch_related(Prefetch('positions', queryset=order_product_set))
+    queryset = Order.objects.select_related('creator').prefetch_related(Prefetch('positions', queryset=order_product_set))
+    # Архивные заказы (archive_orders) включаются, только если запрос фильтрует по датам
+    archive_queryset = OrderHistory.objects.select_related('creator').prefetch_related(
+        Prefetch('positions', queryset=OrderHistoryProduct.objects.select_related('product'))
+    )
+    archive_filterset_class = OrderHistoryFilter
+    archive_query_params = ('created_at_after', 'created_at_before', 'updated_at_after', 'updated_at_before')
+    # Ссылки на позиции есть и у архивных заказов в ответах с фильтром по датам
+    archive_actions = ('positions',)
     permission_classes = [IsAuthenticated & IsOwnerOrAdminUser]
     serializer_class = OrderSerializer
+    pagination_class = CountedKeysetPagination
+    # Позиции заказов содержат вложенные товары
+    etag_versions = ('product', 'stock')
+    etag_probe_queryset = True
 
     filter_backends = [DjangoFilterBackend, filters.OrderingFilter, IsOwnerOrAdminFilterBackend]
     ordering_fields = ['amount', ]
 
     filterset_class = OrderFilter
 
-    def get_queryset(self):
-        """queryset с заказами только для создателя или для админа c фильтрацией по продукту из позиции"""
-
-        filter_params = {}
-
-        # фильтрация для продукта из позиции
-        product_id = self.request.query_params.get('product')
-        if product_id is not None:
-            filter_params = {'positions__product__id': product_id}
-
-        return self.queryset.filter(**filter_params)
-
     def get_permissions(self):
         """Получение прав для действий."""
         if self.action == "create":
@@ -76,11 +138,139 @@ class OrderViewSet(ModelViewSet):
         else:
             return super(OrderViewSet, self).get_permissions()
 
+    def create(self, request, *args, **kwargs):
+        """
+        Создание заказа. В асинхронном режиме (настройка ORDER_INTAKE_ASYNC или заголовок
+        `Prefer: respond-async`) проверяется только форма данных, заказ ставится в очередь
+        и возвращается 202 с заявкой, статус которой доступен по ссылке из заголовка Location.
+        """
+        if not is_async_intake(request, default=settings.ORDER_INTAKE_ASYNC):
+            return super().create(request, *args, **kwargs)
+        return self.idempotent_response(self.create_ticket, request)
+
+    def create_ticket(self, request):
+        """Заявка на создание заказа для асинхронного приёма."""
+        serializer = OrderIntakeSerializer(data=request.data)
+        serializer.is_valid(raise_exception=True)
+        ticket = OrderTicket.objects.create(creator=request.user, payload=serializer.validated_data)
+
+        data = OrderTicketSerializer(ticket, context=self.get_serializer_context()).data
+        headers = {'Location': data['url'], 'Preference-Applied': 'respond-async'}
+        return Response(data, status=HTTP_202_ACCEPTED, headers=headers)
+
+    def get_queryset(self):
+        if self.action == 'positions':
+            # Позициям заказа (действующего или архивного) нужен только сам заказ с владельцем
+            # для проверки прав, без его позиций.
+            return self.queryset.model.objects.select_related('creator')
+        return super().get_queryset()
+
+    @action(detail=True, methods=['get'])
+    def positions(self, request, pk=None):
+        """ Все позиции заказа с пагинацией, в ответе заказа их не больше NESTED_LIST_LIMIT. """
+        order = self.get_object()
+        return self.get_nested_response(order.positions.select_related('product'), ProductOrderSerializer)
+
+
+class OrderTicketViewSet(mixins.RetrieveModelMixin, GenericViewSet):
+    """ Viewset для статуса заявок асинхронного создания заказов. """
+
+    queryset = OrderTicket.objects.all()
+    permission_classes = [IsAuthenticated]
+    serializer_class = OrderTicketSerializer
+    filter_backends = [IsOwnerOrAdminFilterBackend]
+
 
-class CollectionViewSet(ModelViewSet):
+class CollectionViewSet(ConditionalGetMixin, CachedResponseMixin, NestedLimitMixin, SparseQuerysetMixin, ModelViewSet):
     """ Viewset для подборок. """
 
     collection_product_set = CollectionProduct.objects.select_related('product')
     queryset = Collection.objects.prefetch_related(Prefetch('products', collection_product_set))
     permission_classes = [IsAuthenticatedOrReadOnly & IsAdminUserOrReadOnly]
     serializer_class = CollectionSerializer
+    pagination_class = KeysetPagination
+    # Подборки содержат товары, поэтому ответы зависят и от версий товаров и остатков
+    cache_versions = etag_versions = ('collection', 'product', 'stock')
+
+    def get_queryset(self):
+        if self.action in ('products', 'add_products', 'remove_products'):
+            # Товарам подборки и изменению её состава нужна только сама подборка, без её товаров.
+            return Collection.objects.only('id')
+        return super().get_queryset()
+
+    @action(detail=True, methods=['get'])
+    def products(self, request, pk=None):
+        """ Все товары подборки с пагинацией, в ответе подборки их не больше NESTED_LIST_LIMIT. """
+        collection = self.get_object()
+        return self.get_nested_response(collection.products.select_related('product'), CollectionProductSerializer)
+
+    def get_product_ids(self, request):
+        serializer = CollectionProductIdsSerializer(data=request.data)
+        serializer.is_valid(raise_exception=True)
+        return serializer.validated_data['product_ids']
+
+    @action(detail=True, methods=['post'], url_path='products/add', url_name='products-add')
+    def add_products(self, request, pk=None):
+        """
+        Добавляет товары в подборку одним запросом: {"product_ids": [1, 2]}.
+        Товары, которые уже в подборке, пропускаются. Если какого-то товара нет, ничего не добавляется.
+        """
+        collection = self.get_object()
+        added, missing = add_collection_products(collection.pk, self.get_product_ids(request))
+        if missing:
+            raise ValidationError({'product_ids': [
+                f'Invalid pk "{product_id}" - object does not exist.' for product_id in missing
+            ]})
+        return Response({'added': added})
+
+    @action(detail=True, methods=['post'], url_path='products/remove', url_name='products-remove')
+    def remove_products(self, request, pk=None):
+        """
+        Удаляет товары из подборки одним запросом: {"product_ids": [1, 2]}.
+        Товары, которых нет в подборке, пропускаются. Удалить все товары подборки нельзя.
+        """
+        collection = self.get_object()
+        removed = remove_collection_products(collection.pk, self.get_product_ids(request))
+        if removed is None:
+            raise ValidationError({'product_ids': ['Collection cannot be left without products.']})
+        return Response({'removed': removed})
+
+
+class DailySalesViewSet(mixins.ListModelMixin, GenericViewSet):
+    """ Количество и сумма заказов по дням из предрасчитанной аналитики (refresh_sales_analytics). """
+
+    queryset = DailySales.objects.order_by('day')
+    permission_classes = [IsAuthenticated & IsAdminUser]
+    serializer_class = DailySalesSerializer
+    filterset_class = DailySalesFilter
+
+
+class ProductSalesViewSet(mixins.ListModelMixin, GenericViewSet):
+    """ Товары по убыванию выручки за период: ?day_after=&day_before=&limit=<N>. """
+
+    queryset = DailyProductSales.objects.values('product').annotate(
+        title=F('product__title'), quantity=Sum('quantity'), revenue=Sum('revenue')
+    ).order_by('-revenue', 'product')
+    permission_classes = [IsAuthenticated & IsAdminUser]
+    serializer_class = ProductSalesSerializer
+    filterset_class = DailyProductSalesFilter
+    limit = 100
+    max_limit = 1000
+
+    def list(self, request, *args, **kwargs):
+        try:
+            limit = positive_int(request.query_params['limit'], cutoff=self.max_limit)
+        except (KeyError, ValueError):
+            limit = self.limit
+
+        queryset = self.filter_queryset(self.get_queryset())[:limit]
+        return Response(self.get_serializer(queryset, many=True).data)
+
+
+class StatusSalesViewSet(mixins.ListModelMixin, GenericViewSet):
+    """ Количество заказов по статусам за период. """
+
+    queryset = DailyStatusSales.objects.values('status').annotate(orders_count=Sum('orders_count')).order_by('status')
+    permission_classes = [IsAuthenticated & IsAdminUser]
+    serializer_class = StatusSalesSerializer
+    filterset_class = DailyStatusSalesFilter
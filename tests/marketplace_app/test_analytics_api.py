@@ -0,0 +1,76 @@
+from datetime import timedelta
+
+import pytest
+from django.core.management import call_command
+from django.utils import timezone
+from model_bakery import baker
+from rest_framework.reverse import reverse
+from rest_framework.status import HTTP_200_OK, HTTP_401_UNAUTHORIZED, HTTP_403_FORBIDDEN
+
+from marketplace.models import Order
+
+
+@pytest.fixture
+def sales(user_factory, product_factory):
+    """ Заказы за сегодня и неделю назад с пересчитанной аналитикой. """
+    user = user_factory()
+    products = product_factory(_quantity=2)
+    for days, status, product, quantity in ((0, 'NEW', products[0], 1), (0, 'DONE', products[1], 5),
+                                            (7, 'DONE', products[0], 2)):
+        order = baker.make('order', creator=user, amount=quantity * 10, status=status)
+        baker.make('orderproduct', order=order, product=product, quantity=quantity, unit_price=10,
+                   line_total=quantity * 10)
+        Order.objects.filter(pk=order.pk).update(created_at=timezone.now() - timedelta(days=days))
+    call_command('refresh_sales_analytics', full=True)
+    return products
+
+
+@pytest.mark.django_db
+def test_sales_analytics_by_day(api_auth_admin, sales):
+    # arrange
+    today = timezone.localdate()
+    url = reverse("analytics-sales-list")
+
+    # act
+    resp = api_auth_admin.get(url)
+    filtered = api_auth_admin.get(url, {'day_after': today.isoformat()})
+
+    # assert
+    assert resp.status_code == HTTP_200_OK
+    assert resp.json() == [
+        {'day': (today - timedelta(days=7)).isoformat(), 'orders_count': 1, 'revenue': '20.00'},
+        {'day': today.isoformat(), 'orders_count': 2, 'revenue': '60.00'},
+    ]
+    assert filtered.json() == resp.json()[1:]
+
+
+@pytest.mark.django_db
+def test_sales_analytics_by_product_and_status(api_auth_admin, sales):
+    # arrange
+    today = timezone.localdate().isoformat()
+
+    # act
+    products = api_auth_admin.get(reverse("analytics-products-list"))
+    top = api_auth_admin.get(reverse("analytics-products-list"), {'day_after': today, 'limit': 1})
+    statuses = api_auth_admin.get(reverse("analytics-statuses-list"))
+
+    # assert
+    assert products.status_code == HTTP_200_OK
+    assert products.json() == [
+        {'product': sales[1].id, 'title': sales[1].title, 'quantity': 5, 'revenue': '50.00'},
+        {'product': sales[0].id, 'title': sales[0].title, 'quantity': 3, 'revenue': '30.00'},
+    ]
+    assert top.json() == products.json()[:1]
+    assert statuses.json() == [{'status': 'DONE', 'orders_count': 2}, {'status': 'NEW', 'orders_count': 1}]
+
+
+@pytest.mark.parametrize("url_name", ("analytics-sales-list", "analytics-products-list", "analytics-statuses-list"))
+@pytest.mark.django_db
+def test_sales_analytics_for_admin_only(api_client, api_auth_client, url_name):
+    # act
+    anonymous = api_client.get(reverse(url_name))
+    user = api_auth_client.get(reverse(url_name))
+
+    # assert
+    assert anonymous.status_code == HTTP_401_UNAUTHORIZED
+    assert user.status_code == HTTP_403_FORBIDDEN
@@ -1,7 +1,15 @@
 import pytest
+from django.db import connection
+from django.test.utils import CaptureQueriesContext
+from model_bakery import baker
 from rest_framework.reverse import reverse
 from rest_framework.status import HTTP_200_OK, HTTP_401_UNAUTHORIZED, HTTP_400_BAD_REQUEST, HTTP_403_FORBIDDEN, \
-    HTTP_201_CREATED, HTTP_204_NO_CONTENT
+    HTTP_201_CREATED, HTTP_204_NO_CONTENT, HTTP_404_NOT_FOUND
+from rest_framework.test import APIRequestFactory
+
+from marketplace.cache import get_versions
+from marketplace.models import CollectionProduct
+from marketplace.serializers import CollectionSerializer
 
 
 @pytest.mark.django_db
@@ -17,7 +25,7 @@ def test_retrieve_collection(api_client, collection_factory):
     assert resp.status_code == HTTP_200_OK
     resp_json = resp.json()
     assert resp_json
-    assert len(resp_json) == 6  # fields count
+    assert len(resp_json) == 8  # fields count
     assert resp_json['id'] == obj.id
     assert resp_json['title'] == obj.title
     assert resp_json['text'] == obj.text
@@ -36,7 +44,7 @@ def test_list_collection(api_client, collection_factory):
 
     # assert
     assert resp.status_code == HTTP_200_OK
-    resp_json = resp.json()
+    resp_json = resp.json()['results']
     assert resp_json
     assert len(resp_json) == len(objs)
     for i, item in enumerate(resp_json):
@@ -151,7 +159,7 @@ def test_create_collection_for_admin_client(api_auth_admin, product_ids_factory)
     assert resp.status_code == HTTP_201_CREATED
     resp_json = resp.json()
     assert resp_json
-    assert len(resp_json) == 6  # fields count
+    assert len(resp_json) == 8  # fields count
     assert resp_json['title'] == payload['title']
     for i, item in enumerate(resp_json['products']):
         assert item['product']['id'] == payload['products'][i]['product_id']
@@ -243,7 +251,7 @@ def test_update_collection_for_admin_client(api_auth_admin, collection_factory,
     resp = api_auth_admin.patch(url, payload, format='json')
     assert resp.status_code == HTTP_200_OK
     resp_json = resp.json()
-    assert len(resp_json) == 6  # fields count
+    assert len(resp_json) == 8  # fields count
     assert resp_json['id'] == collection.id
     assert resp_json['title'] == payload['title']
     assert resp_json['text'] == payload['text']
@@ -251,6 +259,61 @@ def test_update_collection_for_admin_client(api_auth_admin, collection_factory,
         assert item['product']['id'] == payload['products'][i]['product_id']
 
 
+@pytest.mark.django_db
+def test_update_collection_applies_products_diff(api_auth_admin, product_factory):
+    # arrange
+    kept, removed, added = product_factory(_quantity=20), product_factory(_quantity=20), product_factory(_quantity=20)
+    collection = baker.make('collection', make_m2m=False)
+    CollectionProduct.objects.bulk_create(CollectionProduct(collection=collection, product=p) for p in kept + removed)
+    payload = {'products': [{'product_id': p.id} for p in kept + added + added[:5]]}
+
+    # act
+    with CaptureQueriesContext(connection) as captured:
+        resp = api_auth_admin.patch(reverse("product-collections-detail", kwargs={'pk': collection.id}),
+                                    payload, format='json')
+
+    # assert
+    assert resp.status_code == HTTP_200_OK
+    assert set(collection.products.values_list('product_id', flat=True)) == {p.id for p in kept + added}
+    writes = [query['sql'].split()[0] for query in captured
+              if query['sql'].startswith(('INSERT', 'DELETE')) and 'marketplace_collection_products' in query['sql']]
+    assert writes == ['INSERT', 'DELETE']
+
+
+@pytest.mark.django_db
+def test_update_collection_products_without_row_signals(product_factory, django_assert_num_queries):
+    # arrange
+    kept, removed, added = product_factory(_quantity=5), product_factory(_quantity=45), product_factory(_quantity=5)
+    collection = baker.make('collection', make_m2m=False)
+    CollectionProduct.objects.bulk_create(CollectionProduct(collection=collection, product=p) for p in kept + removed)
+    serializer = CollectionSerializer(collection, data={'products': [{'product_id': p.id} for p in kept + added]},
+                                      partial=True, context={'request': APIRequestFactory().patch('/')})
+    assert serializer.is_valid(), serializer.errors
+    version, = get_versions('collection')
+
+    # act: SAVEPOINT, текущие товары, INSERT, DELETE, UPDATE подборки, RELEASE SAVEPOINT
+    with django_assert_num_queries(6):
+        serializer.save()
+
+    # assert
+    assert set(collection.products.values_list('product_id', flat=True)) == {p.id for p in kept + added}
+    assert get_versions('collection') == (version + 1,)
+
+
+@pytest.mark.django_db
+def test_create_collection_skips_duplicate_products(api_auth_admin, product_factory):
+    # arrange
+    products = product_factory(_quantity=3)
+    payload = {'title': 'test', 'products': [{'product_id': p.id} for p in products + products]}
+
+    # act
+    resp = api_auth_admin.post(reverse("product-collections-list"), payload, format='json')
+
+    # assert
+    assert resp.status_code == HTTP_201_CREATED
+    assert [item['product']['id'] for item in resp.json()['products']] == [p.id for p in products]
+
+
 @pytest.mark.django_db
 def test_delete_collection_for_admin_client(api_client, collection_factory):
     # arrange
@@ -286,3 +349,223 @@ def test_delete_collection_for_admin_client(api_auth_admin, collection_factory):
     assert resp.status_code == HTTP_204_NO_CONTENT
 
 
+
+
+@pytest.mark.django_db
+def test_cached_collection_reflects_product_changes(api_client, api_auth_admin, collection_factory):
+    # arrange
+    collection = collection_factory()
+    product = collection.products.first().product
+    url = reverse("product-collections-detail", kwargs={'pk': collection.id})
+    resp = api_client.get(url)
+    assert resp.status_code == HTTP_200_OK
+
+    # act: товар из подборки изменился
+    resp = api_auth_admin.patch(reverse("products-detail", kwargs={'pk': product.id}), {'title': 'new'})
+    assert resp.status_code == HTTP_200_OK
+
+    # assert
+    resp_json = api_client.get(url).json()
+    assert 'new' in [item['product']['title'] for item in resp_json['products']]
+
+
+@pytest.mark.django_db
+def test_validate_products_resolves_products_in_one_query(api_auth_admin, product_ids_factory,
+                                                          django_assert_num_queries):
+    # arrange
+    products = product_ids_factory(_quantity=30)
+    request = APIRequestFactory().post(reverse("product-collections-list"))
+
+    # act
+    serializer = CollectionSerializer(data={'title': 'test', 'products': products}, context={'request': request})
+    with django_assert_num_queries(1):
+        assert serializer.is_valid(), serializer.errors
+
+    # act: несуществующий товар
+    payload = {'title': 'test', 'products': products[:2] + [{'product_id': 0}]}
+    resp = api_auth_admin.post(reverse("product-collections-list"), payload, format='json')
+
+    # assert
+    assert resp.status_code == HTTP_400_BAD_REQUEST
+    assert resp.json()['products'] == [{}, {}, {'product_id': ['Invalid pk "0" - object does not exist.']}]
+
+
+@pytest.mark.django_db
+def test_retrieve_collection_sparse_fields(api_client, collection_factory):
+    # arrange
+    collection = collection_factory()
+    titles = sorted(item.product.title for item in collection.products.all())
+    url = reverse("product-collections-detail", kwargs={'pk': collection.id})
+
+    # act
+    with CaptureQueriesContext(connection) as captured:
+        resp = api_client.get(url, {'fields': 'title,products.product.title'})
+
+    # assert
+    assert resp.status_code == HTTP_200_OK
+    assert resp.json()['title'] == collection.title
+    assert sorted(item['product']['title'] for item in resp.json()['products']) == titles
+    assert not [query for query in captured if '"description"' in query['sql']]
+
+
+@pytest.mark.django_db
+def test_add_products_to_collection(api_client, api_auth_admin, product_factory):
+    # arrange
+    present, new = product_factory(), product_factory(_quantity=2)
+    collection = baker.make('collection', make_m2m=False)
+    CollectionProduct.objects.create(collection=collection, product=present)
+    detail_url = reverse("product-collections-detail", kwargs={'pk': collection.id})
+    api_client.get(detail_url)  # ответ кешируется
+    updated_at = collection.updated_at
+
+    # act
+    with CaptureQueriesContext(connection) as captured:
+        resp = api_auth_admin.post(reverse("product-collections-products-add", kwargs={'pk': collection.id}),
+                                   {'product_ids': [new[1].id, present.id, new[0].id]}, format='json')
+
+    # assert
+    assert resp.status_code == HTTP_200_OK
+    assert resp.json() == {'added': sorted(p.id for p in new)}
+    assert sum('marketplace_collection_products' in query['sql'] for query in captured) == 1
+    collection.refresh_from_db()
+    assert collection.updated_at > updated_at
+    resp = api_client.get(detail_url)
+    assert sorted(item['product']['id'] for item in resp.json()['products']) == sorted(p.id for p in [present] + new)
+
+
+@pytest.mark.django_db
+def test_add_missing_products_to_collection(api_auth_admin, collection_factory, product_factory):
+    # arrange
+    collection = collection_factory()
+    count = collection.products.count()
+    product = product_factory()
+
+    # act
+    resp = api_auth_admin.post(reverse("product-collections-products-add", kwargs={'pk': collection.id}),
+                               {'product_ids': [product.id, 999999]}, format='json')
+
+    # assert
+    assert resp.status_code == HTTP_400_BAD_REQUEST
+    assert resp.json() == {'product_ids': ['Invalid pk "999999" - object does not exist.']}
+    assert collection.products.count() == count
+
+
+@pytest.mark.django_db
+def test_remove_products_from_collection(api_auth_admin, product_factory):
+    # arrange
+    products = product_factory(_quantity=3)
+    collection = baker.make('collection', make_m2m=False)
+    CollectionProduct.objects.bulk_create(CollectionProduct(collection=collection, product=p) for p in products)
+    url = reverse("product-collections-products-remove", kwargs={'pk': collection.id})
+    updated_at = collection.updated_at
+
+    # act
+    resp = api_auth_admin.post(url, {'product_ids': [products[0].id, 999999]}, format='json')
+
+    # assert
+    assert resp.status_code == HTTP_200_OK
+    assert resp.json() == {'removed': [products[0].id]}
+    assert sorted(collection.products.values_list('product_id', flat=True)) == [p.id for p in products[1:]]
+    collection.refresh_from_db()
+    assert collection.updated_at > updated_at
+
+    # act: подборка не может остаться без товаров
+    resp = api_auth_admin.post(url, {'product_ids': [p.id for p in products]}, format='json')
+
+    # assert
+    assert resp.status_code == HTTP_400_BAD_REQUEST
+    assert collection.products.count() == 2
+
+
+@pytest.mark.parametrize(
+    ["url_name", "payload"],
+    (
+        ("product-collections-products-add", {'product_ids': []}),
+        ("product-collections-products-remove", {'product_ids': ['x']}),
+        ("product-collections-products-remove", {}),
+    )
+)
+@pytest.mark.django_db
+def test_validate_collection_products_change(api_auth_admin, collection_factory, url_name, payload):
+    # arrange
+    collection = collection_factory()
+
+    # act
+    resp = api_auth_admin.post(reverse(url_name, kwargs={'pk': collection.id}), payload, format='json')
+
+    # assert
+    assert resp.status_code == HTTP_400_BAD_REQUEST
+
+
+@pytest.mark.django_db
+def test_change_collection_products_for_nonadmin_client(api_auth_client, collection_factory, product_factory):
+    # arrange
+    collection = collection_factory()
+    url = reverse("product-collections-products-add", kwargs={'pk': collection.id})
+
+    # act
+    resp = api_auth_client.post(url, {'product_ids': [product_factory().id]}, format='json')
+
+    # assert
+    assert resp.status_code == HTTP_403_FORBIDDEN
+
+
+@pytest.mark.django_db
+def test_list_collections_caps_products(api_client, product_factory, settings):
+    # arrange
+    settings.NESTED_LIST_LIMIT = 3
+    products = product_factory(_quantity=6)
+    large, small = baker.make('collection', make_m2m=False, _quantity=2)
+    CollectionProduct.objects.bulk_create(
+        [CollectionProduct(collection=large, product=p) for p in products]
+        + [CollectionProduct(collection=small, product=p) for p in products[:2]]
+    )
+
+    # act
+    resp = api_client.get(reverse("product-collections-list"))
+
+    # assert
+    assert resp.status_code == HTTP_200_OK
+    items = {item['id']: item for item in resp.json()['results']}
+    assert [item['product']['id'] for item in items[large.id]['products']] == [p.id for p in products[:3]]
+    assert items[large.id]['products_count'] == 6
+    assert len(items[small.id]['products']) == items[small.id]['products_count'] == 2
+    assert items[large.id]['products_url'].endswith(
+        reverse("product-collections-products", kwargs={'pk': large.id})
+    )
+
+    # act: полный список товаров подборки постранично
+    ids, url, params = [], items[large.id]['products_url'], {'page_size': 4}
+    while url:
+        page = api_client.get(url, params).json()
+        ids.extend(item['product']['id'] for item in page['results'])
+        url, params = page['next'], None
+
+    # assert
+    assert ids == [p.id for p in products]
+
+
+@pytest.mark.django_db
+def test_collection_products_for_missing_collection(api_client):
+    # act
+    resp = api_client.get(reverse("product-collections-products", kwargs={'pk': 999999}))
+
+    # assert
+    assert resp.status_code == HTTP_404_NOT_FOUND
+
+
+@pytest.mark.django_db
+def test_list_collections_products_count_in_one_query(api_client, product_factory, django_assert_num_queries):
+    # arrange
+    products = product_factory(_quantity=4)
+    for i in range(5):
+        collection = baker.make('collection', make_m2m=False)
+        CollectionProduct.objects.bulk_create(CollectionProduct(collection=collection, product=p) for p in products[:i])
+
+    # act: страница подборок и количества товаров одним GROUP BY
+    with django_assert_num_queries(2):
+        resp = api_client.get(reverse("product-collections-list"), {'fields': 'id,products_count'})
+
+    # assert
+    assert resp.status_code == HTTP_200_OK
+    assert [item['products_count'] for item in resp.json()['results']] == [0, 1, 2, 3, 4]
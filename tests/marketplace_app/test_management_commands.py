@@ -0,0 +1,294 @@
+import decimal
+import io
+import json
+from datetime import timedelta
+
+import pytest
+from django.contrib.postgres.search import SearchQuery
+from django.core.management import call_command
+from django.core.management.base import CommandError
+from django.utils import timezone
+from model_bakery import baker
+
+from marketplace.cache import get_versions
+from marketplace.models import IdempotencyKey, Order, OrderProduct, OrderTicket, Product, SEARCH_CONFIG, \
+    DailySales, DailyProductSales, DailyStatusSales, SalesChange, ArchivedOrder, ArchivedOrderProduct
+
+
+@pytest.mark.django_db
+def test_rebuild_product_ratings(product_factory, review_factory):
+    # arrange: агрегаты разошлись с отзывами
+    product = product_factory(review_count=10, mark_sum=10, mark_1_count=10)
+    review_factory(product=product, mark=5)
+    review_factory(product=product, mark=4)
+    without_reviews = product_factory(review_count=1, mark_sum=3, mark_3_count=1)
+    version = get_versions('product')
+
+    # act
+    call_command('rebuild_product_ratings', batch_size=1)
+
+    # assert
+    product.refresh_from_db()
+    assert (product.review_count, product.mark_sum) == (2, 9)
+    assert [getattr(product, f'mark_{mark}_count') for mark in range(1, 6)] == [0, 0, 0, 1, 1]
+    without_reviews.refresh_from_db()
+    assert (without_reviews.review_count, without_reviews.mark_sum, without_reviews.mark_3_count) == (0, 0, 0)
+    assert Product.objects.with_rating().get(pk=product.pk).rating == 4.5
+    assert get_versions('product') > version
+
+
+@pytest.mark.django_db
+def test_import_catalog_from_csv(tmp_path, product_factory, review_factory):
+    # arrange
+    product = product_factory(title='старый', description='', price=100)
+    review_factory(product=product, mark=5)
+    Product.objects.filter(pk=product.pk).add_review_mark(5)
+    path = tmp_path / 'catalog.csv'
+    path.write_text(
+        'id,title,description,price\n'
+        f'{product.id},обновлённый,"описание, с запятой",200\n'
+        ',смартфон,,300.50\n'
+        '1000000,ноутбук,новый,400\n',
+        encoding='utf-8'
+    )
+    out = io.StringIO()
+
+    # act
+    call_command('import_catalog', str(path), batch_size=2, stdout=out)
+
+    # assert
+    assert 'строк/сек' in out.getvalue()
+    assert Product.objects.count() == 3
+    product.refresh_from_db()
+    assert (product.title, product.description, product.price) == ('обновлённый', 'описание, с запятой', 200)
+    assert (product.review_count, product.mark_sum) == (1, 5)
+    created = Product.objects.get(title='смартфон')
+    assert (created.description, created.price, created.review_count) == ('', decimal.Decimal('300.50'), 0)
+    assert Product.objects.filter(pk=1000000, title='ноутбук').exists()
+    assert Product.objects.filter(search_document=SearchQuery('смартфоны', config=SEARCH_CONFIG)).get() == created
+
+    # assert: последовательность id сдвинута за импортированные id
+    assert product_factory().id > 1000000
+
+
+@pytest.mark.django_db
+def test_import_catalog_with_new_ids_and_without_ids(tmp_path, product_factory):
+    # arrange: следующий id последовательности явно задан в файле вместе со строкой без id
+    next_id = product_factory().id + 1
+    path = tmp_path / 'catalog.csv'
+    path.write_text(
+        'id,title,description,price\n'
+        f'{next_id},явный,,100\n'
+        ',без id,,200\n',
+        encoding='utf-8'
+    )
+
+    # act
+    call_command('import_catalog', str(path), stdout=io.StringIO())
+
+    # assert
+    assert Product.objects.get(pk=next_id).title == 'явный'
+    assert Product.objects.get(title='без id').id > next_id
+    assert product_factory().id > next_id + 1
+
+
+@pytest.mark.django_db
+def test_import_catalog_from_ndjson(tmp_path, product_factory):
+    # arrange
+    product = product_factory(title='старый', price=100)
+    path = tmp_path / 'catalog.ndjson'
+    path.write_text(
+        json.dumps({'id': product.id, 'title': 'первый', 'price': 1}) + '\n\n'
+        + json.dumps({'id': product.id, 'title': 'последний', 'price': 2}) + '\n'
+        + json.dumps({'title': 'новый', 'price': 3}) + '\n',
+        encoding='utf-8'
+    )
+
+    # act
+    call_command('import_catalog', str(path), stdout=io.StringIO())
+
+    # assert: при повторе id используется последняя строка
+    product.refresh_from_db()
+    assert (product.title, product.price) == ('последний', 2)
+    assert Product.objects.filter(title='новый').exists()
+
+
+@pytest.mark.parametrize(
+    ["content", "message"],
+    (
+        ('title,price\nтовар,не число\n', 'строк 1-1'),
+        ('title,price\n,10\nтовар,200000\n', 'строках: 1, 2'),
+    )
+)
+@pytest.mark.django_db
+def test_import_catalog_with_invalid_rows(tmp_path, product_factory, content, message):
+    # arrange
+    product_factory(title='старый')
+    path = tmp_path / 'catalog.csv'
+    path.write_text(content, encoding='utf-8')
+
+    # act
+    with pytest.raises(CommandError, match=message):
+        call_command('import_catalog', str(path), stdout=io.StringIO())
+
+    # assert: ничего не записано
+    assert list(Product.objects.values_list('title', flat=True)) == ['старый']
+
+
+@pytest.mark.django_db
+def test_backfill_order_prices(order_factory, product_factory):
+    # arrange: позиции, созданные до появления цены в позиции
+    product, another_product = product_factory(_quantity=2, price=100)
+    single = order_factory(amount=90, products=[])
+    OrderProduct.objects.create(order=single, product=product, quantity=3)
+    multiple = order_factory(amount=300, products=[])
+    OrderProduct.objects.create(order=multiple, product=product, quantity=2)
+    OrderProduct.objects.create(order=multiple, product=another_product, quantity=1)
+    OrderProduct.objects.create(
+        order=multiple, product=product, quantity=1, unit_price=decimal.Decimal(1), line_total=decimal.Decimal(1)
+    )
+    out = io.StringIO()
+
+    # act
+    call_command('backfill_order_prices', batch_size=1, stdout=out)
+
+    # assert
+    assert '3' in out.getvalue()
+    assert list(single.positions.values_list('unit_price', 'line_total')) == [(30, 90)]
+    assert list(multiple.positions.order_by('id').values_list('unit_price', 'line_total')) == [
+        (100, 200), (100, 100), (1, 1)
+    ]
+    assert not OrderProduct.objects.filter(unit_price__isnull=True).exists()
+
+
+@pytest.mark.django_db(transaction=True)
+def test_process_order_tickets(user_factory, product_factory):
+    # arrange
+    user = user_factory()
+    product = product_factory(price=10)
+    OrderTicket.objects.bulk_create([
+        OrderTicket(creator=user, payload={'positions': [{'product_id': product.id, 'quantity': i}]})
+        for i in range(1, 21)
+    ])
+    out = io.StringIO()
+
+    # act: несколько воркеров в потоках
+    call_command('process_order_tickets', workers=3, batch_size=4, once=True, stdout=out)
+
+    # assert: каждая заявка обработана ровно один раз
+    assert 'Обработано заявок: 20' in out.getvalue()
+    assert not OrderTicket.objects.exclude(status=OrderTicket.TicketStatus.DONE).exists()
+    assert Order.objects.count() == 20
+    assert sorted(Order.objects.values_list('amount', flat=True)) == [10 * i for i in range(1, 21)]
+
+
+@pytest.mark.django_db
+def test_purge_idempotency_keys(user_factory, settings):
+    # arrange
+    user = user_factory()
+    IdempotencyKey.objects.bulk_create([
+        IdempotencyKey(user=user, scope='orders', key=str(i), request_hash='', status_code=201, response={})
+        for i in range(5)
+    ])
+    expired = timezone.now() - timedelta(seconds=settings.IDEMPOTENCY_KEY_TTL + 1)
+    IdempotencyKey.objects.filter(key__in=['0', '1', '2']).update(created_at=expired)
+
+    # act
+    call_command('purge_idempotency_keys', batch_size=2, stdout=io.StringIO())
+
+    # assert
+    assert sorted(IdempotencyKey.objects.values_list('key', flat=True)) == ['3', '4']
+
+
+@pytest.mark.django_db
+def test_refresh_sales_analytics(user_factory, product_factory):
+    # arrange
+    user = user_factory()
+    product = product_factory()
+    orders = [
+        baker.make('order', creator=user, amount=300, status=status)
+        for status in (Order.OrderStatus.NEW, Order.OrderStatus.DONE, Order.OrderStatus.DONE)
+    ]
+    for order in orders:
+        baker.make('orderproduct', order=order, product=product, quantity=3, unit_price=100, line_total=300)
+    today = timezone.localdate()
+
+    # act
+    call_command('refresh_sales_analytics', stdout=io.StringIO())
+
+    # assert
+    assert not SalesChange.objects.exists()
+    assert DailySales.objects.get(day=today).orders_count == 3
+    assert DailySales.objects.get(day=today).revenue == 900
+    sales = DailyProductSales.objects.get(day=today, product=product)
+    assert (sales.quantity, sales.revenue) == (9, 900)
+    assert dict(DailyStatusSales.objects.values_list('status', 'orders_count')) == {'NEW': 1, 'DONE': 2}
+
+    # act: изменения после пересчёта учитываются следующим запуском только за затронутые дни
+    orders[0].status = Order.OrderStatus.DONE
+    orders[0].save()
+    orders[1].delete()
+    out = io.StringIO()
+    call_command('refresh_sales_analytics', stdout=out)
+
+    # assert
+    assert 'Пересчитано дней: 1' in out.getvalue()
+    assert DailySales.objects.get(day=today).orders_count == 2
+    assert DailyProductSales.objects.get(day=today, product=product).quantity == 6
+    assert dict(DailyStatusSales.objects.values_list('status', 'orders_count')) == {'DONE': 2}
+
+
+@pytest.mark.django_db
+def test_refresh_sales_analytics_full(user_factory):
+    # arrange: заказ, изменённый в обход сигналов, учитывается только полным пересчётом
+    order = baker.make('order', creator=user_factory(), amount=100)
+    call_command('refresh_sales_analytics', stdout=io.StringIO())
+    day = timezone.localdate() - timedelta(days=3)
+    Order.objects.filter(pk=order.pk).update(created_at=timezone.now() - timedelta(days=3))
+
+    # act
+    out = io.StringIO()
+    call_command('refresh_sales_analytics', stdout=out)
+    assert 'Изменений нет' in out.getvalue()
+    call_command('refresh_sales_analytics', full=True, stdout=io.StringIO())
+
+    # assert
+    assert list(DailySales.objects.values_list('day', 'orders_count')) == [(day, 1)]
+
+
+@pytest.mark.django_db
+def test_archive_orders(user_factory, product_factory):
+    # arrange
+    user = user_factory()
+    product = product_factory()
+    orders = {}
+    for name, status, days in (('old_done', 'DONE', 100), ('old_new', 'NEW', 100), ('recent_done', 'DONE', 10)):
+        orders[name] = baker.make('order', creator=user, status=status, amount=100)
+        baker.make('orderproduct', order=orders[name], product=product, quantity=2, unit_price=50, line_total=100)
+        Order.objects.filter(pk=orders[name].pk).update(created_at=timezone.now() - timedelta(days=days))
+    ticket = baker.make('orderticket', creator=user, payload={}, status='DONE', order=orders['old_done'])
+    call_command('refresh_sales_analytics', full=True, stdout=io.StringIO())
+
+    # act
+    out = io.StringIO()
+    call_command('archive_orders', days=30, batch_size=1, stdout=out)
+
+    # assert
+    assert 'Перенесено в архив заказов: 1' in out.getvalue()
+    assert set(Order.objects.values_list('id', flat=True)) == {orders['old_new'].id, orders['recent_done'].id}
+    archived = ArchivedOrder.objects.get()
+    assert (archived.id, archived.status, archived.amount, archived.creator_id) == (
+        orders['old_done'].id, 'DONE', 100, user.id
+    )
+    position = ArchivedOrderProduct.objects.get()
+    assert (position.order_id, position.product_id, position.quantity, position.line_total) == (
+        archived.id, product.id, 2, 100
+    )
+    ticket.refresh_from_db()
+    assert ticket.order is None
+
+    # act: полный пересчёт аналитики учитывает архивные заказы
+    call_command('refresh_sales_analytics', full=True, stdout=io.StringIO())
+
+    # assert
+    assert sum(DailySales.objects.values_list('orders_count', flat=True)) == 3
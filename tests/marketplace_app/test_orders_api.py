@@ -1,10 +1,32 @@
+import csv
 import decimal
+import io
+import json
+import threading
+from base64 import urlsafe_b64encode
+from concurrent.futures import ThreadPoolExecutor
+from datetime import timedelta
+from unittest.mock import patch
 
 import pytest
+from django.core.management import call_command
+from django.db import DatabaseError, connection
+from django.test.utils import CaptureQueriesContext
+from django.utils import timezone
+from model_bakery import baker
 from rest_framework.authtoken.models import Token
+from rest_framework.exceptions import ValidationError
 from rest_framework.reverse import reverse
 from rest_framework.status import HTTP_200_OK, HTTP_401_UNAUTHORIZED, HTTP_404_NOT_FOUND, HTTP_201_CREATED, \
-    HTTP_400_BAD_REQUEST, HTTP_403_FORBIDDEN, HTTP_204_NO_CONTENT
+    HTTP_400_BAD_REQUEST, HTTP_403_FORBIDDEN, HTTP_204_NO_CONTENT, HTTP_304_NOT_MODIFIED, HTTP_202_ACCEPTED, \
+    HTTP_422_UNPROCESSABLE_ENTITY
+from rest_framework.test import APIClient, APIRequestFactory
+
+from marketplace.cache import get_versions
+from marketplace.intake import process_order_tickets
+from marketplace.models import IdempotencyKey, Order, OrderProduct, OrderTicket, Product
+from marketplace.serializers import OrderSerializer
+from marketplace.views import OrderViewSet
 
 
 @pytest.mark.django_db
@@ -57,7 +79,7 @@ def test_retrieve_order_owner_client(order_factory, api_client, user_factory):
 
     resp_json = resp.json()
     assert resp_json
-    assert len(resp_json) == 7  # fields count
+    assert len(resp_json) == 9  # fields count
     assert resp_json['id'] == order.id
     assert resp_json['creator']['id'] == order.creator.id
     assert resp_json['status'] == order.status
@@ -90,7 +112,7 @@ def test_list_orders_for_not_owner_client(api_client, order_factory, user_factor
 
     resp = api_client.get(url)
     assert resp.status_code == HTTP_200_OK
-    resp_json = resp.json()
+    resp_json = resp.json()['results']
     assert len(resp_json) == 0
 
 
@@ -106,7 +128,7 @@ def test_list_orders_for_owner_client(api_client, order_factory):
 
     resp = api_client.get(url)
     assert resp.status_code == HTTP_200_OK
-    resp_json = resp.json()
+    resp_json = resp.json()['results']
     assert len(resp_json) == 1
 
 
@@ -119,10 +141,59 @@ def test_list_orders_for_admin_client(api_auth_admin, order_factory, user_factor
     # for Admin client
     resp = api_auth_admin.get(url)
     assert resp.status_code == HTTP_200_OK
-    resp_json = resp.json()
+    resp_json = resp.json()['results']
     assert len(resp_json) == len(objs)
 
 
+@pytest.mark.django_db
+def test_list_orders_exact_count(api_auth_admin, order_factory):
+    # arrange
+    order_factory(_quantity=25)
+
+    # act
+    resp = api_auth_admin.get(reverse("orders-list"), {'page_size': 10})
+
+    # assert
+    assert resp.status_code == HTTP_200_OK
+    resp_json = resp.json()
+    assert (resp_json['count'], resp_json['count_estimated']) == (25, False)
+    assert len(resp_json['results']) == 10
+
+
+@pytest.mark.parametrize("params", ({}, {'status': 'DONE'}))
+@pytest.mark.django_db
+def test_list_orders_estimated_count(api_auth_admin, order_factory, settings, params):
+    # arrange
+    settings.COUNT_ESTIMATE_THRESHOLD = 0
+    order_factory(_quantity=5)
+
+    # act
+    with CaptureQueriesContext(connection) as captured:
+        resp = api_auth_admin.get(reverse("orders-list"), params)
+
+    # assert
+    assert resp.status_code == HTTP_200_OK
+    resp_json = resp.json()
+    assert resp_json['count_estimated'] is True
+    assert isinstance(resp_json['count'], int)
+    assert not any('AS "__count"' in query['sql'] for query in captured)
+
+
+@pytest.mark.django_db
+def test_admin_order_changelist_estimated_count(admin_client, order_factory, settings):
+    # arrange
+    settings.COUNT_ESTIMATE_THRESHOLD = 0
+    order_factory(_quantity=5)
+
+    # act
+    with CaptureQueriesContext(connection) as captured:
+        resp = admin_client.get(reverse("admin:marketplace_order_changelist"))
+
+    # assert
+    assert resp.status_code == HTTP_200_OK
+    assert not any('AS "__count"' in query['sql'] and 'marketplace_order' in query['sql'] for query in captured)
+
+
 @pytest.mark.django_db
 def test_filter_status_orders(api_auth_admin, order_factory, user_factory):
     # arrange
@@ -138,7 +209,7 @@ def test_filter_status_orders(api_auth_admin, order_factory, user_factory):
     # for Admin client
     resp = api_auth_admin.get(url, {'status': test_status})
     assert resp.status_code == HTTP_200_OK
-    resp_json = resp.json()
+    resp_json = resp.json()['results']
     assert resp_json[test_obj_id]['status'] == test_status
 
 
@@ -154,7 +225,7 @@ def test_order_filter_amount_orders(api_auth_admin, order_factory, user_factory)
     # for Admin client
     resp = api_auth_admin.get(url, {'ordering': 'amount'})
     assert resp.status_code == HTTP_200_OK
-    resp_json = resp.json()
+    resp_json = resp.json()['results']
     assert decimal.Decimal(resp_json[0]['amount']) == decimal.Decimal(min_amount)
     assert decimal.Decimal(resp_json[-1]['amount']) == decimal.Decimal(max_amount)
 
@@ -171,7 +242,7 @@ def test_filter_create_at_orders(api_auth_admin, order_factory):
 
     # assert
     assert resp.status_code == HTTP_200_OK
-    resp_json = resp.json()
+    resp_json = resp.json()['results']
     assert resp_json
     assert len(resp_json) == 1
 
@@ -188,7 +259,7 @@ def test_filter_updated_at_orders(api_auth_admin, order_factory):
 
     # assert
     assert resp.status_code == HTTP_200_OK
-    resp_json = resp.json()
+    resp_json = resp.json()['results']
     assert resp_json
     assert len(resp_json) == 1
 
@@ -210,7 +281,7 @@ def test_filter_product_id_orders(api_auth_admin, order_factory, product_ids_fac
 
     # assert
     assert resp.status_code == HTTP_200_OK
-    resp_json = resp.json()
+    resp_json = resp.json()['results']
     assert len(resp_json) == 1
     assert resp_json[0]['id'] == test_order['id']
     resp_json[0]['positions'][0]['product']['id'] = test_product_id
@@ -253,7 +324,7 @@ def test_create_order_for_authorized_client(api_client, product_ids_factory, use
 
     resp_json = resp.json()
     assert resp_json
-    assert len(resp_json) == 7  # fields count
+    assert len(resp_json) == 9  # fields count
     assert resp_json['creator']['id'] == creator.id
     assert decimal.Decimal(resp_json['amount']) == decimal.Decimal(test_amount)
     for i, obj in enumerate(resp_json['positions']):
@@ -425,7 +496,7 @@ def test_update_order_for_admin_client(api_auth_admin, product_ids_factory, orde
 
     resp_json = resp.json()
     assert resp_json
-    assert len(resp_json) == 7  # fields count
+    assert len(resp_json) == 9  # fields count
     assert resp_json['creator']['id'] == order['creator']['id']
     assert resp_json['amount'] == order['amount']
     assert resp_json['status'] == payload['status']
@@ -467,3 +538,727 @@ def test_delete_order_for_admin_client(api_auth_admin, order_factory):
     resp = api_auth_admin.delete(url)
     assert resp.status_code == HTTP_204_NO_CONTENT
 
+
+
+@pytest.mark.django_db
+def test_paginate_orders_with_ordering_by_amount(api_auth_admin, order_factory):
+    # arrange
+    orders = order_factory(_quantity=5, amount=decimal.Decimal(100))
+    orders += order_factory(_quantity=5, amount=decimal.Decimal(50))
+    url = reverse("orders-list")
+    expected = [obj.id for obj in sorted(orders, key=lambda obj: (obj.amount, obj.id), reverse=True)]
+
+    # act
+    ids = []
+    next_url, params = url, {'ordering': '-amount', 'page_size': 4}
+    while next_url:
+        resp = api_auth_admin.get(next_url, params)
+        assert resp.status_code == HTTP_200_OK
+        resp_json = resp.json()
+        ids.extend(item['id'] for item in resp_json['results'])
+        next_url, params = resp_json['next'], None
+
+    # assert
+    assert ids == expected
+
+
+@pytest.mark.django_db
+def test_paginate_orders_with_tampered_cursor(api_auth_admin, order_factory):
+    # arrange: значения позиции не подходят к полям сортировки (amount, id)
+    order_factory(_quantity=2, amount=decimal.Decimal(100))
+    url = reverse("orders-list")
+    cursors = [{'o': ['-amount', '-id'], 'p': ['x', 'y']}, {'o': ['-amount', '-id'], 'p': ['1', 10 ** 20]}]
+
+    for cursor in cursors:
+        # act
+        encoded = urlsafe_b64encode(json.dumps(cursor).encode()).decode()
+        resp = api_auth_admin.get(url, {'ordering': '-amount', 'cursor': encoded})
+
+        # assert
+        assert resp.status_code == HTTP_404_NOT_FOUND
+
+
+@pytest.mark.django_db
+def test_conditional_get_orders(api_client, api_auth_admin, order_factory):
+    # arrange
+    order = order_factory(status='NEW')
+    url = reverse("orders-detail", kwargs={'pk': order.id})
+    api_client.force_authenticate(order.creator)
+    etag = api_client.get(url)['ETag']
+
+    # act
+    resp = api_client.get(url, HTTP_IF_NONE_MATCH=etag)
+
+    # assert
+    assert resp.status_code == HTTP_304_NOT_MODIFIED
+
+    # assert: ETag зависит от пользователя, чужой заказ не отдаётся как 304
+    assert api_auth_admin.get(url, HTTP_IF_NONE_MATCH=etag).status_code == HTTP_200_OK
+
+    # act: изменение статуса заказа меняет ETag
+    api_auth_admin.patch(url, {'status': 'DONE'}, format='json')
+
+    # assert
+    resp = api_client.get(url, HTTP_IF_NONE_MATCH=etag)
+    assert resp.status_code == HTTP_200_OK
+    assert resp.json()['status'] == 'DONE'
+
+
+@pytest.mark.django_db
+def test_export_orders(api_client, api_auth_admin, order_factory, django_assert_num_queries):
+    # arrange
+    orders = order_factory(_quantity=5, status='NEW')
+    orders[0].status = 'DONE'
+    orders[0].save()
+    url = reverse("orders-export")
+
+    # act: NDJSON для админа с фильтром, пачками по 2 заказа
+    with patch.object(OrderViewSet, 'export_chunk_size', 2):
+        resp = api_auth_admin.get(url, {'format': 'ndjson', 'status': 'NEW'})
+        # запрос заказов серверным курсором и по одному запросу позиций на каждую пачку
+        with django_assert_num_queries(1 + 2):
+            rows = [json.loads(line) for line in b''.join(resp.streaming_content).decode().splitlines()]
+
+    # assert
+    assert resp.status_code == HTTP_200_OK
+    assert resp['Content-Type'] == 'application/x-ndjson; charset=utf-8'
+    assert sorted(row['id'] for row in rows) == sorted(order.id for order in orders[1:])
+    for row in rows:
+        assert row['positions']
+        assert row['positions'][0]['product']['title']
+
+    # act: CSV для владельца (IsOwnerOrAdminFilterBackend)
+    api_client.force_authenticate(orders[0].creator)
+    resp = api_client.get(url, {'format': 'csv'})
+
+    # assert
+    assert resp.status_code == HTTP_200_OK
+    assert resp['Content-Disposition'] == 'attachment; filename="orders.csv"'
+    rows = list(csv.DictReader(io.StringIO(b''.join(resp.streaming_content).decode())))
+    assert len(rows) == 1
+    assert rows[0]['id'] == str(orders[0].id)
+    assert rows[0]['creator.id'] == str(orders[0].creator.id)
+    assert json.loads(rows[0]['positions'])
+
+    # assert: неизвестный формат
+    assert api_auth_admin.get(url, {'format': 'xml'}).status_code == HTTP_404_NOT_FOUND
+
+
+@pytest.mark.django_db
+def test_validate_positions_resolves_products_in_one_query(product_ids_factory, django_assert_num_queries):
+    # arrange
+    payload = {"positions": product_ids_factory(_quantity=50, price=10)}
+    request = APIRequestFactory().post(reverse("orders-list"))
+
+    # act
+    serializer = OrderSerializer(data=payload, context={'request': request})
+    with django_assert_num_queries(1):
+        assert serializer.is_valid(), serializer.errors
+
+    # assert
+    assert serializer.validated_data['amount'] == 500
+
+
+@pytest.mark.django_db
+def test_validate_not_exists_products_per_position_on_create_order(api_auth_client, product_factory):
+    # arrange
+    product = product_factory()
+    payload = {
+        "positions": [{'product_id': product.id}, {'product_id': product.id + 100}, {'product_id': 'abc'}]
+    }
+
+    # act
+    resp = api_auth_client.post(reverse("orders-list"), payload, format='json')
+
+    # assert: ошибки по позициям
+    assert resp.status_code == HTTP_400_BAD_REQUEST
+    errors = resp.json()['positions']
+    assert errors[0] == {}
+    assert errors[1] == {'product_id': [f'Invalid pk "{product.id + 100}" - object does not exist.']}
+    assert errors[2] == {'product_id': ['Incorrect type. Expected pk value, received str.']}
+
+
+@pytest.mark.django_db
+def test_create_order_query_count_does_not_depend_on_positions(api_auth_client, product_ids_factory):
+    # arrange
+    url = reverse("orders-list")
+    counts = []
+
+    # act
+    for quantity in (5, 50):
+        payload = {"positions": product_ids_factory(_quantity=quantity, price=10)}
+        with CaptureQueriesContext(connection) as captured:
+            resp = api_auth_client.post(url, payload, format='json')
+        assert resp.status_code == HTTP_201_CREATED
+        assert len(resp.json()['positions']) == quantity
+        counts.append(len(captured))
+
+    # assert
+    assert counts[0] == counts[1]
+
+
+@pytest.mark.django_db
+def test_create_order_is_atomic(api_auth_client, product_ids_factory):
+    # arrange
+    payload = {"positions": product_ids_factory(_quantity=3, price=10)}
+
+    # act: ошибка при записи позиций
+    with patch.object(OrderProduct.objects, 'bulk_create', side_effect=DatabaseError):
+        with pytest.raises(DatabaseError):
+            api_auth_client.post(reverse("orders-list"), payload, format='json')
+
+    # assert: заказ без позиций не остался
+    assert not Order.objects.exists()
+
+
+@pytest.mark.django_db
+def test_create_order_stores_price_snapshot(api_auth_client, product_factory):
+    # arrange
+    product, another_product = product_factory(_quantity=2, price=100)
+    payload = {"positions": [{'product_id': product.id, 'quantity': 3}, {'product_id': another_product.id}]}
+
+    # act
+    resp = api_auth_client.post(reverse("orders-list"), payload, format='json')
+    assert resp.status_code == HTTP_201_CREATED
+    order_id = resp.json()['id']
+    product.price = 500
+    product.save()
+
+    # assert: цена позиции не меняется вместе с ценой товара
+    positions = api_auth_client.get(reverse("orders-detail", kwargs={'pk': order_id})).json()['positions']
+    assert [(decimal.Decimal(p['unit_price']), decimal.Decimal(p['line_total'])) for p in positions] == [
+        (100, 300), (100, 100)
+    ]
+    assert list(OrderProduct.objects.order_totals()) == [{'order': order_id, 'total': 400}]
+    assert list(OrderProduct.objects.filter(product=product).product_revenue()) == [
+        {'product': product.id, 'quantity': 3, 'revenue': 300}
+    ]
+
+
+@pytest.mark.django_db
+def test_filter_orders_by_several_products(api_auth_admin, order_factory, product_factory):
+    # arrange
+    first, second, third = product_factory(_quantity=3)
+    both = order_factory(products=[])
+    OrderProduct.objects.bulk_create([
+        OrderProduct(order=both, product=first),
+        OrderProduct(order=both, product=first),
+        OrderProduct(order=both, product=second),
+    ])
+    only_second = order_factory(products=[])
+    OrderProduct.objects.create(order=only_second, product=second)
+    only_third = order_factory(products=[])
+    OrderProduct.objects.create(order=only_third, product=third)
+    url = reverse("orders-list")
+
+    def order_ids(params):
+        resp = api_auth_admin.get(url, params)
+        assert resp.status_code == HTTP_200_OK
+        return sorted(item['id'] for item in resp.json()['results'])
+
+    # assert: заказ с несколькими позициями товара не дублируется
+    assert order_ids({'product': first.id}) == [both.id]
+    # assert: любой из товаров
+    assert order_ids({'product': f'{first.id},{second.id}'}) == sorted([both.id, only_second.id])
+    # assert: все товары
+    assert order_ids({'product': f'{first.id},{second.id}', 'product_match': 'all'}) == [both.id]
+    assert order_ids({'product': f'{second.id},{third.id}', 'product_match': 'all'}) == []
+
+    # assert: некорректные значения
+    assert api_auth_admin.get(url, {'product': 'abc'}).status_code == HTTP_400_BAD_REQUEST
+    assert api_auth_admin.get(url, {'product': first.id, 'product_match': 'some'}).status_code == HTTP_400_BAD_REQUEST
+    too_many = ','.join(str(i) for i in range(1, 102))
+    assert api_auth_admin.get(url, {'product': too_many}).status_code == HTTP_400_BAD_REQUEST
+
+
+@pytest.mark.django_db
+def test_create_order_async(api_auth_client, api_auth_another_client, product_factory, django_assert_num_queries):
+    # arrange
+    product = product_factory(price=100)
+    payload = {"positions": [{'product_id': product.id, 'quantity': 2}, {'product_id': product.id + 100}]}
+    url = reverse("orders-list")
+
+    # act: проверяется только форма данных, товары не запрашиваются
+    with django_assert_num_queries(2):  # токен и запись заявки
+        resp = api_auth_client.post(url, payload, format='json', HTTP_PREFER='respond-async')
+
+    # assert
+    assert resp.status_code == HTTP_202_ACCEPTED
+    assert resp['Preference-Applied'] == 'respond-async'
+    ticket = resp.json()
+    assert ticket['status'] == 'PENDING'
+    assert resp['Location'] == ticket['url']
+    assert not Order.objects.exists()
+
+    # act: ошибка формы данных возвращается сразу
+    resp = api_auth_client.post(url, {"positions": [{'quantity': 0}]}, format='json', HTTP_PREFER='respond-async')
+
+    # assert
+    assert resp.status_code == HTTP_400_BAD_REQUEST
+    assert set(resp.json()['positions'][0]) == {'product_id', 'quantity'}
+
+    # act: воркер обрабатывает заявку
+    assert process_order_tickets() == 1
+
+    # assert: несуществующий товар - заявка с ошибкой
+    resp = api_auth_client.get(ticket['url'])
+    assert resp.json()['status'] == 'FAILED'
+    assert resp.json()['errors']['positions'][1]['product_id']
+    assert not Order.objects.exists()
+
+    # act: корректная заявка
+    payload = {"positions": [{'product_id': product.id, 'quantity': 2}]}
+    ticket = api_auth_client.post(url, payload, format='json', HTTP_PREFER='respond-async').json()
+    process_order_tickets()
+
+    # assert
+    resp = api_auth_client.get(ticket['url'])
+    assert resp.json()['status'] == 'DONE'
+    order = Order.objects.get(pk=resp.json()['order'])
+    assert order.amount == 200
+    assert list(order.positions.values_list('product', 'quantity', 'line_total')) == [(product.id, 2, 200)]
+
+    # assert: чужую заявку не видно
+    assert api_auth_another_client.get(ticket['url']).status_code == HTTP_404_NOT_FOUND
+    # assert: очередь пуста
+    assert process_order_tickets() == 0
+
+
+@pytest.mark.django_db
+def test_create_order_async_by_settings(api_auth_client, product_factory, settings):
+    # arrange
+    settings.ORDER_INTAKE_ASYNC = True
+    payload = {"positions": [{'product_id': product_factory().id}]}
+
+    # act
+    resp = api_auth_client.post(reverse("orders-list"), payload, format='json')
+
+    # assert
+    assert resp.status_code == HTTP_202_ACCEPTED
+    assert OrderTicket.objects.get().payload == {'positions': [{'product_id': payload['positions'][0]['product_id'],
+                                                                'quantity': 1}]}
+
+
+@pytest.mark.django_db
+def test_process_order_tickets_isolates_failures(user_factory, product_factory):
+    # arrange: вторая заявка падает с непредвиденной ошибкой
+    user, product = user_factory(), product_factory(price=10)
+    OrderTicket.objects.bulk_create([
+        OrderTicket(creator=user, payload={'positions': [{'product_id': product.id, 'quantity': i}]})
+        for i in range(1, 4)
+    ])
+    create = OrderSerializer.create
+
+    def failing_create(serializer, validated_data):
+        if validated_data['positions'][0]['quantity'] == 2:
+            raise RuntimeError('boom')
+        return create(serializer, validated_data)
+
+    # act
+    with patch.object(OrderSerializer, 'create', failing_create):
+        processed = process_order_tickets()
+
+    # assert: остальные заявки обработаны, упавшая не возвращается в очередь
+    assert processed == 3
+    statuses = [(ticket.status, ticket.errors) for ticket in OrderTicket.objects.order_by('id')]
+    assert statuses == [
+        ('DONE', None), ('FAILED', {'non_field_errors': ['Internal error.']}), ('DONE', None)
+    ]
+    assert sorted(Order.objects.values_list('amount', flat=True)) == [10, 30]
+    assert process_order_tickets() == 0
+
+
+@pytest.mark.django_db
+def test_process_order_tickets_reclaims_abandoned(user_factory, product_factory):
+    # arrange: заявки, забранные воркером, который не закончил обработку
+    user, product = user_factory(), product_factory(price=10)
+    abandoned, processing = OrderTicket.objects.bulk_create([
+        OrderTicket(creator=user, payload={'positions': [{'product_id': product.id}]},
+                    status=OrderTicket.TicketStatus.PROCESSING)
+        for _ in range(2)
+    ])
+    OrderTicket.objects.filter(pk=abandoned.pk).update(updated_at=timezone.now() - timedelta(hours=1))
+
+    # act
+    processed = process_order_tickets()
+
+    # assert
+    assert processed == 1
+    abandoned.refresh_from_db()
+    processing.refresh_from_db()
+    assert (abandoned.status, processing.status) == ('DONE', 'PROCESSING')
+
+
+@pytest.mark.django_db
+def test_create_order_with_idempotency_key(api_auth_client, api_auth_another_client, product_ids_factory):
+    # arrange
+    payload = {"positions": product_ids_factory(_quantity=2, price=10)}
+    url = reverse("orders-list")
+
+    # act
+    first = api_auth_client.post(url, payload, format='json', HTTP_IDEMPOTENCY_KEY='key-1')
+    repeat = api_auth_client.post(url, payload, format='json', HTTP_IDEMPOTENCY_KEY='key-1')
+
+    # assert: повтор получает тот же ответ, заказ создан один раз
+    assert first.status_code == repeat.status_code == HTTP_201_CREATED
+    assert repeat['Idempotent-Replayed'] == 'true'
+    assert repeat.json() == first.json()
+    assert Order.objects.count() == 1
+
+    # act: тот же ключ с другими данными
+    resp = api_auth_client.post(url, {"positions": product_ids_factory()}, format='json', HTTP_IDEMPOTENCY_KEY='key-1')
+
+    # assert
+    assert resp.status_code == HTTP_422_UNPROCESSABLE_ENTITY
+
+    # act: тот же ключ у другого пользователя и запрос без ключа
+    assert api_auth_another_client.post(url, payload, format='json', HTTP_IDEMPOTENCY_KEY='key-1').status_code == \
+        HTTP_201_CREATED
+    assert api_auth_client.post(url, payload, format='json').status_code == HTTP_201_CREATED
+
+    # assert
+    assert Order.objects.count() == 3
+
+
+@pytest.mark.django_db
+def test_idempotency_key_expires(api_auth_client, product_ids_factory, settings):
+    # arrange
+    payload = {"positions": product_ids_factory(price=10)}
+    url = reverse("orders-list")
+    api_auth_client.post(url, payload, format='json', HTTP_IDEMPOTENCY_KEY='key-1')
+    IdempotencyKey.objects.update(created_at=timezone.now() - timedelta(seconds=settings.IDEMPOTENCY_KEY_TTL + 1))
+
+    # act
+    resp = api_auth_client.post(url, payload, format='json', HTTP_IDEMPOTENCY_KEY='key-1')
+
+    # assert: ключ устарел, заказ создан заново
+    assert resp.status_code == HTTP_201_CREATED
+    assert 'Idempotent-Replayed' not in resp
+    assert Order.objects.count() == 2
+    assert IdempotencyKey.objects.get().response['id'] == resp.json()['id']
+
+
+@pytest.mark.django_db
+def test_failed_request_does_not_store_idempotency_key(api_auth_client, product_ids_factory):
+    # arrange
+    url = reverse("orders-list")
+
+    # act: ошибка валидации не сохраняется, повтор с исправленными данными выполняется
+    resp = api_auth_client.post(url, {"positions": []}, format='json', HTTP_IDEMPOTENCY_KEY='key-1')
+    assert resp.status_code == HTTP_400_BAD_REQUEST
+    resp = api_auth_client.post(url, {"positions": product_ids_factory(price=10)}, format='json',
+                                HTTP_IDEMPOTENCY_KEY='key-1')
+
+    # assert
+    assert resp.status_code == HTTP_201_CREATED
+
+
+@pytest.mark.django_db(transaction=True)
+def test_concurrent_requests_with_same_idempotency_key(user_factory, product_ids_factory):
+    # arrange
+    user = user_factory()
+    payload = {"positions": product_ids_factory(price=10)}
+    barrier = threading.Barrier(4)
+
+    def post():
+        client = APIClient()
+        client.force_authenticate(user)
+        barrier.wait()
+        try:
+            return client.post(reverse("orders-list"), payload, format='json', HTTP_IDEMPOTENCY_KEY='key-1')
+        finally:
+            connection.close()
+
+    # act
+    with ThreadPoolExecutor(max_workers=4) as pool:
+        responses = list(pool.map(lambda _: post(), range(4)))
+
+    # assert: запись выполнена один раз, остальные получили сохранённый ответ
+    assert {resp.status_code for resp in responses} == {HTTP_201_CREATED}
+    assert len({resp.json()['id'] for resp in responses}) == 1
+    assert Order.objects.count() == 1
+
+
+@pytest.mark.django_db
+def test_list_orders_sparse_fields(api_auth_admin, order_factory):
+    # arrange
+    orders = order_factory(_quantity=3)
+    url = reverse("orders-list")
+
+    # act
+    with CaptureQueriesContext(connection) as captured:
+        resp = api_auth_admin.get(url, {'fields': 'id,positions.quantity,positions.product'})
+
+    # assert: товары позиций не читаются, вместо них id
+    assert resp.status_code == HTTP_200_OK
+    for order, item in zip(orders, resp.json()['results']):
+        assert item['id'] == order.id
+        positions = [{'product': p.product_id, 'quantity': p.quantity} for p in order.positions.order_by('product')]
+        assert sorted(item['positions'], key=lambda p: p['product']) == positions
+    assert not [query for query in captured if 'marketplace_product' in query['sql']]
+    assert not [query for query in captured if '"unit_price"' in query['sql']]
+
+
+@pytest.mark.django_db
+def test_retrieve_order_expand_position_product(api_auth_admin, order_factory):
+    # arrange
+    order = order_factory()
+    position = order.positions.first()
+    url = reverse("orders-detail", kwargs={'pk': order.id})
+
+    # act
+    resp = api_auth_admin.get(url, {'fields': 'positions.product', 'expand': 'positions.product'})
+
+    # assert
+    assert resp.status_code == HTTP_200_OK
+    assert resp.json()['positions'][0]['product']['title'] == position.product.title
+
+
+@pytest.mark.django_db
+def test_list_orders_includes_archive_with_date_filter(api_auth_admin, order_factory):
+    # arrange
+    archived, recent = order_factory(status='DONE'), order_factory()
+    products = sorted(archived.positions.values_list('product_id', flat=True))
+    Order.objects.filter(pk=archived.pk).update(created_at=timezone.now() - timedelta(days=100))
+    call_command('archive_orders', days=30, stdout=io.StringIO())
+    url = reverse("orders-list")
+    since = (timezone.now() - timedelta(days=365)).isoformat()
+
+    # act
+    live = api_auth_admin.get(url)
+    history = api_auth_admin.get(url, {'created_at_after': since})
+    detail = api_auth_admin.get(reverse("orders-detail", kwargs={'pk': archived.id}), {'created_at_after': since})
+
+    # assert
+    assert [item['id'] for item in live.json()['results']] == [recent.id]
+    assert [item['id'] for item in history.json()['results']] == [archived.id, recent.id]
+    assert detail.status_code == HTTP_200_OK
+    assert sorted(item['product']['id'] for item in detail.json()['positions']) == products
+    assert api_auth_admin.get(reverse("orders-detail", kwargs={'pk': archived.id})).status_code == HTTP_404_NOT_FOUND
+
+
+@pytest.mark.django_db
+def test_archived_order_positions_url(api_client, api_auth_another_client, order_factory):
+    # arrange
+    archived = order_factory(status='DONE')
+    products = sorted(archived.positions.values_list('product_id', flat=True))
+    Order.objects.filter(pk=archived.pk).update(created_at=timezone.now() - timedelta(days=100))
+    call_command('archive_orders', days=30, stdout=io.StringIO())
+    api_client.force_authenticate(archived.creator)
+    since = (timezone.now() - timedelta(days=365)).isoformat()
+    positions_url = api_client.get(reverse("orders-list"), {'created_at_after': since}).json()['results'][0][
+        'positions_url'
+    ]
+
+    # act
+    resp = api_client.get(positions_url)
+
+    # assert
+    assert resp.status_code == HTTP_200_OK
+    assert sorted(item['product']['id'] for item in resp.json()['results']) == products
+    assert api_auth_another_client.get(positions_url).status_code == HTTP_404_NOT_FOUND
+
+
+@pytest.mark.django_db
+def test_create_order_reserves_stock(api_auth_client, product_factory):
+    # arrange
+    tracked, untracked = product_factory(price=10, stock=5), product_factory(price=10, stock=None)
+    payload = {"positions": [{'product_id': tracked.id, 'quantity': 2}, {'product_id': untracked.id, 'quantity': 7},
+                             {'product_id': tracked.id, 'quantity': 1}]}
+
+    # act
+    resp = api_auth_client.post(reverse("orders-list"), payload, format='json')
+
+    # assert
+    assert resp.status_code == HTTP_201_CREATED
+    tracked.refresh_from_db()
+    untracked.refresh_from_db()
+    assert (tracked.stock, untracked.stock) == (2, None)
+
+
+@pytest.mark.django_db
+def test_create_order_refreshes_cached_product_stock(api_client, api_auth_client, product_factory):
+    # arrange
+    product = product_factory(price=10, stock=100)
+    url = reverse("products-detail", kwargs={'pk': product.id})
+    before = api_client.get(url)
+    product_version = get_versions('product')
+
+    # act
+    api_auth_client.post(reverse("orders-list"), {"positions": [{'product_id': product.id, 'quantity': 5}]},
+                         format='json')
+    conditional = api_client.get(url, HTTP_IF_NONE_MATCH=before['ETag'])
+    fresh = api_client.get(url)
+
+    # assert
+    assert before.json()['stock'] == 100
+    assert conditional.status_code == HTTP_200_OK
+    assert conditional['ETag'] != before['ETag']
+    assert fresh.json()['stock'] == 95
+
+    # assert: заказ не сбрасывает кеш каталога и автодополнения
+    assert get_versions('product') == product_version
+
+
+@pytest.mark.django_db
+def test_create_order_not_enough_stock(api_auth_client, product_factory):
+    # arrange
+    products = [product_factory(price=10, stock=10), product_factory(price=10, stock=1)]
+    payload = {"positions": [{'product_id': products[0].id, 'quantity': 2}, {'product_id': products[1].id, 'quantity': 2}]}
+
+    # act
+    resp = api_auth_client.post(reverse("orders-list"), payload, format='json')
+
+    # assert
+    assert resp.status_code == HTTP_400_BAD_REQUEST
+    assert resp.json() == {'positions': [{}, {'quantity': ['Not enough stock: 1 left.']}]}
+    assert not Order.objects.exists()
+
+
+@pytest.mark.django_db
+def test_reservation_rolls_back_order_when_stock_changed(user_factory, product_factory):
+    # arrange: остаток уменьшился после проверки данных заказа
+    products = [product_factory(price=10, stock=10), product_factory(price=10, stock=5)]
+    request = APIRequestFactory().post(reverse("orders-list"))
+    request.user = user_factory()
+    data = {"positions": [{'product_id': products[0].id, 'quantity': 3}, {'product_id': products[1].id, 'quantity': 3}]}
+    serializer = OrderSerializer(data=data, context={'request': request})
+    assert serializer.is_valid(), serializer.errors
+    Product.objects.filter(pk=products[1].pk).update(stock=2)
+
+    # act
+    with pytest.raises(ValidationError) as exc_info:
+        serializer.save()
+
+    # assert
+    assert exc_info.value.detail == {'positions': [{}, {'quantity': ['Not enough stock: 2 left.']}]}
+    assert not Order.objects.exists()
+    assert list(Product.objects.order_by('pk').values_list('stock', flat=True)) == [10, 2]
+
+
+@pytest.mark.django_db(transaction=True)
+def test_concurrent_checkouts_do_not_oversell(user_factory, product_factory):
+    # arrange: встречные корзины с общими товарами в разном порядке
+    hot, other = product_factory(price=10, stock=5), product_factory(price=10, stock=100)
+    users = user_factory(_quantity=10)
+    barrier = threading.Barrier(len(users))
+
+    def post(i):
+        client = APIClient()
+        client.force_authenticate(users[i])
+        products = [hot, other] if i % 2 else [other, hot]
+        barrier.wait()
+        try:
+            return client.post(reverse("orders-list"), {
+                "positions": [{'product_id': product.id, 'quantity': 1} for product in products]
+            }, format='json')
+        finally:
+            connection.close()
+
+    # act
+    with ThreadPoolExecutor(max_workers=len(users)) as pool:
+        responses = list(pool.map(post, range(len(users))))
+
+    # assert
+    statuses = [resp.status_code for resp in responses]
+    assert statuses.count(HTTP_201_CREATED) == 5
+    assert statuses.count(HTTP_400_BAD_REQUEST) == 5
+    hot.refresh_from_db()
+    other.refresh_from_db()
+    assert (hot.stock, other.stock) == (0, 95)
+    assert Order.objects.count() == 5
+
+
+@pytest.mark.django_db
+def test_retrieve_order_caps_positions(api_client, api_auth_another_client, settings):
+    # arrange
+    settings.NESTED_LIST_LIMIT = 3
+    order = baker.make('order')
+    positions = baker.make('OrderProduct', order=order, quantity=1, _quantity=5)
+    api_client.force_authenticate(order.creator)
+
+    # act
+    resp = api_client.get(reverse("orders-detail", kwargs={'pk': order.id}))
+
+    # assert
+    assert resp.status_code == HTTP_200_OK
+    resp_json = resp.json()
+    assert [item['product']['id'] for item in resp_json['positions']] == [p.product_id for p in positions[:3]]
+    assert resp_json['positions_count'] == 5
+    assert resp_json['positions_url'].endswith(reverse("orders-positions", kwargs={'pk': order.id}))
+
+    # act: полный список позиций постранично
+    ids, url, params = [], resp_json['positions_url'], {'page_size': 2}
+    while url:
+        page = api_client.get(url, params).json()
+        ids.extend(item['product']['id'] for item in page['results'])
+        url, params = page['next'], None
+
+    # assert
+    assert ids == [p.product_id for p in positions]
+    resp = api_auth_another_client.get(reverse("orders-positions", kwargs={'pk': order.id}))
+    assert resp.status_code == HTTP_404_NOT_FOUND
+
+
+@pytest.mark.django_db
+def test_list_orders_limits_positions_prefetch(api_auth_admin, settings):
+    # arrange
+    settings.NESTED_LIST_LIMIT = 2
+    orders = baker.make('order', _quantity=3)
+    for i, order in enumerate(orders):
+        baker.make('OrderProduct', order=order, quantity=1, _quantity=i + 1)
+
+    # act
+    with CaptureQueriesContext(connection) as captured:
+        resp = api_auth_admin.get(reverse("orders-list"))
+
+    # assert: позиции выбираются одним запросом с row_number(), количество считается только у обрезанного списка
+    assert resp.status_code == HTTP_200_OK
+    counts = [(len(item['positions']), item['positions_count']) for item in resp.json()['results']]
+    assert counts == [(1, 1), (2, 2), (2, 3)]
+    positions_queries = [query['sql'] for query in captured if query['sql'].startswith(
+        'SELECT "marketplace_orderproduct"."id"'
+    )]
+    assert len(positions_queries) == 1
+    assert 'ROW_NUMBER() OVER' in positions_queries[0]
+    assert sum('COUNT(*)' in query['sql'] and 'marketplace_orderproduct' in query['sql'] for query in captured) == 1
+
+
+@pytest.mark.django_db
+def test_list_orders_positions_count_in_one_query(api_auth_admin):
+    # arrange
+    orders = baker.make('order', _quantity=5)
+    for i, order in enumerate(orders):
+        baker.make('OrderProduct', order=order, quantity=1, _quantity=i + 1)
+
+    # act: без списка позиций prefetch не выполняется
+    with CaptureQueriesContext(connection) as captured:
+        resp = api_auth_admin.get(reverse("orders-list"), {'fields': 'id,positions_count'})
+
+    # assert
+    assert resp.status_code == HTTP_200_OK
+    assert [item['positions_count'] for item in resp.json()['results']] == [1, 2, 3, 4, 5]
+    count_queries = [query['sql'] for query in captured if 'marketplace_orderproduct' in query['sql']]
+    assert len(count_queries) == 1
+    assert 'GROUP BY' in count_queries[0]
+
+
+@pytest.mark.django_db
+def test_export_orders_keeps_all_positions(api_auth_admin, settings):
+    # arrange
+    settings.NESTED_LIST_LIMIT = 2
+    order = baker.make('order')
+    baker.make('OrderProduct', order=order, quantity=1, _quantity=4)
+
+    # act
+    resp = api_auth_admin.get(reverse("orders-export"), {'format': 'ndjson'})
+
+    # assert
+    rows = [json.loads(line) for line in b''.join(resp.streaming_content).decode().splitlines()]
+    assert [(len(row['positions']), row['positions_count']) for row in rows] == [(4, 4)]
+
+
+@pytest.mark.django_db
+def test_retrieve_order_with_non_numeric_pk(api_auth_client):
+    resp = api_auth_client.get(reverse("orders-detail", kwargs={'pk': 'abc'}))
+    assert resp.status_code == HTTP_404_NOT_FOUND
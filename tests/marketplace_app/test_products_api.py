@@ -1,10 +1,23 @@
+import csv
 import decimal
+import io
+import json
 import random
+from base64 import urlsafe_b64encode
 
 import pytest
+from django.core.cache import cache
+from django.db import connection
+from django.test.utils import CaptureQueriesContext
+from rest_framework.request import Request
 from rest_framework.reverse import reverse
 from rest_framework.status import HTTP_200_OK, HTTP_201_CREATED, HTTP_400_BAD_REQUEST, HTTP_401_UNAUTHORIZED, \
-    HTTP_403_FORBIDDEN, HTTP_204_NO_CONTENT
+    HTTP_403_FORBIDDEN, HTTP_204_NO_CONTENT, HTTP_404_NOT_FOUND, HTTP_304_NOT_MODIFIED
+from rest_framework.test import APIRequestFactory
+
+from marketplace.cache import bump_version
+from marketplace.models import Product
+from marketplace.views import ProductViewSet
 
 
 @pytest.mark.django_db
@@ -18,7 +31,7 @@ def test_retrieve_product(api_client, product_factory):
     # assert
     assert resp.status_code == HTTP_200_OK
     resp_json = resp.json()
-    assert len(resp_json) == 6  # fields count
+    assert len(resp_json) == 11  # fields count
     assert resp_json['id'] == product.id
     assert resp_json['title'] == product.title
     assert resp_json['description'] == product.description
@@ -38,7 +51,7 @@ def test_list_products(api_client, product_factory):
 
     # assert
     assert resp.status_code == HTTP_200_OK
-    resp_json = resp.json()
+    resp_json = resp.json()['results']
     assert len(resp_json) == len(products)
     for i, item in enumerate(resp_json):
         assert item['id'] == products[i].id
@@ -59,7 +72,7 @@ def test_filter_price_products(api_client, product_factory):
 
     # assert
     assert resp.status_code == HTTP_200_OK
-    resp_json = resp.json()
+    resp_json = resp.json()['results']
     for item in resp_json:
         assert decimal.Decimal(item['price']) >= test_price
 
@@ -68,11 +81,26 @@ def test_filter_price_products(api_client, product_factory):
 
     # assert
     assert resp.status_code == HTTP_200_OK
-    resp_json = resp.json()
+    resp_json = resp.json()['results']
     for item in resp_json:
         assert decimal.Decimal(item['price']) <= test_price
 
 
+@pytest.mark.django_db
+def test_list_products_count(api_client, product_factory):
+    # arrange
+    product_factory(price=10, _quantity=3)
+    product_factory(price=1000, _quantity=2)
+
+    # act
+    resp = api_client.get(reverse("products-list"), {'price__gte': 100})
+
+    # assert
+    assert resp.status_code == HTTP_200_OK
+    resp_json = resp.json()
+    assert (resp_json['count'], resp_json['count_estimated']) == (2, False)
+
+
 @pytest.mark.django_db
 def test_filter_search_products(api_client, product_factory):
     # arrange
@@ -86,7 +114,7 @@ def test_filter_search_products(api_client, product_factory):
 
     # assert
     assert resp.status_code == HTTP_200_OK
-    resp_json = resp.json()
+    resp_json = resp.json()['results']
     assert len(resp_json) == 1
     test_product = resp_json[0]
     assert test_product['id'] == product.id
@@ -97,7 +125,7 @@ def test_filter_search_products(api_client, product_factory):
 
     # assert
     assert resp.status_code == HTTP_200_OK
-    resp_json = resp.json()
+    resp_json = resp.json()['results']
     assert len(resp_json) == 1
     test_product = resp_json[0]
     assert test_product['id'] == product.id
@@ -142,7 +170,7 @@ def test_create_product_for_admin_client(api_auth_admin, product_factory):
     resp = api_auth_admin.post(url, payload, format='json')
     assert resp.status_code == HTTP_201_CREATED
     resp_json = resp.json()
-    assert len(resp_json) == 6  # fields count
+    assert len(resp_json) == 11  # fields count
     assert resp_json['title'] == payload['title']
     assert decimal.Decimal(resp_json['price']) == decimal.Decimal(payload['price'])
 
@@ -188,7 +216,7 @@ def test_update_product_for_admin_client(api_auth_admin, product_factory):
     resp = api_auth_admin.patch(url, payload, format='json')
     assert resp.status_code == HTTP_200_OK
     resp_json = resp.json()
-    assert len(resp_json) == 6  # fields count
+    assert len(resp_json) == 11  # fields count
     assert resp_json['id'] == product.id
     assert resp_json['title'] == payload['title']
     assert resp_json['description'] == payload['description']
@@ -248,3 +276,431 @@ def test_delete_product_for_admin_client(api_auth_admin, product_factory):
     url = reverse("products-detail", kwargs={'pk': product.id})
     resp = api_auth_admin.delete(url)
     assert resp.status_code == HTTP_204_NO_CONTENT
+
+
+@pytest.mark.django_db
+def test_paginate_products(api_client, product_factory):
+    # arrange
+    products = product_factory(_quantity=7)
+    url = reverse("products-list")
+
+    # act: идём по страницам вперёд
+    ids = []
+    resp = api_client.get(url, {'page_size': 3})
+    pages = [resp.json()]
+    while pages[-1]['next']:
+        resp = api_client.get(pages[-1]['next'])
+        assert resp.status_code == HTTP_200_OK
+        pages.append(resp.json())
+    for page in pages:
+        ids.extend(item['id'] for item in page['results'])
+
+    # assert
+    assert len(pages) == 3
+    assert pages[0]['previous'] is None
+    assert ids == [obj.id for obj in products]
+
+    # act: возвращаемся на страницу назад
+    resp = api_client.get(pages[-1]['previous'])
+
+    # assert
+    assert resp.status_code == HTTP_200_OK
+    assert [item['id'] for item in resp.json()['results']] == [item['id'] for item in pages[1]['results']]
+
+
+@pytest.mark.django_db
+def test_paginate_products_with_invalid_cursor(api_client):
+    url = reverse("products-list")
+    resp = api_client.get(url, {'cursor': 'invalid'})
+    assert resp.status_code == HTTP_404_NOT_FOUND
+
+
+@pytest.mark.django_db
+def test_paginate_products_with_foreign_cursor(api_client, product_factory):
+    # arrange
+    product_factory(_quantity=3)
+    url = reverse("products-list")
+    next_url = api_client.get(url, {'page_size': 1}).json()['next']
+    tampered = urlsafe_b64encode(json.dumps({'o': ['created_at', 'id'], 'p': ['x', 'y']}).encode()).decode()
+
+    # act
+    valid = api_client.get(next_url)
+    reordered = api_client.get(next_url + '&ordering=-rating')
+    invalid = api_client.get(url, {'cursor': tampered})
+
+    # assert: курсор другой сортировки и подмененные значения позиции
+    assert valid.status_code == HTTP_200_OK
+    assert reordered.status_code == HTTP_404_NOT_FOUND
+    assert invalid.status_code == HTTP_404_NOT_FOUND
+    assert invalid.json() == {'detail': 'Invalid cursor'}
+
+
+@pytest.mark.django_db
+def test_search_products_ranks_title_above_description(api_client, product_factory):
+    # arrange
+    in_description = product_factory(title='Чехол', description='Подходит для смартфона')
+    in_title = product_factory(title='Смартфон', description='Новый')
+    product_factory(title='Наушники', description='Беспроводные')
+    url = reverse("products-list")
+
+    # act: поиск по другой словоформе
+    resp = api_client.get(url, {'search': 'смартфоны'})
+
+    # assert
+    assert resp.status_code == HTTP_200_OK
+    resp_json = resp.json()['results']
+    assert [item['id'] for item in resp_json] == [in_title.id, in_description.id]
+
+
+@pytest.mark.django_db
+def test_search_products_with_english_stemming(api_client, product_factory):
+    # arrange
+    product = product_factory(title='Running shoes')
+    product_factory(title='Socks')
+    url = reverse("products-list")
+
+    # act
+    resp = api_client.get(url, {'search': 'run shoe'})
+
+    # assert
+    assert resp.status_code == HTTP_200_OK
+    resp_json = resp.json()['results']
+    assert [item['id'] for item in resp_json] == [product.id]
+
+
+@pytest.mark.django_db
+def test_paginate_search_products(api_client, product_factory):
+    # arrange
+    products = product_factory(_quantity=3, title='Кружка', description='Керамическая кружка')
+    products += product_factory(_quantity=3, title='Кружка', description='')
+    product_factory(_quantity=3, title='Тарелка')
+    url = reverse("products-list")
+
+    # act
+    ids = []
+    next_url, params = url, {'search': 'кружка', 'page_size': 2}
+    while next_url:
+        resp = api_client.get(next_url, params)
+        assert resp.status_code == HTTP_200_OK
+        resp_json = resp.json()
+        ids.extend(item['id'] for item in resp_json['results'])
+        next_url, params = resp_json['next'], None
+
+    # assert: сначала товары с совпадением и в описании, внутри одного ранга — по убыванию id
+    assert ids == [obj.id for obj in reversed(products[:3])] + [obj.id for obj in reversed(products[3:])]
+
+
+@pytest.mark.django_db
+def test_suggest_products(api_client, product_factory):
+    # arrange
+    phone = product_factory(title='Смартфон Galaxy')
+    case = product_factory(title='Чехол для смартфона')
+    product_factory(title='Наушники')
+    url = reverse("products-suggest")
+
+    # act: префикс с опечаткой
+    resp = api_client.get(url, {'q': 'смартфан'})
+
+    # assert
+    assert resp.status_code == HTTP_200_OK
+    resp_json = resp.json()
+    assert {item['id'] for item in resp_json} == {phone.id, case.id}
+    assert resp_json[0] == {'id': phone.id, 'title': phone.title}
+
+    # act: ограничение количества подсказок
+    resp = api_client.get(url, {'q': 'смарт', 'limit': 1})
+
+    # assert
+    assert resp.status_code == HTTP_200_OK
+    assert [item['id'] for item in resp.json()] == [phone.id]
+
+
+@pytest.mark.django_db
+def test_suggest_products_cache_invalidation(api_client, api_auth_admin, product_factory):
+    # arrange
+    product = product_factory(title='Ноутбук')
+    url = reverse("products-suggest")
+    resp = api_client.get(url, {'q': 'ноут'})
+    assert [item['title'] for item in resp.json()] == ['Ноутбук']
+
+    # act
+    resp = api_auth_admin.patch(reverse("products-detail", kwargs={'pk': product.id}), {'title': 'Ноутбук Pro'})
+    assert resp.status_code == HTTP_200_OK
+    resp = api_client.get(url, {'q': 'ноут'})
+
+    # assert
+    assert [item['title'] for item in resp.json()] == ['Ноутбук Pro']
+
+
+@pytest.mark.django_db
+def test_suggest_products_shared_cache(api_client, product_factory, django_assert_num_queries):
+    # arrange
+    product = product_factory(title='Палатка')
+    url = reverse("products-suggest")
+    api_client.get(url, {'q': 'палат'})
+
+    # act: повторный запрос из общего кеша
+    with django_assert_num_queries(0):
+        resp = api_client.get(url, {'q': 'палат'})
+
+    # assert
+    assert [item['title'] for item in resp.json()] == ['Палатка']
+
+    # act: товар изменён без сигналов (например в другом процессе), сброшена только версия данных в общем кеше
+    Product.objects.filter(pk=product.pk).update(title='Палатка туристическая')
+    bump_version('product')
+    resp = api_client.get(url, {'q': 'палат'})
+
+    # assert
+    assert [item['title'] for item in resp.json()] == ['Палатка туристическая']
+
+
+@pytest.mark.django_db
+def test_suggest_products_with_empty_query(api_client, product_factory):
+    product_factory()
+    resp = api_client.get(reverse("products-suggest"), {'q': '  '})
+    assert resp.status_code == HTTP_200_OK
+    assert resp.json() == []
+
+
+@pytest.mark.django_db
+def test_filter_and_order_products_by_rating(api_client, product_factory):
+    # arrange
+    high = product_factory(review_count=2, mark_sum=9)
+    low = product_factory(review_count=1, mark_sum=2)
+    without_reviews = product_factory()
+    url = reverse("products-list")
+
+    # act
+    resp = api_client.get(url, {'ordering': '-rating'})
+
+    # assert
+    assert resp.status_code == HTTP_200_OK
+    assert [item['id'] for item in resp.json()['results']] == [high.id, low.id, without_reviews.id]
+
+    # act
+    resp = api_client.get(url, {'rating__gte': 3})
+
+    # assert
+    assert resp.status_code == HTTP_200_OK
+    assert [item['id'] for item in resp.json()['results']] == [high.id]
+
+
+@pytest.mark.django_db
+def test_cached_product_responses(api_client, api_auth_admin, product_factory, django_assert_num_queries):
+    # arrange
+    product = product_factory(title='old')
+    url = reverse("products-detail", kwargs={'pk': product.id})
+    list_url = reverse("products-list")
+    assert api_client.get(url).json()['title'] == 'old'
+    assert api_client.get(list_url).json()['results'][0]['title'] == 'old'
+
+    # act: повторные запросы отдаются из кеша без обращений к БД
+    with django_assert_num_queries(0):
+        assert api_client.get(url).json()['title'] == 'old'
+        assert api_client.get(list_url).json()['results'][0]['title'] == 'old'
+
+    # act: изменение товара увеличивает версию и сбрасывает кеш
+    resp = api_auth_admin.patch(url, {'title': 'new'}, format='json')
+    assert resp.status_code == HTTP_200_OK
+
+    # assert
+    assert api_client.get(url).json()['title'] == 'new'
+    assert api_client.get(list_url).json()['results'][0]['title'] == 'new'
+
+
+@pytest.mark.django_db
+def test_cached_product_response_is_served_stale_while_recomputing(api_client, product_factory,
+                                                                  django_assert_num_queries):
+    # arrange
+    product = product_factory(title='old')
+    url = reverse("products-detail", kwargs={'pk': product.id})
+    assert api_client.get(url).json()['title'] == 'old'
+    Product.objects.filter(pk=product.pk).update(title='new')
+    bump_version('product')
+
+    # act: ответ пересчитывает другой запрос (блокировка занята)
+    view = ProductViewSet(basename='products', action='retrieve')
+    request = APIRequestFactory().get(url)
+    lock_key = view.get_response_cache_key(Request(request), {'pk': str(product.pk)}) + ':lock'
+    cache.add(lock_key, 1)
+
+    # assert: отдаётся последний закешированный ответ
+    with django_assert_num_queries(0):
+        assert api_client.get(url).json()['title'] == 'old'
+
+    # act: блокировка освобождена
+    cache.delete(lock_key)
+
+    # assert
+    assert api_client.get(url).json()['title'] == 'new'
+
+
+@pytest.mark.django_db
+def test_conditional_get_products(api_client, api_auth_admin, product_factory, django_assert_num_queries):
+    # arrange
+    product = product_factory(title='old')
+    url = reverse("products-detail", kwargs={'pk': product.id})
+    resp = api_client.get(url)
+    etag = resp['ETag']
+
+    # act: тот же ETag отдаёт 304 без обращений к БД
+    with django_assert_num_queries(0):
+        resp = api_client.get(url, HTTP_IF_NONE_MATCH=etag)
+
+    # assert
+    assert resp.status_code == HTTP_304_NOT_MODIFIED
+    assert not resp.content
+
+    # act: изменение товара меняет ETag
+    api_auth_admin.patch(url, {'title': 'new'}, format='json')
+    resp = api_client.get(url, HTTP_IF_NONE_MATCH=etag)
+
+    # assert
+    assert resp.status_code == HTTP_200_OK
+    assert resp['ETag'] != etag
+    assert resp['Last-Modified']
+    assert resp.json()['title'] == 'new'
+
+    # assert: ETag списка зависит от параметров запроса
+    list_url = reverse("products-list")
+    assert api_client.get(list_url)['ETag'] != api_client.get(list_url, {'price__gte': 1})['ETag']
+
+
+@pytest.mark.django_db
+def test_bulk_products_for_not_admin_client(api_auth_client):
+    # act
+    resp = api_auth_client.post(reverse("products-bulk"), [{'title': 'test', 'price': 10}], format='json')
+
+    # assert
+    assert resp.status_code == HTTP_403_FORBIDDEN
+    assert not Product.objects.exists()
+
+
+@pytest.mark.django_db
+def test_bulk_create_and_update_products(api_client, api_auth_admin, product_factory):
+    # arrange
+    product = product_factory(title='старый', price=100)
+    etag = api_client.get(reverse("products-detail", kwargs={'pk': product.id}))['ETag']
+    data = [
+        {'title': 'смартфон', 'description': 'новый', 'price': 500},
+        {'id': product.id, 'price': 200},
+        {'title': 'ноутбук', 'price': 900},
+    ]
+
+    # act
+    resp = api_auth_admin.post(reverse("products-bulk"), data, format='json')
+
+    # assert
+    assert resp.status_code == HTTP_200_OK
+    resp_json = resp.json()
+    assert resp_json['updated'] == [product.id]
+    assert len(resp_json['created']) == 2
+    product.refresh_from_db()
+    assert product.title == 'старый'
+    assert product.price == 200
+    created = Product.objects.get(pk=resp_json['created'][0])
+    assert (created.title, created.description, created.price) == ('смартфон', 'новый', 500)
+
+    # assert: поисковые документы и кеш обновлены
+    resp = api_client.get(reverse("products-list"), {'search': 'смартфоны'})
+    assert [item['id'] for item in resp.json()['results']] == [created.id]
+    resp = api_client.get(reverse("products-detail", kwargs={'pk': product.id}), HTTP_IF_NONE_MATCH=etag)
+    assert resp.status_code == HTTP_200_OK
+    assert decimal.Decimal(resp.json()['price']) == 200
+
+
+@pytest.mark.django_db
+def test_bulk_products_from_ndjson(api_auth_admin, product_factory):
+    # arrange
+    product = product_factory(title='старый')
+    body = f'{{"title": "новый", "price": 10}}\n\n{{"id": {product.id}, "title": "обновлённый"}}\n'
+
+    # act
+    resp = api_auth_admin.post(reverse("products-bulk"), body, content_type='application/x-ndjson')
+
+    # assert
+    assert resp.status_code == HTTP_200_OK
+    assert Product.objects.filter(title='новый').exists()
+    product.refresh_from_db()
+    assert product.title == 'обновлённый'
+
+    # act: некорректная строка
+    resp = api_auth_admin.post(reverse("products-bulk"), '{"title": "a"}\n{oops', content_type='application/x-ndjson')
+
+    # assert
+    assert resp.status_code == HTTP_400_BAD_REQUEST
+    assert 'line 2' in resp.json()['detail']
+
+
+@pytest.mark.django_db
+def test_bulk_products_returns_errors_per_row(api_auth_admin, product_factory):
+    # arrange
+    product = product_factory(title='старый')
+    data = [
+        {'title': 'новый', 'price': 10},
+        {'title': 'без цены'},
+        {'id': product.id, 'price': -1},
+        {'id': 0, 'title': 'нет такого'},
+        {'id': product.id, 'title': 'повтор'},
+    ]
+
+    # act
+    resp = api_auth_admin.post(reverse("products-bulk"), data, format='json')
+
+    # assert: ошибки по строкам, ничего не записано
+    assert resp.status_code == HTTP_400_BAD_REQUEST
+    errors = resp.json()
+    assert len(errors) == len(data)
+    assert errors[0] == {}
+    assert list(errors[1]) == ['price']
+    assert list(errors[2]) == ['price']
+    assert list(errors[3]) == ['id']
+    assert list(errors[4]) == ['id']
+    assert Product.objects.count() == 1
+    product.refresh_from_db()
+    assert product.title == 'старый'
+
+    # act: не список
+    resp = api_auth_admin.post(reverse("products-bulk"), {'title': 'новый', 'price': 10}, format='json')
+
+    # assert
+    assert resp.status_code == HTTP_400_BAD_REQUEST
+
+
+@pytest.mark.django_db
+def test_export_products_csv(api_client, product_factory):
+    # arrange
+    product_factory(title='чайник', price=100)
+    expected = product_factory(title='дорогой чайник', price=5000)
+    url = reverse("products-export")
+
+    # act: фильтры list применяются к выгрузке
+    resp = api_client.get(url, {'format': 'csv', 'price__gte': 1000})
+
+    # assert
+    assert resp.status_code == HTTP_200_OK
+    assert resp['Content-Type'] == 'text/csv; charset=utf-8'
+    rows = list(csv.DictReader(io.StringIO(b''.join(resp.streaming_content).decode())))
+    assert [row['id'] for row in rows] == [str(expected.id)]
+    assert rows[0]['title'] == 'дорогой чайник'
+    assert rows[0]['marks.5'] == '0'
+
+
+@pytest.mark.django_db
+def test_list_products_sparse_fields(api_client, product_factory):
+    # arrange
+    product_factory(_quantity=3)
+    url = reverse("products-list")
+
+    # act
+    with CaptureQueriesContext(connection) as captured:
+        resp = api_client.get(url, {'fields': 'id,title,rating', 'ordering': '-rating'})
+
+    # assert
+    assert resp.status_code == HTTP_200_OK
+    results = resp.json()['results']
+    assert len(results) == 3
+    assert all(set(item) == {'id', 'title', 'rating'} for item in results)
+    sql = [query['sql'] for query in captured if 'marketplace_product' in query['sql']][-1]
+    assert '"description"' not in sql
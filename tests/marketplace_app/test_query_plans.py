@@ -0,0 +1,194 @@
+import re
+
+import pytest
+from django.core.management import call_command
+from django.db import connection
+from django.test.utils import CaptureQueriesContext
+from model_bakery import baker
+from rest_framework.reverse import reverse
+from rest_framework.status import HTTP_200_OK
+
+from marketplace.models import OrderProduct, Product
+
+
+# Объём данных, при котором планировщик выбирает индексы по стоимости, а не сортировку пары страниц в памяти.
+SEED_ROWS = 5000
+
+# Товары с ценами 200..40199: фильтры `price >= 50000` и `price <= 100` выбирают единицы строк.
+SEED_PRODUCTS_SQL = """
+    INSERT INTO marketplace_product (created_at, updated_at, title, description, price, review_count, mark_sum,
+                                     mark_1_count, mark_2_count, mark_3_count, mark_4_count, mark_5_count)
+    SELECT now() - make_interval(mins => i), now() - make_interval(mins => i), 'Товар ' || i, 'Описание ' || i,
+           200 + i * 7 %% 40000, 0, 0, 0, 0, 0, 0, 0
+    FROM generate_series(1, %(rows)s) AS i
+"""
+
+# По отзыву на каждый товар от одного из пользователей (creator, product уникальны).
+SEED_REVIEWS_SQL = """
+    INSERT INTO marketplace_review (created_at, updated_at, creator_id, product_id, text, mark)
+    SELECT now() - make_interval(mins => p.id::int %% 10000), now() - make_interval(mins => p.id::int %% 10000),
+           (%(users)s::bigint[])[1 + p.id %% cardinality(%(users)s::bigint[])], p.id, '', 1 + p.id %% 5
+    FROM marketplace_product AS p
+    WHERE NOT EXISTS (SELECT 1 FROM marketplace_review AS r WHERE r.product_id = p.id)
+"""
+
+# Новых заказов мало (2%), большинство выполнено: фильтр `status = 'NEW'` выбирает малую долю строк.
+SEED_ORDERS_SQL = """
+    INSERT INTO marketplace_order (created_at, updated_at, creator_id, amount, status)
+    SELECT now() - make_interval(mins => i), now() - make_interval(mins => i),
+           (%(users)s::bigint[])[1 + i %% cardinality(%(users)s::bigint[])], i %% 1000 + 0.5,
+           CASE WHEN i %% 50 = 0 THEN 'NEW' WHEN i %% 50 = 1 THEN 'IN_PROGRESS' ELSE 'DONE' END
+    FROM generate_series(1, %(rows)s) AS i
+"""
+
+SEED_POSITIONS_SQL = """
+    INSERT INTO marketplace_orderproduct (order_id, product_id, quantity, unit_price, line_total)
+    SELECT o.id, p.id, 1, p.price, p.price
+    FROM marketplace_order AS o
+    JOIN marketplace_product AS p ON p.id = (SELECT min(id) FROM marketplace_product) + o.id %% %(rows)s
+    WHERE NOT EXISTS (SELECT 1 FROM marketplace_orderproduct AS op WHERE op.order_id = o.id)
+"""
+
+
+@pytest.fixture
+def seeded_data(user_factory, product_factory):
+    """ Данные для проверки планов запросов: товары, отзывы, заказы и подборки. """
+    users = user_factory(_quantity=20)
+    products = product_factory(_quantity=30)
+    for i, product in enumerate(products):
+        baker.make('review', product=product, creator=users[i % len(users)])
+    for i in range(30):
+        baker.make('order', creator=users[i % len(users)], status='DONE' if i % 3 else 'NEW', make_m2m=True)
+    baker.make('collection', make_m2m=True, _quantity=5)
+
+    params = {'rows': SEED_ROWS, 'users': [user.pk for user in users]}
+    with connection.cursor() as cursor:
+        for sql in (SEED_PRODUCTS_SQL, SEED_REVIEWS_SQL, SEED_ORDERS_SQL, SEED_POSITIONS_SQL):
+            cursor.execute(sql, params)
+    Product.objects.filter(search_document__isnull=True).update_search_document()
+
+    with connection.cursor() as cursor:
+        for table in ('auth_user', 'marketplace_product', 'marketplace_review', 'marketplace_order',
+                      'marketplace_orderproduct', 'marketplace_collection', 'marketplace_collection_products'):
+            cursor.execute(f'ANALYZE {table}')
+    return users, products
+
+
+def assert_no_seq_scan(captured, indexes=()):
+    """
+    Выполняет EXPLAIN для каждого запроса к таблицам marketplace при запрещённом последовательном
+    сканировании. Если план всё равно содержит Seq Scan, значит подходящего индекса нет.
+    Без Seq Scan планировщик может взять любой индекс (например, полный обход первичного ключа),
+    поэтому каждый индекс из indexes должен встретиться в плане хотя бы одного запроса.
+    Запросы EXPLAIN для оценки количества записей не выполняются и не проверяются.
+    """
+    queries = [
+        query['sql'] for query in captured
+        if 'marketplace_' in query['sql'] and not query['sql'].startswith('EXPLAIN')
+    ]
+    assert queries
+    plans = []
+    with connection.cursor() as cursor:
+        cursor.execute('SET LOCAL enable_seqscan = off')
+        for sql in queries:
+            cursor.execute('EXPLAIN ' + sql)
+            plan = '\n'.join(row[0] for row in cursor.fetchall())
+            assert 'Seq Scan' not in plan, f'{sql}\n{plan}'
+            plans.append(f'{sql}\n{plan}')
+
+    for index in indexes:
+        assert any(re.search(rf'\b{index}\b', plan) for plan in plans), \
+            f'{index} is not used\n\n' + '\n\n'.join(plans)
+
+
+@pytest.mark.parametrize(
+    ["url_name", "params", "indexes"],
+    (
+        ("products-list", {}, ['product_created_at_id_idx']),
+        ("products-list", {'price__gte': 50000}, ['product_price_idx']),
+        ("products-list", {'price__lte': 100}, ['product_price_idx']),
+        ("products-list", {'search': 'товар'}, ['product_search_document_idx']),
+        ("products-list", {'ordering': '-rating'}, ['product_rating_id_idx']),
+        ("products-suggest", {'q': 'товар'}, ['product_title_trgm_idx']),
+        ("product-reviews-list", {}, ['review_created_at_id_idx']),
+        ("product-reviews-list", {'created_at_after': '2000-01-01', 'created_at_before': '2100-01-01'},
+         ['review_created_at_id_idx']),
+        ("product-collections-list", {}, ['collection_created_at_id_idx']),
+    )
+)
+@pytest.mark.django_db
+def test_public_list_query_plans(api_client, seeded_data, url_name, params, indexes):
+    with CaptureQueriesContext(connection) as captured:
+        resp = api_client.get(reverse(url_name), params)
+    assert resp.status_code == HTTP_200_OK
+    assert_no_seq_scan(captured, indexes)
+
+
+@pytest.mark.django_db
+def test_review_filter_query_plans(api_client, seeded_data):
+    users, products = seeded_data
+    for params, index in (
+        ({'product': products[0].id}, 'review_product_created_at_idx'),
+        ({'creator': users[0].id}, 'review_creator_created_at_idx'),
+    ):
+        with CaptureQueriesContext(connection) as captured:
+            resp = api_client.get(reverse("product-reviews-list"), params)
+        assert resp.status_code == HTTP_200_OK
+        assert_no_seq_scan(captured, [index])
+
+
+@pytest.mark.parametrize(
+    ["params", "admin_indexes", "owner_indexes"],
+    (
+        ({}, ['order_created_at_id_idx'], []),
+        ({'status': 'NEW'}, ['order_status_created_at_idx'], ['order_creator_status_idx']),
+        ({'amount': '100.00'}, ['order_amount_id_idx'], []),
+        ({'ordering': '-amount'}, ['order_amount_id_idx'], []),
+        ({'created_at_after': '2000-01-01', 'created_at_before': '2100-01-01'}, ['order_created_at_id_idx'], []),
+        ({'updated_at_after': '2000-01-01', 'updated_at_before': '2100-01-01'}, ['order_updated_at_idx'], []),
+        ({'product': '1,2,3'}, ['orderproduct_product_idx'], []),
+        ({'product': '1,2', 'product_match': 'all'}, ['orderproduct_product_idx'], []),
+        # с фильтром по датам запрос идёт и к архивным заказам
+        ({'created_at_after': '2000-01-01', 'product': '1,2,3', 'ordering': '-amount'}, ['orderproduct_product_idx'], []),
+    )
+)
+@pytest.mark.django_db
+def test_order_list_query_plans(api_auth_admin, api_client, seeded_data, params, admin_indexes, owner_indexes):
+    users, products = seeded_data
+
+    # для админа
+    with CaptureQueriesContext(connection) as captured:
+        resp = api_auth_admin.get(reverse("orders-list"), params)
+    assert resp.status_code == HTTP_200_OK
+    assert_no_seq_scan(captured, admin_indexes)
+
+    # для владельца (IsOwnerOrAdminFilterBackend)
+    api_client.force_authenticate(users[0])
+    with CaptureQueriesContext(connection) as captured:
+        resp = api_client.get(reverse("orders-list"), params)
+    assert resp.status_code == HTTP_200_OK
+    assert_no_seq_scan(captured, owner_indexes)
+
+
+@pytest.mark.django_db
+def test_order_revenue_query_plans(seeded_data):
+    users, products = seeded_data
+    order = OrderProduct.objects.first().order_id
+    with CaptureQueriesContext(connection) as captured:
+        list(OrderProduct.objects.filter(product=products[0]).product_revenue())
+        list(OrderProduct.objects.filter(order=order).order_totals())
+    assert_no_seq_scan(captured)
+
+
+@pytest.mark.parametrize("url_name", ("analytics-sales-list", "analytics-products-list", "analytics-statuses-list"))
+@pytest.mark.django_db
+def test_sales_analytics_query_plans(api_auth_admin, seeded_data, url_name):
+    call_command('refresh_sales_analytics', full=True)
+    with connection.cursor() as cursor:
+        for table in ('marketplace_dailysales', 'marketplace_dailyproductsales', 'marketplace_dailystatussales'):
+            cursor.execute(f'ANALYZE {table}')
+
+    with CaptureQueriesContext(connection) as captured:
+        resp = api_auth_admin.get(reverse(url_name), {'day_after': '2000-01-01', 'day_before': '2100-01-01'})
+    assert resp.status_code == HTTP_200_OK
+    assert_no_seq_scan(captured)
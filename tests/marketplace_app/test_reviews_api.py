@@ -1,7 +1,11 @@
+import json
+
 import pytest
+from django.db import connection
+from django.test.utils import CaptureQueriesContext
 from rest_framework.reverse import reverse
 from rest_framework.status import HTTP_200_OK, HTTP_401_UNAUTHORIZED, HTTP_201_CREATED, HTTP_400_BAD_REQUEST,\
-    HTTP_204_NO_CONTENT, HTTP_403_FORBIDDEN
+    HTTP_204_NO_CONTENT, HTTP_403_FORBIDDEN, HTTP_304_NOT_MODIFIED, HTTP_404_NOT_FOUND
 
 
 @pytest.mark.django_db
@@ -36,7 +40,7 @@ def test_list_reviews(api_client, review_factory):
     resp = api_client.get(url)
     # assert
     assert resp.status_code == HTTP_200_OK
-    resp_json = resp.json()
+    resp_json = resp.json()['results']
     assert resp_json
     assert len(resp_json) == len(objs)
     for i, obj in enumerate(resp_json):
@@ -60,7 +64,7 @@ def test_filter_creator_id_for_reviews(api_client, review_factory):
 
     # assert
     assert resp.status_code == HTTP_200_OK
-    resp_json = resp.json()
+    resp_json = resp.json()['results']
     assert resp_json
     assert len(resp_json) == 1
     assert resp_json[0]['id'] == reviews[0].id
@@ -83,7 +87,7 @@ def test_filter_product_id_for_reviews(api_client, review_factory):
 
     # assert
     assert resp.status_code == HTTP_200_OK
-    resp_json = resp.json()
+    resp_json = resp.json()['results']
     assert resp_json
     assert len(resp_json) == 1
     assert resp_json[0]['id'] == reviews[0].id
@@ -105,7 +109,7 @@ def test_filter_create_at_reviews(api_client, review_factory):
 
     # assert
     assert resp.status_code == HTTP_200_OK
-    resp_json = resp.json()
+    resp_json = resp.json()['results']
     assert resp_json
     assert len(resp_json) == 1
 
@@ -257,6 +261,51 @@ def test_validate_product_with_unique_together_with_creator_on_create_review(api
     print(resp.rendered_content)
 
 
+@pytest.mark.django_db
+def test_create_review_without_pre_check_queries(api_auth_client, product_factory):
+    # arrange
+    product = product_factory()
+    payload = {'mark': 4, 'product_id': product.id}
+
+    # act
+    with CaptureQueriesContext(connection) as captured:
+        resp = api_auth_client.post(reverse("product-reviews-list"), payload, format='json')
+
+    # assert: до INSERT отзыва только обновление агрегатов товара
+    assert resp.status_code == HTTP_201_CREATED
+    queries = [query['sql'] for query in captured if 'marketplace_' in query['sql']]
+    insert = next(i for i, sql in enumerate(queries) if sql.startswith('INSERT INTO "marketplace_review"'))
+    assert [sql.split()[0] for sql in queries[:insert]] == ['UPDATE']
+
+
+@pytest.mark.django_db
+def test_create_duplicate_review_keeps_aggregates(api_auth_client, product_factory):
+    # arrange
+    product = product_factory()
+    payload = {'mark': 4, 'product_id': product.id}
+    url = reverse("product-reviews-list")
+    api_auth_client.post(url, payload, format='json')
+
+    # act
+    resp = api_auth_client.post(url, {**payload, 'mark': 1}, format='json')
+
+    # assert
+    assert resp.status_code == HTTP_400_BAD_REQUEST
+    assert resp.json() == {'non_field_errors': ['The fields creator, product_id must make a unique set.']}
+    product.refresh_from_db()
+    assert (product.review_count, product.mark_sum, product.mark_1_count) == (1, 4, 0)
+
+
+@pytest.mark.django_db
+def test_create_review_for_missing_product_error(api_auth_client):
+    # act
+    resp = api_auth_client.post(reverse("product-reviews-list"), {'mark': 3, 'product_id': 999999}, format='json')
+
+    # assert
+    assert resp.status_code == HTTP_400_BAD_REQUEST
+    assert resp.json() == {'product_id': ['Invalid pk "999999" - object does not exist.']}
+
+
 @pytest.mark.django_db
 def test_update_review_for_unauthorized_client(api_client, product_factory, review_factory):
     # arrange
@@ -360,6 +409,24 @@ def test_update_review_for_owner_client(api_auth_client, product_factory):
     assert resp.status_code == HTTP_200_OK
 
 
+@pytest.mark.django_db
+def test_write_review_returns_fresh_product_rating(api_auth_client, product_factory):
+    # arrange
+    product = product_factory()
+    created = api_auth_client.post(reverse("product-reviews-list"), {'mark': 5, 'product_id': product.id},
+                                   format='json')
+    url = reverse("product-reviews-detail", kwargs={'pk': created.json()['id']})
+
+    # act
+    resp = api_auth_client.patch(url, {'mark': 3}, format='json')
+
+    # assert: вложенный товар учитывает оценку, изменённую в агрегатах в обход ORM
+    assert created.json()['product']['rating'] == 5.0
+    assert resp.status_code == HTTP_200_OK
+    assert resp.json()['product']['rating'] == 3.0
+    assert resp.json()['product']['marks'] == {'1': 0, '2': 0, '3': 1, '4': 0, '5': 0}
+
+
 @pytest.mark.django_db
 def test_validate_same_product_on_update_review(api_auth_client, product_factory):
     # arrange
@@ -447,6 +514,27 @@ def test_validate_new_product_on_update_review(api_auth_client, product_factory)
     assert resp_json['product']['id'] == payload['product_id']
 
 
+@pytest.mark.django_db
+def test_update_review_to_already_reviewed_product(api_auth_client, product_factory):
+    # arrange
+    first, second = product_factory(), product_factory()
+    url = reverse("product-reviews-list")
+    review_id = api_auth_client.post(url, {'mark': 5, 'product_id': first.id}, format='json').json()['id']
+    api_auth_client.post(url, {'mark': 2, 'product_id': second.id}, format='json')
+
+    # act
+    resp = api_auth_client.patch(reverse("product-reviews-detail", kwargs={'pk': review_id}),
+                                 {'product_id': second.id}, format='json')
+
+    # assert
+    assert resp.status_code == HTTP_400_BAD_REQUEST
+    assert resp.json() == {'non_field_errors': ['The fields creator, product_id must make a unique set.']}
+    first.refresh_from_db()
+    second.refresh_from_db()
+    assert (first.review_count, first.mark_sum) == (1, 5)
+    assert (second.review_count, second.mark_sum) == (1, 2)
+
+
 @pytest.mark.parametrize(
     ["mark", "expected_status"],
     (
@@ -546,3 +634,179 @@ def test_delete_review_for_admin(api_auth_admin, review_factory):
     resp = api_auth_admin.delete(url)
     assert resp.status_code == HTTP_204_NO_CONTENT
 
+
+
+@pytest.mark.django_db
+def test_product_rating_aggregates_on_review_changes(api_auth_client, api_auth_another_client, product_factory):
+    # arrange
+    product, another_product = product_factory(_quantity=2)
+    url = reverse("product-reviews-list")
+    product_url = reverse("products-detail", kwargs={'pk': product.id})
+
+    # act: два отзыва к товару
+    resp = api_auth_client.post(url, {'mark': 5, 'product_id': product.id}, format='json')
+    assert resp.status_code == HTTP_201_CREATED
+    review_id = resp.json()['id']
+    resp = api_auth_another_client.post(url, {'mark': 2, 'product_id': product.id}, format='json')
+    assert resp.status_code == HTTP_201_CREATED
+
+    # assert
+    resp_json = api_auth_client.get(product_url).json()
+    assert resp_json['review_count'] == 2
+    assert resp_json['mark_sum'] == 7
+    assert resp_json['rating'] == 3.5
+    assert resp_json['marks'] == {'1': 0, '2': 1, '3': 0, '4': 0, '5': 1}
+
+    # act: меняем оценку и товар отзыва
+    review_url = reverse("product-reviews-detail", kwargs={'pk': review_id})
+    resp = api_auth_client.patch(review_url, {'mark': 4, 'product_id': another_product.id}, format='json')
+    assert resp.status_code == HTTP_200_OK
+
+    # assert
+    resp_json = api_auth_client.get(product_url).json()
+    assert resp_json['review_count'] == 1
+    assert resp_json['marks'] == {'1': 0, '2': 1, '3': 0, '4': 0, '5': 0}
+    resp_json = api_auth_client.get(reverse("products-detail", kwargs={'pk': another_product.id})).json()
+    assert resp_json['review_count'] == 1
+    assert resp_json['rating'] == 4
+    assert resp_json['marks'] == {'1': 0, '2': 0, '3': 0, '4': 1, '5': 0}
+
+    # act: удаляем отзыв
+    resp = api_auth_client.delete(review_url)
+    assert resp.status_code == HTTP_204_NO_CONTENT
+
+    # assert
+    resp_json = api_auth_client.get(reverse("products-detail", kwargs={'pk': another_product.id})).json()
+    assert resp_json['review_count'] == 0
+    assert resp_json['mark_sum'] == 0
+    assert resp_json['rating'] is None
+
+
+@pytest.mark.django_db
+def test_conditional_get_reviews(api_client, api_auth_client, product_factory, django_assert_num_queries):
+    # arrange
+    product = product_factory()
+    url = reverse("product-reviews-list")
+    resp = api_auth_client.post(url, {'mark': 5, 'product_id': product.id}, format='json')
+    review_url = reverse("product-reviews-detail", kwargs={'pk': resp.json()['id']})
+    resp = api_client.get(url)
+    etag, last_modified = resp['ETag'], resp['Last-Modified']
+
+    # act: проверка валидаторов выполняет один агрегирующий запрос без загрузки отзывов
+    with django_assert_num_queries(1):
+        resp = api_client.get(url, HTTP_IF_NONE_MATCH=etag)
+    assert resp.status_code == HTTP_304_NOT_MODIFIED
+    resp = api_client.get(url, HTTP_IF_MODIFIED_SINCE=last_modified)
+    assert resp.status_code == HTTP_304_NOT_MODIFIED
+
+    # act: изменение отзыва меняет ETag списка и отзыва
+    review_etag = api_client.get(review_url)['ETag']
+    api_auth_client.patch(review_url, {'text': 'изменено'}, format='json')
+
+    # assert
+    assert api_client.get(url, HTTP_IF_NONE_MATCH=etag).status_code == HTTP_200_OK
+    assert api_client.get(review_url, HTTP_IF_NONE_MATCH=review_etag).status_code == HTTP_200_OK
+
+    # act: удаление отзыва меняет ETag списка
+    etag = api_client.get(url)['ETag']
+    api_auth_client.delete(review_url)
+
+    # assert
+    assert api_client.get(url, HTTP_IF_NONE_MATCH=etag).status_code == HTTP_200_OK
+    assert api_client.get(review_url).status_code == HTTP_404_NOT_FOUND
+
+
+@pytest.mark.django_db
+def test_export_reviews_ndjson(api_client, review_factory):
+    # arrange
+    reviews = review_factory(_quantity=3)
+    url = reverse("product-reviews-export")
+
+    # act
+    resp = api_client.get(url, {'product': reviews[0].product_id})
+
+    # assert: формат по умолчанию NDJSON
+    assert resp.status_code == HTTP_200_OK
+    rows = [json.loads(line) for line in b''.join(resp.streaming_content).decode().splitlines()]
+    assert [row['id'] for row in rows] == [reviews[0].id]
+    assert rows[0]['product']['id'] == reviews[0].product_id
+    assert rows[0]['creator']['id'] == reviews[0].creator_id
+
+
+@pytest.mark.django_db
+def test_create_review_with_idempotency_key(api_auth_client, product_factory):
+    # arrange
+    product = product_factory()
+    payload = {'mark': 5, 'product_id': product.id}
+    url = reverse("product-reviews-list")
+
+    # act
+    first = api_auth_client.post(url, payload, format='json', HTTP_IDEMPOTENCY_KEY='review-1')
+    repeat = api_auth_client.post(url, payload, format='json', HTTP_IDEMPOTENCY_KEY='review-1')
+
+    # assert: повтор получает сохранённый ответ вместо ошибки уникальности
+    assert first.status_code == repeat.status_code == HTTP_201_CREATED
+    assert repeat.json() == first.json()
+    product.refresh_from_db()
+    assert product.review_count == 1
+
+
+@pytest.mark.django_db
+def test_list_reviews_sparse_fields(api_client, review_factory):
+    # arrange
+    objs = review_factory(_quantity=3)
+    url = reverse("product-reviews-list")
+
+    # act
+    with CaptureQueriesContext(connection) as captured:
+        resp = api_client.get(url, {'fields': 'id,mark,product'})
+
+    # assert: товар заменён его id, лишние колонки и JOIN не выбираются
+    assert resp.status_code == HTTP_200_OK
+    assert resp.json()['results'] == [{'id': obj.id, 'mark': obj.mark, 'product': obj.product_id} for obj in objs]
+    sql = [query['sql'] for query in captured if 'marketplace_review' in query['sql']][-1]
+    assert 'JOIN' not in sql
+    assert '"text"' not in sql
+
+
+@pytest.mark.django_db
+def test_retrieve_review_expand_fields(api_client, review_factory):
+    # arrange
+    obj = review_factory()
+    url = reverse("product-reviews-detail", kwargs={'pk': obj.id})
+
+    # act
+    nested = api_client.get(url, {'fields': 'id,product.title,creator.username'})
+    expanded = api_client.get(url, {'fields': 'product', 'expand': 'product'})
+
+    # assert
+    assert nested.status_code == HTTP_200_OK
+    assert nested.json() == {
+        'id': obj.id, 'product': {'title': obj.product.title}, 'creator': {'username': obj.creator.username}
+    }
+    assert expanded.status_code == HTTP_200_OK
+    assert expanded.json()['product']['description'] == obj.product.description
+    assert len(expanded.json()['product']) == 11
+
+
+@pytest.mark.django_db
+def test_reviews_unknown_sparse_fields(api_client, review_factory):
+    # arrange
+    review_factory()
+    url = reverse("product-reviews-list")
+
+    # act: поле только для записи и несуществующее вложенное поле
+    write_only = api_client.get(url, {'fields': 'id,product_id'})
+    nested = api_client.get(url, {'fields': 'id,product.weight'})
+
+    # assert
+    assert write_only.status_code == HTTP_400_BAD_REQUEST
+    assert write_only.json() == {'fields': ['Unknown field "product_id".']}
+    assert nested.status_code == HTTP_400_BAD_REQUEST
+    assert nested.json() == {'fields': ['Unknown field "product.weight".']}
+
+
+@pytest.mark.django_db
+def test_retrieve_review_with_non_numeric_pk(api_client):
+    resp = api_client.get(reverse("product-reviews-detail", kwargs={'pk': 'abc'}))
+    assert resp.status_code == HTTP_404_NOT_FOUND
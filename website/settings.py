@@ -38,6 +38,7 @@ INSTALLED_APPS = [
     'django.contrib.sessions',
     'django.contrib.messages',
     'django.contrib.staticfiles',
+    'django.contrib.postgres',
 
     'rest_framework',
     'rest_framework.authtoken',
@@ -101,6 +102,39 @@ DATABASES = {
 }
 
 
+# Cache
+# https://docs.djangoproject.com/en/3.2/topics/cache/
+# По умолчанию кеш в памяти процесса. Для общего кеша между процессами задайте, например,
+# CACHE_BACKEND=django.core.cache.backends.memcached.PyMemcacheCache и CACHE_LOCATION=memcached:11211.
+
+CACHES = {
+    'default': {
+        'BACKEND': os.getenv('CACHE_BACKEND', 'django.core.cache.backends.locmem.LocMemCache'),
+        'LOCATION': os.getenv('CACHE_LOCATION', ''),
+    }
+}
+
+
+# Асинхронный приём заказов: POST /api/v1/orders/ ставит заказ в очередь и отвечает 202 всегда,
+# а не только на запросы с заголовком `Prefer: respond-async`. Очередь разбирает команда process_order_tickets.
+
+ORDER_INTAKE_ASYNC = os.getenv('ORDER_INTAKE_ASYNC', '0') == '1'
+
+# Время хранения ответов на запросы создания с заголовком Idempotency-Key, в секундах.
+
+IDEMPOTENCY_KEY_TTL = int(os.getenv('IDEMPOTENCY_KEY_TTL', 24 * 60 * 60))
+
+# Начиная с этой оценки планировщика количество записей в списках заказов и товаров и в интерфейсе
+# администратора не считается через COUNT(*), а возвращается оценкой.
+
+COUNT_ESTIMATE_THRESHOLD = int(os.getenv('COUNT_ESTIMATE_THRESHOLD', 100000))
+
+# Вложенные списки (товары подборки, позиции заказа) в ответах list и retrieve обрезаются до этого числа элементов,
+# полные списки отдаются вложенными ресурсами с пагинацией.
+
+NESTED_LIST_LIMIT = int(os.getenv('NESTED_LIST_LIMIT', 20))
+
+
 # Password validation
 # https://docs.djangoproject.com/en/3.2/ref/settings/#auth-password-validators
 